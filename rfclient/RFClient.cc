@@ -98,8 +98,10 @@ bool RFClient::findInterface(const char *ifName, Interface *dst) {
     return true;
 }
 
-RFClient::RFClient(uint64_t id, const string &address, RouteSource source) {
+RFClient::RFClient(uint64_t id, const string &address, RouteSource source,
+                   uint64_t max_rm_outstanding) {
     this->rm_outstanding = 0;
+    this->max_rm_outstanding = max_rm_outstanding;
     this->id = id;
 
     string id_str = to_string<uint64_t>(id);
@@ -137,7 +139,7 @@ RFClient::RFClient(uint64_t id, const string &address, RouteSource source) {
        bool flow_control = false;
        {
           boost::lock_guard<boost::mutex> lock(this->rm_outstanding_mutex);
-          if (this->rm_outstanding > max_rm_outstanding) {
+          if (this->rm_outstanding >= this->max_rm_outstanding) {
             flow_control = true;
           }
        }
@@ -301,10 +303,25 @@ bool RFClient::process(const string &, const string &, const string &,
                 sendAllInterfaceToControllerRouteMods(vm_port);
                 break;
             case PCT_ROUTEMOD_ACK:
-                syslog(LOG_DEBUG, "Got RouteMod ack (vm_port=%d)", vm_port);
                 {
+                    /* One ack may cover several RouteMods. Acks from an
+                     * rfserver that predates count have none (read as 0),
+                     * and each covers one. */
+                    uint32_t count = config->get_count();
+                    if (count == 0)
+                        count = 1;
+                    syslog(LOG_DEBUG, "Got RouteMod ack (vm_port=%d, count=%d)",
+                           vm_port, count);
                     boost::lock_guard<boost::mutex> lock(this->rm_outstanding_mutex);
-                    --(this->rm_outstanding);
+                    /* Unsigned, so a duplicate or stale ack must not wrap it
+                     * round and stop RouteMods being sent. */
+                    if (count > this->rm_outstanding) {
+                        syslog(LOG_WARNING, "Got ack for %d RouteMods with "
+                               "%lu outstanding", count,
+                               (unsigned long) this->rm_outstanding);
+                        count = this->rm_outstanding;
+                    }
+                    this->rm_outstanding -= count;
                 }
                 break;
             default:
@@ -444,27 +461,31 @@ map<string, Interface> RFClient::load_interfaces() {
 }
 
 void usage(char *name) {
-    printf("usage: %s [-f] [-a <address>] [-i <interface>] [-n <id>]\n\n"
+    printf("usage: %s [-f] [-a <address>] [-i <interface>] [-n <id>] "
+           "[-w <count>]\n\n"
            "RFClient subscribes to kernel updates and pushes these to \n"
            "RFServer for further processing.\n\n"
            "Arguments:\n"
            "  -a <address>      Specify the address for RFServer\n"
            "  -i <interface>    Specify which interface to use for client ID\n"
            "  -f                Use the FPM interface for route updates\n"
-           "  -n <id>           Manually specify client ID in hex\n\n"
+           "  -n <id>           Manually specify client ID in hex\n"
+           "  -w <count>        Send at most count RouteMods without an ack\n"
+           "                    (default %lu)\n\n"
            "  -h                Print Help (this message) and exit\n"
            "  -v                Print the version number and exit\n"
            "\nReport bugs to: https://github.com/routeflow/RouteFlow/issues\n",
-           name);
+           name, (unsigned long) default_max_rm_outstanding);
 }
 
 int main(int argc, char* argv[]) {
     string address = "";  /* Empty means use default. */
     RouteSource route_source = RS_NETLINK;
     uint64_t id = get_interface_id(DEFAULT_RFCLIENT_INTERFACE);
+    uint64_t max_rm_outstanding = default_max_rm_outstanding;
 
     char c;
-    while ((c = getopt (argc, argv, "a:fi:n:hv")) != -1) {
+    while ((c = getopt (argc, argv, "a:fi:n:w:hv")) != -1) {
         switch(c) {
         case 'a':
             address = optarg;
@@ -478,6 +499,13 @@ int main(int argc, char* argv[]) {
         case 'n':
             id = strtol(optarg, NULL, 16);
             break;
+        case 'w':
+            max_rm_outstanding = strtoul(optarg, NULL, 10);
+            if (max_rm_outstanding == 0) {
+                usage(argv[0]);
+                return EXIT_FAILURE;
+            }
+            break;
         case 'h':
             usage(argv[0]);
             return 0;
@@ -491,7 +519,7 @@ int main(int argc, char* argv[]) {
     }
 
     openlog("rfclient", LOG_NDELAY | LOG_NOWAIT | LOG_PID, SYSLOGFACILITY);
-    RFClient s(id, address, route_source);
+    RFClient s(id, address, route_source, max_rm_outstanding);
 
     return 0;
 }
@@ -12,12 +12,14 @@
 #include "FlowTable.hh"
 #include "PortMapper.hh"
 
-const int max_rm_outstanding = 1;
+/* RouteMods sent to RFServer without an ack, unless given with -w. */
+const uint64_t default_max_rm_outstanding = 64;
 
 class RFClient : private RFProtocolFactory, private IPCMessageProcessor,
                  public InterfaceMap {
     public:
-        RFClient(uint64_t id, const string &address, RouteSource);
+        RFClient(uint64_t id, const string &address, RouteSource,
+                 uint64_t max_rm_outstanding);
         bool findInterface(const char *ifName, Interface *dst);
 
     private:
@@ -27,6 +29,7 @@ class RFClient : private RFProtocolFactory, private IPCMessageProcessor,
         SyncQueue<RouteMod> rm_q;
         boost::mutex rm_outstanding_mutex;
         uint64_t rm_outstanding;
+        uint64_t max_rm_outstanding;
         uint64_t id;
 
         boost::mutex ifMutex; /* This guards both of the maps below. */
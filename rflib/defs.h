@@ -12,6 +12,12 @@
 #define RFSERVER_ID "rfserver"
 #define RFPROXY_ID "rfproxy"
 
+/* Whether ZeroMQ IPC uses the compact binary codec, as with IPC_CODEC
+'binary' in defs.py. Peers are sent binary once they have sent it, or before
+they have been heard from if listed in IPC_BINARY_PEERS. */
+#define IPC_BINARY_CODEC false
+#define IPC_BINARY_PEERS { RFSERVER_ID }
+
 #define DEFAULT_RFCLIENT_INTERFACE "eth0"
 
 #define SYSLOGFACILITY LOG_LOCAL7
@@ -1,11 +1,29 @@
 
-IPC_TYPE = 'zeromq'  # options are 'zeromq' or 'mongo'
-DB_TYPE = 'memory'   # options are 'memory' or 'mongo'
+IPC_TYPE = 'zeromq'  # options are 'zeromq', 'shm' or 'mongo'
+DB_TYPE = 'memory'   # options are 'memory', 'memory-native', 'mongo' or
+                     # 'mongo-writebehind'
+IPC_CODEC = 'bson'   # options are 'bson' or 'binary' (zeromq only). The
+                     # C++ services use IPC_BINARY_CODEC in defs.h, see
+                     # IPC_BINARY_PEERS.
+IPC_THREADING = 'std'  # options are 'std' or 'eventlet'
 
 MONGO_ADDRESS = "192.168.10.1:27017"
 MONGO_DB_NAME = "db"
+MONGO_IPC_MODE = 'poll'  # options are 'poll' or 'tailable'
+MONGO_IPC_FLUSH_INTERVAL = 0  # seconds to buffer sends, 0 sends immediately
+MONGO_WRITE_BEHIND_INTERVAL = 1  # seconds between 'mongo-writebehind' flushes
 
 ZEROMQ_ADDRESS =  "tcp://192.168.10.1:25555"
+ZEROMQ_DISPATCH = 'direct'  # options are 'direct' or 'pubsub', eventlet
+                            # services always use 'pubsub'
+ZEROMQ_DISPATCH_QUEUE_SIZE = 1000  # messages queued per 'direct' listener
+ZEROMQ_PEER_HWM = 10000  # messages held for an unreachable peer
+
+# 'shm' uses ZeroMQ for peers that are not on the same host
+SHM_IPC_PATH = "/dev/shm/routeflow"
+SHM_IPC_SIZE = 4 * 1024 * 1024  # bytes in each service's ring
+
+METRICS_SAMPLE = 16  # timers time 1 in every METRICS_SAMPLE calls
 
 RFCLIENT_RFSERVER_CHANNEL = "rfclient<->rfserver"
 RFSERVER_RFPROXY_CHANNEL = "rfserver<->rfproxy"
@@ -18,6 +36,14 @@ RFFPCONF_NAME = "rffpconf"
 
 RFSERVER_ID = "rfserver"
 RFPROXY_ID = "rfproxy"
+# The only sender rfserver accepts a ProfileRequest from, see rfprofile.py
+RFPROFILE_ID = "rfprofile"
+
+# With IPC_CODEC 'binary', peers sent binary before they have been heard
+# from. These must have the binary codec enabled, which the C++ services only
+# have with IPC_BINARY_CODEC in defs.h. Other peers are sent BSON until they
+# send binary themselves.
+IPC_BINARY_PEERS = (RFSERVER_ID,)
 
 DEFAULT_RFCLIENT_INTERFACE = "eth0"
 
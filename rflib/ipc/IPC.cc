@@ -1,5 +1,9 @@
 #include "IPC.h"
 
+#include <cstring>
+
+#include "types/endian.hh"
+
 IPCMessage::~IPCMessage() {
     /* Virtual destructor quells compiler warnings about undefined behaviour */
 }
@@ -11,3 +15,79 @@ string IPCMessageService::get_id() {
 void IPCMessageService::set_id(string id) {
     this->id = id;
 }
+
+void pack_uint8(string &data, uint8_t value) {
+    data.push_back(static_cast<char>(value));
+}
+
+void pack_uint16(string &data, uint16_t value) {
+    value = htons(value);
+    data.append(reinterpret_cast<const char*>(&value), sizeof(value));
+}
+
+void pack_uint32(string &data, uint32_t value) {
+    value = htonl(value);
+    data.append(reinterpret_cast<const char*>(&value), sizeof(value));
+}
+
+void pack_uint64(string &data, uint64_t value) {
+    value = htonll(value);
+    data.append(reinterpret_cast<const char*>(&value), sizeof(value));
+}
+
+void pack_bool(string &data, bool value) {
+    pack_uint8(data, value ? 1 : 0);
+}
+
+void pack_string(string &data, const string &value) {
+    if (value.size() > 0xFFFF) {
+        throw std::length_error("String too long for the binary codec");
+    }
+    pack_uint16(data, value.size());
+    data.append(value);
+}
+
+const char* unpack_bytes(const char* data, size_t size, size_t &offset,
+                         size_t length) {
+    if (offset > size || length > size - offset) {
+        throw BinaryDecodeError("Binary message truncated");
+    }
+    const char* value = data + offset;
+    offset += length;
+    return value;
+}
+
+uint8_t unpack_uint8(const char* data, size_t size, size_t &offset) {
+    return *reinterpret_cast<const uint8_t*>(
+        unpack_bytes(data, size, offset, sizeof(uint8_t)));
+}
+
+uint16_t unpack_uint16(const char* data, size_t size, size_t &offset) {
+    uint16_t value;
+    memcpy(&value, unpack_bytes(data, size, offset, sizeof(value)),
+           sizeof(value));
+    return ntohs(value);
+}
+
+uint32_t unpack_uint32(const char* data, size_t size, size_t &offset) {
+    uint32_t value;
+    memcpy(&value, unpack_bytes(data, size, offset, sizeof(value)),
+           sizeof(value));
+    return ntohl(value);
+}
+
+uint64_t unpack_uint64(const char* data, size_t size, size_t &offset) {
+    uint64_t value;
+    memcpy(&value, unpack_bytes(data, size, offset, sizeof(value)),
+           sizeof(value));
+    return ntohll(value);
+}
+
+bool unpack_bool(const char* data, size_t size, size_t &offset) {
+    return unpack_uint8(data, size, offset) != 0;
+}
+
+string unpack_string(const char* data, size_t size, size_t &offset) {
+    uint16_t length = unpack_uint16(data, size, offset);
+    return string(unpack_bytes(data, size, offset, length), length);
+}
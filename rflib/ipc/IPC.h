@@ -1,7 +1,10 @@
 #ifndef __IPC_H__
 #define __IPC_H__
 
+#include <stdint.h>
+#include <stdexcept>
 #include <string>
+#include <vector>
 
 using namespace std;
 
@@ -23,11 +26,114 @@ class IPCMessage {
         * @return the binary representation of the message in BSON */        
         virtual const char* to_BSON() = 0;
 
+        /** Sets the fields of this message from the compact binary encoding
+        produced by to_binary.
+        @param data the binary data from which to load
+        @param size the length of data in bytes */
+        virtual void from_binary(const char* data, size_t size) = 0;
+
+        /** Creates a compact binary encoding of this message. Unlike BSON it
+        carries no field names, so both ends must use the same RFProtocol.
+        @return the binary representation of the message */
+        virtual string to_binary() = 0;
+
         /**  Get a string representation of the message.
         * @return the string representation of the message */              
         virtual string str() = 0;
 };
 
+/** Raised when binary data ends before the message it encodes. */
+class BinaryDecodeError : public std::runtime_error {
+    public:
+        BinaryDecodeError(const string& msg) : std::runtime_error(msg) { }
+};
+
+/* Helpers used by the generated to_binary/from_binary methods, the same
+encoding as in IPC.py. The pack_ functions append to data. The unpack_
+functions read from the size bytes of data at offset and advance offset past
+the value. Integers are in network byte-order, strings are prefixed with a 16
+bit length and lists with a 32 bit count. */
+void pack_uint8(string &data, uint8_t value);
+void pack_uint16(string &data, uint16_t value);
+void pack_uint32(string &data, uint32_t value);
+void pack_uint64(string &data, uint64_t value);
+void pack_bool(string &data, bool value);
+void pack_string(string &data, const string &value);
+
+uint8_t unpack_uint8(const char* data, size_t size, size_t &offset);
+uint16_t unpack_uint16(const char* data, size_t size, size_t &offset);
+uint32_t unpack_uint32(const char* data, size_t size, size_t &offset);
+uint64_t unpack_uint64(const char* data, size_t size, size_t &offset);
+bool unpack_bool(const char* data, size_t size, size_t &offset);
+string unpack_string(const char* data, size_t size, size_t &offset);
+/** Returns the next length bytes of data */
+const char* unpack_bytes(const char* data, size_t size, size_t &offset,
+                         size_t length);
+
+/** Packs a list of Match, Action or Option, each as its type, the length of
+its value and the value in network byte-order. */
+template <class T>
+void pack_tlvs(string &data, const std::vector<T> &tlvs) {
+    typename std::vector<T>::const_iterator iter;
+
+    pack_uint32(data, tlvs.size());
+    for (iter = tlvs.begin(); iter != tlvs.end(); ++iter) {
+        string value = iter->value_to_binary();
+        pack_uint8(data, iter->getType());
+        pack_uint16(data, value.size());
+        data.append(value);
+    }
+}
+
+/** Unpacks a list of Match, Action or Option. Invalid ones are skipped, as
+in their to_vector. */
+template <class T>
+std::vector<T> unpack_tlvs(const char* data, size_t size, size_t &offset) {
+    std::vector<T> tlvs;
+
+    uint32_t count = unpack_uint32(data, size, offset);
+    for (uint32_t i = 0; i < count; ++i) {
+        uint8_t type = unpack_uint8(data, size, offset);
+        uint16_t length = unpack_uint16(data, size, offset);
+        const char* value = unpack_bytes(data, size, offset, length);
+        T* tlv = T::from_binary(type, reinterpret_cast<const uint8_t*>(value),
+                                length);
+        if (tlv != NULL) {
+            tlvs.push_back(*tlv);
+            delete tlv;
+        }
+    }
+    return tlvs;
+}
+
+/** Packs a list of messages, each prefixed with its 32 bit length. */
+template <class T>
+void pack_messages(string &data, std::vector<T> messages) {
+    typename std::vector<T>::iterator iter;
+
+    pack_uint32(data, messages.size());
+    for (iter = messages.begin(); iter != messages.end(); ++iter) {
+        string payload = iter->to_binary();
+        pack_uint32(data, payload.size());
+        data.append(payload);
+    }
+}
+
+template <class T>
+std::vector<T> unpack_messages(const char* data, size_t size, size_t &offset) {
+    std::vector<T> messages;
+
+    uint32_t count = unpack_uint32(data, size, offset);
+    for (uint32_t i = 0; i < count; ++i) {
+        uint32_t length = unpack_uint32(data, size, offset);
+        const char* payload = unpack_bytes(data, size, offset, length);
+        T msg;
+        msg.from_binary(payload, length);
+        messages.push_back(msg);
+    }
+    return messages;
+}
+
 /** Abstract class for an IPC message factory. 
 A factory is responsible for creating message objects for a given type. */
 class IPCMessageFactory {
@@ -1,6 +1,12 @@
+import struct
+
 import bson
+from bson.binary import Binary
 
 class IPCMessage(object):
+    # Generated messages declare their fields as slots
+    __slots__ = ()
+
     def get_type(self):
         raise NotImplementedError
 
@@ -16,6 +22,136 @@ class IPCMessage(object):
     def to_bson(self):
         return bson.BSON.encode(self.to_dict())
 
+    def from_binary(self, data):
+        """Sets the fields of this message from the compact binary encoding
+        produced by to_binary"""
+        raise NotImplementedError
+
+    def to_binary(self):
+        """Returns a compact binary encoding of this message.
+
+        Fixed size fields are packed first with a per-message struct, followed
+        by strings and lists (see the pack_ functions below). Unlike BSON this
+        carries no field names, so both ends must use the same RFProtocol.
+        """
+        raise NotImplementedError
+
+class LazyMessage(object):
+    """A received message that is only decoded when it is first used.
+
+    get_type() does not decode the payload, nor does re-encoding it in the
+    codec it was received in, so messages that are filtered on their type or
+    forwarded unchanged are never decoded. Any other attribute decodes the
+    payload into msg, an empty message built by the factory, and is looked up
+    on it.
+    """
+    __slots__ = ('_msg', '_payload', '_binary', '_decoded')
+
+    def __init__(self, msg, payload, binary=False):
+        self._msg = msg
+        self._payload = payload
+        self._binary = binary
+        self._decoded = False
+
+    def get_type(self):
+        return self._msg.get_type()
+
+    def get_message(self):
+        """Returns the decoded message"""
+        if not self._decoded:
+            if self._binary:
+                self._msg.from_binary(self._payload)
+            else:
+                self._msg.from_bson(to_bytes(self._payload))
+            self._payload = None
+            self._decoded = True
+        return self._msg
+
+    def __getattr__(self, name):
+        return getattr(self.get_message(), name)
+
+    def __str__(self):
+        return str(self.get_message())
+
+    def to_bson(self):
+        if not self._decoded and not self._binary:
+            return to_bytes(self._payload)
+        return self.get_message().to_bson()
+
+    def to_binary(self):
+        if not self._decoded and self._binary:
+            return to_bytes(self._payload)
+        return self.get_message().to_binary()
+
+def to_bytes(data):
+    """Returns data, a str, buffer or memoryview (e.g. a slice of a received
+    frame), as a str"""
+    if isinstance(data, memoryview):
+        return data.tobytes()
+    return str(data)
+
+# Helpers used by the generated to_binary/from_binary methods. The pack_
+# functions append to a list of strings, the unpack_ functions take the data
+# (a str, buffer or memoryview) and an offset and return (value, new offset).
+_LENGTH = struct.Struct('!H')
+_COUNT = struct.Struct('!I')
+_TLV_HEADER = struct.Struct('!BH')
+
+def pack_string(parts, value):
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    parts.append(_LENGTH.pack(len(value)))
+    parts.append(value)
+
+def unpack_string(data, offset):
+    (length,) = _LENGTH.unpack_from(data, offset)
+    offset += _LENGTH.size
+    return (to_bytes(data[offset:offset + length]), offset + length)
+
+def pack_tlvs(parts, tlvs):
+    """Packs a list of Match, Action or Option dicts"""
+    parts.append(_COUNT.pack(len(tlvs)))
+    for tlv in tlvs:
+        value = tlv['value']
+        parts.append(_TLV_HEADER.pack(tlv['type'], len(value)))
+        parts.append(value)
+
+def unpack_tlvs(data, offset):
+    (count,) = _COUNT.unpack_from(data, offset)
+    offset += _COUNT.size
+    tlvs = []
+    for i in xrange(count):
+        (type_, length) = _TLV_HEADER.unpack_from(data, offset)
+        offset += _TLV_HEADER.size
+        tlvs.append({'type': type_,
+                     'value': Binary(to_bytes(data[offset:offset + length]),
+                                     0)})
+        offset += length
+    return (tlvs, offset)
+
+def pack_messages(parts, cls, dicts):
+    """Packs a list of dicts produced by cls.to_dict"""
+    parts.append(_COUNT.pack(len(dicts)))
+    for d in dicts:
+        msg = cls()
+        msg.from_dict(d)
+        payload = msg.to_binary()
+        parts.append(_COUNT.pack(len(payload)))
+        parts.append(payload)
+
+def unpack_messages(data, offset, cls):
+    (count,) = _COUNT.unpack_from(data, offset)
+    offset += _COUNT.size
+    dicts = []
+    for i in xrange(count):
+        (length,) = _COUNT.unpack_from(data, offset)
+        offset += _COUNT.size
+        msg = cls()
+        msg.from_binary(data[offset:offset + length])
+        dicts.append(msg.to_dict())
+        offset += length
+    return (dicts, offset)
+
 
 class IPCMessageFactory:
     def build_for_type(self, type_):
@@ -1,8 +1,17 @@
-from rflib.defs import IPC_TYPE
+from rflib.defs import IPC_TYPE, IPC_THREADING
 from IPC import IPCRole
 
+if IPC_THREADING == 'eventlet':
+    # Run the IPC workers, and every other thread of the service, as green
+    # threads on one OS thread. This must happen before the IPC backend is
+    # imported, so that ZeroMQIPC picks up eventlet's zmq.
+    import eventlet
+    eventlet.monkey_patch()
+
 if IPC_TYPE == 'zeromq':
     from ZeroMQIPC import buildIPC
+elif IPC_TYPE == 'shm':
+    from ShmIPC import buildIPC
 elif IPC_TYPE == 'mongo':
     from MongoIPC import buildIPC
 else:
@@ -28,13 +37,28 @@ class StdThreading(object):
     name = "StdThreading"
 
 
-def for_server(id_, threading_=StdThreading):
+if IPC_THREADING == 'eventlet':
+    class GreenThreading(object):
+        import eventlet
+        from eventlet.green import threading
+
+        Thread = staticmethod(threading.Thread)
+        Event = staticmethod(threading.Event)
+        sleep = staticmethod(eventlet.sleep)
+        name = "GreenThreading"
+
+    DefaultThreading = GreenThreading
+else:
+    DefaultThreading = StdThreading
+
+
+def for_server(id_, threading_=DefaultThreading):
     return buildIPC(IPCRole.server, id_, threading_)
 
-def for_client(id_, threading_=StdThreading):
+def for_client(id_, threading_=DefaultThreading):
     return buildIPC(IPCRole.client, id_, threading_)
 
-def for_proxy(id_, threading_=StdThreading):
+def for_proxy(id_, threading_=DefaultThreading):
     return buildIPC(IPCRole.proxy, id_, threading_)
 
 
@@ -1,7 +1,14 @@
+import logging
+import time
+import threading
+
 import pymongo as mongo
+from bson.objectid import ObjectId
 
-from rflib.defs import MONGO_ADDRESS, MONGO_DB_NAME
+from rflib.defs import MONGO_ADDRESS, MONGO_DB_NAME, MONGO_IPC_MODE
+from rflib.defs import MONGO_IPC_FLUSH_INTERVAL
 import rflib.ipc.IPC as IPC
+import rflib.metrics as metrics
 
 FROM_FIELD = "from"
 TO_FIELD = "to"
@@ -12,6 +19,30 @@ CONTENT_FIELD = "content"
 # 1 MB for the capped collection
 CC_SIZE = 1048576
 
+# Tailable mode: high-water marks are kept in this collection, one document
+# per (id, channel)
+HWM_COLLECTION = "ipc_hwm"
+HWM_FIELD = "last"
+# Tailable mode: consumed messages are acknowledged after this many messages
+# or seconds, whichever comes first
+ACK_BATCH = 100
+ACK_INTERVAL = 0.05
+
+# Messages are stored as documents rather than sent as payloads, so unlike
+# ZeroMQIPC only messages are counted, not bytes
+IPC_MESSAGES = metrics.counter('ipc_messages_total',
+                               'IPC messages sent and received',
+                               ('direction', 'channel'))
+
+_logger = logging.getLogger(__name__)
+_handler    = logging.StreamHandler()
+_log_format = '%(asctime)s %(name)-12s %(levelname)-8s %(message)s'
+_formatter  = logging.Formatter(_log_format, '%b %d %H:%M:%S')
+_handler.setFormatter(_formatter)
+_logger.addHandler(_handler)
+_logger.propagate = 0
+_logger.setLevel(logging.INFO)
+
 def put_in_envelope(from_, to, msg):
     envelope = {}
 
@@ -42,7 +73,8 @@ def format_address(address):
         raise ValueError, "Invalid address: " + str(address)
             
 class MongoIPCMessageService(IPC.IPCMessageService):
-    def __init__(self, address, db, id_, threading_):
+    def __init__(self, address, db, id_, threading_,
+                 flush_interval=MONGO_IPC_FLUSH_INTERVAL):
         """Construct an IPCMessageService
 
         Args:
@@ -51,26 +83,82 @@ class MongoIPCMessageService(IPC.IPCMessageService):
             id_: is an identifier to allow messages to be directed to the
                 appropriate recipient.
             threading_: thread management interface, see IPCService.py
+            flush_interval: if > 0, sent messages are buffered per channel
+                and inserted together every flush_interval seconds.
         """
         self._db = db
         self.address = format_address(address)
         self._id = id_
         self._producer_connection = mongo.Connection(*self.address)
         self._threading = threading_
+        # channel_id -> collection, created on first use
+        self._channels = {}
+        self._flush_interval = flush_interval
+        self._pending = {}
+        # Only held briefly and never across I/O, so a plain lock is safe
+        # with green threads too
+        self._pending_lock = threading.Lock()
+        if flush_interval > 0:
+            self._threading.Thread(target=self._flush_worker,
+                                   name="ipc-mongo-flush").start()
         
     def listen(self, channel_id, factory, processor, block=True):
-        worker = self._threading.Thread(target=self._listen_worker,
+        if MONGO_IPC_MODE == 'tailable':
+            target = self._tail_worker
+        else:
+            target = self._listen_worker
+        worker = self._threading.Thread(target=target,
                                         args=(channel_id, factory, processor))
         worker.start()
         if block:
             worker.join()
         
     def send(self, channel_id, to, msg):
-        self._create_channel(self._producer_connection, channel_id)
-        collection = self._producer_connection[self._db][channel_id]
-        collection.insert(put_in_envelope(self.get_id(), to, msg))
+        envelope = put_in_envelope(self.get_id(), to, msg)
+        IPC_MESSAGES.labels('send', channel_id).inc()
+        if self._flush_interval <= 0:
+            self._get_channel(channel_id).insert(envelope)
+            return True
+        with self._pending_lock:
+            self._pending.setdefault(channel_id, []).append(envelope)
         return True
 
+    def _flush_worker(self):
+        # The only thread inserting buffered messages, so each channel's
+        # messages are inserted in the order they were sent
+        while True:
+            self._threading.sleep(self._flush_interval)
+            with self._pending_lock:
+                batches = self._pending
+                self._pending = {}
+            for (channel_id, envelopes) in batches.iteritems():
+                try:
+                    self._insert_batch(channel_id, envelopes)
+                except Exception:
+                    _logger.exception("Failed to insert %d messages on %s, "
+                                      "retrying", len(envelopes), channel_id)
+                    with self._pending_lock:
+                        # Ahead of any sent since, so the order is kept
+                        envelopes.extend(self._pending.get(channel_id, ()))
+                        self._pending[channel_id] = envelopes
+
+    def _insert_batch(self, channel_id, envelopes):
+        # insert() sets each envelope's _id, so on a retry those inserted
+        # before the failure are duplicates and skipped
+        try:
+            self._get_channel(channel_id).insert(envelopes,
+                                                 continue_on_error=True)
+        except mongo.errors.DuplicateKeyError:
+            pass
+
+    def _get_channel(self, channel_id):
+        collection = self._channels.get(channel_id)
+        if collection is None:
+            self._create_channel(self._producer_connection, channel_id)
+            collection = self._producer_connection[self._db][channel_id]
+            self._channels[channel_id] = collection
+        return collection
+
     def _listen_worker(self, channel_id, factory, processor):
         connection = mongo.Connection(*self.address)
         self._create_channel(connection, channel_id)
@@ -81,11 +169,78 @@ class MongoIPCMessageService(IPC.IPCMessageService):
         while True:
             for envelope in cursor:
                 msg = take_from_envelope(envelope, factory)
+                IPC_MESSAGES.labels('receive', channel_id).inc()
                 processor.process(envelope[FROM_FIELD], envelope[TO_FIELD], channel_id, msg);
                 collection.update({"_id": envelope["_id"]}, {"$set": {READ_FIELD: True}})
             self._threading.sleep(0.05)
             cursor = collection.find({TO_FIELD: self.get_id(), READ_FIELD: False}, sort=[("_id", mongo.ASCENDING)])
                 
+    def _tail_worker(self, channel_id, factory, processor):
+        """Follows the channel with a tailable cursor instead of polling.
+
+        Consumption is acknowledged in batches with one upsert of a persisted
+        high-water mark, the _id of the last message consumed. ObjectIds from
+        different producers are only ordered by their timestamp, so a message
+        inserted later may have a smaller _id. The cursor is therefore
+        (re)started from the second of the high-water mark, skipping the
+        messages already consumed since then, which are kept in memory. After
+        a restart of the service these are not known, and messages from the
+        high-water mark's second may be processed again.
+        """
+        connection = mongo.Connection(*self.address)
+        self._create_channel(connection, channel_id)
+
+        collection = connection[self._db][channel_id]
+        marks = connection[self._db][HWM_COLLECTION]
+        key = "%s:%s" % (self.get_id(), channel_id)
+        mark = marks.find_one({"_id": key})
+        last = mark[HWM_FIELD] if mark is not None else None
+        # _ids consumed from the second of last onwards
+        seen = set()
+
+        while True:
+            spec = {TO_FIELD: self.get_id()}
+            if last is not None:
+                start = ObjectId.from_datetime(last.generation_time)
+                spec["_id"] = {"$gte": start}
+                seen = set(id_ for id_ in seen if id_ >= start)
+            cursor = collection.find(spec, tailable=True, await_data=True)
+
+            batch = None
+            deadline = time.time() + ACK_INTERVAL
+            count = 0
+            while cursor.alive:
+                try:
+                    envelope = cursor.next()
+                except StopIteration:
+                    # No data before the server's await timeout
+                    envelope = None
+                if envelope is not None and envelope["_id"] not in seen:
+                    msg = take_from_envelope(envelope, factory)
+                    IPC_MESSAGES.labels('receive', channel_id).inc()
+                    processor.process(envelope[FROM_FIELD], envelope[TO_FIELD], channel_id, msg);
+                    seen.add(envelope["_id"])
+                    batch = envelope["_id"]
+                    count += 1
+                if batch is not None and (count >= ACK_BATCH or
+                                          envelope is None or
+                                          time.time() >= deadline):
+                    self._ack_batch(marks, key, batch)
+                    last = batch
+                    batch = None
+                    count = 0
+                    deadline = time.time() + ACK_INTERVAL
+
+            if batch is not None:
+                self._ack_batch(marks, key, batch)
+                last = batch
+            # The cursor dies if the collection is empty or it falls behind
+            # the capped collection, wait before trying again
+            self._threading.sleep(0.05)
+
+    def _ack_batch(self, marks, key, last):
+        marks.update({"_id": key}, {"$set": {HWM_FIELD: last}}, upsert=True)
+
     def _create_channel(self, connection, name):
         db = connection[self._db]
         try:
@@ -60,6 +60,21 @@ const char* PortRegister::to_BSON() {
     return data;
 }
 
+void PortRegister::from_binary(const char* data, size_t size) {
+    size_t offset = 0;
+    set_vm_id(unpack_uint64(data, size, offset));
+    set_vm_port(unpack_uint32(data, size, offset));
+    set_hwaddress(MACAddress(unpack_string(data, size, offset)));
+}
+
+string PortRegister::to_binary() {
+    string data;
+    pack_uint64(data, get_vm_id());
+    pack_uint32(data, get_vm_port());
+    pack_string(data, get_hwaddress().toString());
+    return data;
+}
+
 string PortRegister::str() {
     stringstream ss;
     ss << "PortRegister" << endl;
@@ -73,12 +88,14 @@ PortConfig::PortConfig() {
     set_vm_id(0);
     set_vm_port(0);
     set_operation_id(0);
+    set_count(0);
 }
 
-PortConfig::PortConfig(uint64_t vm_id, uint32_t vm_port, uint32_t operation_id) {
+PortConfig::PortConfig(uint64_t vm_id, uint32_t vm_port, uint32_t operation_id, uint32_t count) {
     set_vm_id(vm_id);
     set_vm_port(vm_port);
     set_operation_id(operation_id);
+    set_count(count);
 }
 
 int PortConfig::get_type() {
@@ -109,11 +126,23 @@ void PortConfig::set_operation_id(uint32_t operation_id) {
     this->operation_id = operation_id;
 }
 
+uint32_t PortConfig::get_count() {
+    return this->count;
+}
+
+void PortConfig::set_count(uint32_t count) {
+    this->count = count;
+}
+
 void PortConfig::from_BSON(const char* data) {
     mongo::BSONObj obj(data);
     set_vm_id(string_to<uint64_t>(obj["vm_id"].String()));
     set_vm_port(string_to<uint32_t>(obj["vm_port"].String()));
     set_operation_id(string_to<uint32_t>(obj["operation_id"].String()));
+    if (obj.hasField("count"))
+        set_count(string_to<uint32_t>(obj["count"].String()));
+    else
+        set_count(0);
 }
 
 const char* PortConfig::to_BSON() {
@@ -121,18 +150,37 @@ const char* PortConfig::to_BSON() {
     _b.append("vm_id", to_string<uint64_t>(get_vm_id()));
     _b.append("vm_port", to_string<uint32_t>(get_vm_port()));
     _b.append("operation_id", to_string<uint32_t>(get_operation_id()));
+    _b.append("count", to_string<uint32_t>(get_count()));
     mongo::BSONObj o = _b.obj();
     char* data = new char[o.objsize()];
     memcpy(data, o.objdata(), o.objsize());
     return data;
 }
 
+void PortConfig::from_binary(const char* data, size_t size) {
+    size_t offset = 0;
+    set_vm_id(unpack_uint64(data, size, offset));
+    set_vm_port(unpack_uint32(data, size, offset));
+    set_operation_id(unpack_uint32(data, size, offset));
+    set_count(unpack_uint32(data, size, offset));
+}
+
+string PortConfig::to_binary() {
+    string data;
+    pack_uint64(data, get_vm_id());
+    pack_uint32(data, get_vm_port());
+    pack_uint32(data, get_operation_id());
+    pack_uint32(data, get_count());
+    return data;
+}
+
 string PortConfig::str() {
     stringstream ss;
     ss << "PortConfig" << endl;
     ss << "  vm_id: " << to_string<uint64_t>(get_vm_id()) << endl;
     ss << "  vm_port: " << to_string<uint32_t>(get_vm_port()) << endl;
     ss << "  operation_id: " << to_string<uint32_t>(get_operation_id()) << endl;
+    ss << "  count: " << to_string<uint32_t>(get_count()) << endl;
     return ss.str();
 }
 
@@ -194,6 +242,21 @@ const char* DatapathPortRegister::to_BSON() {
     return data;
 }
 
+void DatapathPortRegister::from_binary(const char* data, size_t size) {
+    size_t offset = 0;
+    set_ct_id(unpack_uint64(data, size, offset));
+    set_dp_id(unpack_uint64(data, size, offset));
+    set_dp_port(unpack_uint32(data, size, offset));
+}
+
+string DatapathPortRegister::to_binary() {
+    string data;
+    pack_uint64(data, get_ct_id());
+    pack_uint64(data, get_dp_id());
+    pack_uint32(data, get_dp_port());
+    return data;
+}
+
 string DatapathPortRegister::str() {
     stringstream ss;
     ss << "DatapathPortRegister" << endl;
@@ -249,6 +312,19 @@ const char* DatapathDown::to_BSON() {
     return data;
 }
 
+void DatapathDown::from_binary(const char* data, size_t size) {
+    size_t offset = 0;
+    set_ct_id(unpack_uint64(data, size, offset));
+    set_dp_id(unpack_uint64(data, size, offset));
+}
+
+string DatapathDown::to_binary() {
+    string data;
+    pack_uint64(data, get_ct_id());
+    pack_uint64(data, get_dp_id());
+    return data;
+}
+
 string DatapathDown::str() {
     stringstream ss;
     ss << "DatapathDown" << endl;
@@ -327,6 +403,23 @@ const char* VirtualPlaneMap::to_BSON() {
     return data;
 }
 
+void VirtualPlaneMap::from_binary(const char* data, size_t size) {
+    size_t offset = 0;
+    set_vm_id(unpack_uint64(data, size, offset));
+    set_vm_port(unpack_uint32(data, size, offset));
+    set_vs_id(unpack_uint64(data, size, offset));
+    set_vs_port(unpack_uint32(data, size, offset));
+}
+
+string VirtualPlaneMap::to_binary() {
+    string data;
+    pack_uint64(data, get_vm_id());
+    pack_uint32(data, get_vm_port());
+    pack_uint64(data, get_vs_id());
+    pack_uint32(data, get_vs_port());
+    return data;
+}
+
 string VirtualPlaneMap::str() {
     stringstream ss;
     ss << "VirtualPlaneMap" << endl;
@@ -419,6 +512,25 @@ const char* DataPlaneMap::to_BSON() {
     return data;
 }
 
+void DataPlaneMap::from_binary(const char* data, size_t size) {
+    size_t offset = 0;
+    set_ct_id(unpack_uint64(data, size, offset));
+    set_dp_id(unpack_uint64(data, size, offset));
+    set_dp_port(unpack_uint32(data, size, offset));
+    set_vs_id(unpack_uint64(data, size, offset));
+    set_vs_port(unpack_uint32(data, size, offset));
+}
+
+string DataPlaneMap::to_binary() {
+    string data;
+    pack_uint64(data, get_ct_id());
+    pack_uint64(data, get_dp_id());
+    pack_uint32(data, get_dp_port());
+    pack_uint64(data, get_vs_id());
+    pack_uint32(data, get_vs_port());
+    return data;
+}
+
 string DataPlaneMap::str() {
     stringstream ss;
     ss << "DataPlaneMap" << endl;
@@ -441,8 +553,7 @@ RouteMod::RouteMod() {
     set_options(std::vector<Option>());
 }
 
-RouteMod::RouteMod(uint8_t mod, uint64_t id, uint64_t vm_port, uint64_t table, uint64_t group,
-                   std::vector<Match> matches, std::vector<Action> actions, std::vector<Option> options) {
+RouteMod::RouteMod(uint8_t mod, uint64_t id, uint64_t vm_port, uint64_t table, uint64_t group, std::vector<Match> matches, std::vector<Action> actions, std::vector<Option> options) {
     set_mod(mod);
     set_id(id);
     set_vm_port(vm_port);
@@ -561,6 +672,31 @@ const char* RouteMod::to_BSON() {
     return data;
 }
 
+void RouteMod::from_binary(const char* data, size_t size) {
+    size_t offset = 0;
+    set_mod(unpack_uint8(data, size, offset));
+    set_id(unpack_uint64(data, size, offset));
+    set_vm_port(unpack_uint64(data, size, offset));
+    set_table(unpack_uint64(data, size, offset));
+    set_group(unpack_uint64(data, size, offset));
+    set_matches(unpack_tlvs<Match>(data, size, offset));
+    set_actions(unpack_tlvs<Action>(data, size, offset));
+    set_options(unpack_tlvs<Option>(data, size, offset));
+}
+
+string RouteMod::to_binary() {
+    string data;
+    pack_uint8(data, get_mod());
+    pack_uint64(data, get_id());
+    pack_uint64(data, get_vm_port());
+    pack_uint64(data, get_table());
+    pack_uint64(data, get_group());
+    pack_tlvs(data, get_matches());
+    pack_tlvs(data, get_actions());
+    pack_tlvs(data, get_options());
+    return data;
+}
+
 string RouteMod::str() {
     stringstream ss;
     ss << "RouteMod" << endl;
@@ -568,8 +704,145 @@ string RouteMod::str() {
     ss << "  id: " << to_string<uint64_t>(get_id()) << endl;
     ss << "  vm_port: " << to_string<uint64_t>(get_vm_port()) << endl;
     ss << "  table: " << to_string<uint64_t>(get_table()) << endl;
+    ss << "  group: " << to_string<uint64_t>(get_group()) << endl;
     ss << "  matches: " << MatchList::to_BSON(get_matches()) << endl;
     ss << "  actions: " << ActionList::to_BSON(get_actions()) << endl;
     ss << "  options: " << OptionList::to_BSON(get_options()) << endl;
     return ss.str();
 }
+
+RouteModBatch::RouteModBatch() {
+    set_routemods(std::vector<RouteMod>());
+}
+
+RouteModBatch::RouteModBatch(std::vector<RouteMod> routemods) {
+    set_routemods(routemods);
+}
+
+int RouteModBatch::get_type() {
+    return ROUTE_MOD_BATCH;
+}
+
+std::vector<RouteMod> RouteModBatch::get_routemods() {
+    return this->routemods;
+}
+
+void RouteModBatch::set_routemods(std::vector<RouteMod> routemods) {
+    this->routemods = routemods;
+}
+
+void RouteModBatch::add_routemod(const RouteMod& routemod) {
+    this->routemods.push_back(routemod);
+}
+
+void RouteModBatch::from_BSON(const char* data) {
+    mongo::BSONObj obj(data);
+    set_routemods(RouteModList::to_vector(obj["routemods"].Array()));
+}
+
+const char* RouteModBatch::to_BSON() {
+    mongo::BSONObjBuilder _b;
+    _b.appendArray("routemods", RouteModList::to_BSON(get_routemods()));
+    mongo::BSONObj o = _b.obj();
+    char* data = new char[o.objsize()];
+    memcpy(data, o.objdata(), o.objsize());
+    return data;
+}
+
+void RouteModBatch::from_binary(const char* data, size_t size) {
+    size_t offset = 0;
+    set_routemods(unpack_messages<RouteMod>(data, size, offset));
+}
+
+string RouteModBatch::to_binary() {
+    string data;
+    pack_messages(data, get_routemods());
+    return data;
+}
+
+string RouteModBatch::str() {
+    stringstream ss;
+    ss << "RouteModBatch" << endl;
+    ss << "  routemods: " << RouteModList::to_BSON(get_routemods()) << endl;
+    return ss.str();
+}
+
+ProfileRequest::ProfileRequest() {
+    set_duration(0);
+}
+
+ProfileRequest::ProfileRequest(uint32_t duration) {
+    set_duration(duration);
+}
+
+int ProfileRequest::get_type() {
+    return PROFILE_REQUEST;
+}
+
+uint32_t ProfileRequest::get_duration() {
+    return this->duration;
+}
+
+void ProfileRequest::set_duration(uint32_t duration) {
+    this->duration = duration;
+}
+
+void ProfileRequest::from_BSON(const char* data) {
+    mongo::BSONObj obj(data);
+    set_duration(string_to<uint32_t>(obj["duration"].String()));
+}
+
+const char* ProfileRequest::to_BSON() {
+    mongo::BSONObjBuilder _b;
+    _b.append("duration", to_string<uint32_t>(get_duration()));
+    mongo::BSONObj o = _b.obj();
+    char* data = new char[o.objsize()];
+    memcpy(data, o.objdata(), o.objsize());
+    return data;
+}
+
+void ProfileRequest::from_binary(const char* data, size_t size) {
+    size_t offset = 0;
+    set_duration(unpack_uint32(data, size, offset));
+}
+
+string ProfileRequest::to_binary() {
+    string data;
+    pack_uint32(data, get_duration());
+    return data;
+}
+
+string ProfileRequest::str() {
+    stringstream ss;
+    ss << "ProfileRequest" << endl;
+    ss << "  duration: " << to_string<uint32_t>(get_duration()) << endl;
+    return ss.str();
+}
+
+namespace RouteModList {
+    mongo::BSONArray to_BSON(std::vector<RouteMod> list) {
+        std::vector<RouteMod>::iterator iter;
+        mongo::BSONArrayBuilder builder;
+
+        for (iter = list.begin(); iter != list.end(); ++iter) {
+            const char* data = iter->to_BSON();
+            builder.append(mongo::BSONObj(data).getOwned());
+            delete[] data;
+        }
+
+        return builder.arr();
+    }
+
+    std::vector<RouteMod> to_vector(std::vector<mongo::BSONElement> array) {
+        std::vector<mongo::BSONElement>::iterator iter;
+        std::vector<RouteMod> list;
+
+        for (iter = array.begin(); iter != array.end(); ++iter) {
+            RouteMod msg;
+            msg.from_BSON(iter->Obj().objdata());
+            list.push_back(msg);
+        }
+
+        return list;
+    }
+}
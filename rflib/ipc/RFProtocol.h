@@ -18,7 +18,9 @@ enum {
 	DATAPATH_DOWN,
 	VIRTUAL_PLANE_MAP,
 	DATA_PLANE_MAP,
-	ROUTE_MOD
+	ROUTE_MOD,
+	ROUTE_MOD_BATCH,
+	PROFILE_REQUEST
 };
 
 class PortRegister : public IPCMessage {
@@ -38,6 +40,8 @@ class PortRegister : public IPCMessage {
         virtual int get_type();
         virtual void from_BSON(const char* data);
         virtual const char* to_BSON();
+        virtual void from_binary(const char* data, size_t size);
+        virtual string to_binary();
         virtual string str();
 
     private:
@@ -49,7 +53,7 @@ class PortRegister : public IPCMessage {
 class PortConfig : public IPCMessage {
     public:
         PortConfig();
-        PortConfig(uint64_t vm_id, uint32_t vm_port, uint32_t operation_id);
+        PortConfig(uint64_t vm_id, uint32_t vm_port, uint32_t operation_id, uint32_t count);
 
         uint64_t get_vm_id();
         void set_vm_id(uint64_t vm_id);
@@ -60,15 +64,21 @@ class PortConfig : public IPCMessage {
         uint32_t get_operation_id();
         void set_operation_id(uint32_t operation_id);
 
+        uint32_t get_count();
+        void set_count(uint32_t count);
+
         virtual int get_type();
         virtual void from_BSON(const char* data);
         virtual const char* to_BSON();
+        virtual void from_binary(const char* data, size_t size);
+        virtual string to_binary();
         virtual string str();
 
     private:
         uint64_t vm_id;
         uint32_t vm_port;
         uint32_t operation_id;
+        uint32_t count;
 };
 
 class DatapathPortRegister : public IPCMessage {
@@ -88,6 +98,8 @@ class DatapathPortRegister : public IPCMessage {
         virtual int get_type();
         virtual void from_BSON(const char* data);
         virtual const char* to_BSON();
+        virtual void from_binary(const char* data, size_t size);
+        virtual string to_binary();
         virtual string str();
 
     private:
@@ -110,6 +122,8 @@ class DatapathDown : public IPCMessage {
         virtual int get_type();
         virtual void from_BSON(const char* data);
         virtual const char* to_BSON();
+        virtual void from_binary(const char* data, size_t size);
+        virtual string to_binary();
         virtual string str();
 
     private:
@@ -137,6 +151,8 @@ class VirtualPlaneMap : public IPCMessage {
         virtual int get_type();
         virtual void from_BSON(const char* data);
         virtual const char* to_BSON();
+        virtual void from_binary(const char* data, size_t size);
+        virtual string to_binary();
         virtual string str();
 
     private:
@@ -169,6 +185,8 @@ class DataPlaneMap : public IPCMessage {
         virtual int get_type();
         virtual void from_BSON(const char* data);
         virtual const char* to_BSON();
+        virtual void from_binary(const char* data, size_t size);
+        virtual string to_binary();
         virtual string str();
 
     private:
@@ -182,8 +200,7 @@ class DataPlaneMap : public IPCMessage {
 class RouteMod : public IPCMessage {
     public:
         RouteMod();
-        RouteMod(uint8_t mod, uint64_t id, uint64_t vm_port, uint64_t table, uint64_t group,
-                 std::vector<Match> matches, std::vector<Action> actions, std::vector<Option> options);
+        RouteMod(uint8_t mod, uint64_t id, uint64_t vm_port, uint64_t table, uint64_t group, std::vector<Match> matches, std::vector<Action> actions, std::vector<Option> options);
 
         uint8_t get_mod();
         void set_mod(uint8_t mod);
@@ -215,6 +232,8 @@ class RouteMod : public IPCMessage {
         virtual int get_type();
         virtual void from_BSON(const char* data);
         virtual const char* to_BSON();
+        virtual void from_binary(const char* data, size_t size);
+        virtual string to_binary();
         virtual string str();
 
     private:
@@ -228,4 +247,48 @@ class RouteMod : public IPCMessage {
         std::vector<Option> options;
 };
 
+class RouteModBatch : public IPCMessage {
+    public:
+        RouteModBatch();
+        RouteModBatch(std::vector<RouteMod> routemods);
+
+        std::vector<RouteMod> get_routemods();
+        void set_routemods(std::vector<RouteMod> routemods);
+        void add_routemod(const RouteMod& routemod);
+
+        virtual int get_type();
+        virtual void from_BSON(const char* data);
+        virtual const char* to_BSON();
+        virtual void from_binary(const char* data, size_t size);
+        virtual string to_binary();
+        virtual string str();
+
+    private:
+        std::vector<RouteMod> routemods;
+};
+
+class ProfileRequest : public IPCMessage {
+    public:
+        ProfileRequest();
+        ProfileRequest(uint32_t duration);
+
+        uint32_t get_duration();
+        void set_duration(uint32_t duration);
+
+        virtual int get_type();
+        virtual void from_BSON(const char* data);
+        virtual const char* to_BSON();
+        virtual void from_binary(const char* data, size_t size);
+        virtual string to_binary();
+        virtual string str();
+
+    private:
+        uint32_t duration;
+};
+
+namespace RouteModList {
+    mongo::BSONArray to_BSON(std::vector<RouteMod> list);
+    std::vector<RouteMod> to_vector(std::vector<mongo::BSONElement> array);
+}
+
 #endif /* __RFPROTOCOL_H__ */
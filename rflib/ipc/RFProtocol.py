@@ -1,9 +1,13 @@
+import struct
+
 import bson
 
 from rflib.types.Match import Match
 from rflib.types.Action import Action
 from rflib.types.Option import Option
 from IPC import IPCMessage
+from IPC import pack_string, pack_tlvs, pack_messages
+from IPC import unpack_string, unpack_tlvs, unpack_messages
 
 format_id = lambda dp_id: hex(dp_id).rstrip('L')
 
@@ -14,8 +18,13 @@ DATAPATH_DOWN = 3
 VIRTUAL_PLANE_MAP = 4
 DATA_PLANE_MAP = 5
 ROUTE_MOD = 6
+ROUTE_MOD_BATCH = 7
+PROFILE_REQUEST = 8
 
 class PortRegister(IPCMessage):
+    __slots__ = ("vm_id", "vm_port", "hwaddress",)
+    _fixed = struct.Struct("!QI")
+
     def __init__(self, vm_id=None, vm_port=None, hwaddress=None):
         self.set_vm_id(vm_id)
         self.set_vm_port(vm_port)
@@ -66,6 +75,16 @@ class PortRegister(IPCMessage):
         data["hwaddress"] = str(self.get_hwaddress())
         return data
 
+    def from_binary(self, data):
+        (self.vm_id, self.vm_port,) = self._fixed.unpack_from(data, 0)
+        offset = self._fixed.size
+        (self.hwaddress, offset) = unpack_string(data, offset)
+
+    def to_binary(self):
+        parts = [self._fixed.pack(self.vm_id, self.vm_port)]
+        pack_string(parts, self.hwaddress)
+        return "".join(parts)
+
     def __str__(self):
         s = "PortRegister\n"
         s += "  vm_id: " + format_id(self.get_vm_id()) + "\n"
@@ -74,10 +93,14 @@ class PortRegister(IPCMessage):
         return s
 
 class PortConfig(IPCMessage):
-    def __init__(self, vm_id=None, vm_port=None, operation_id=None):
+    __slots__ = ("vm_id", "vm_port", "operation_id", "count",)
+    _fixed = struct.Struct("!QIII")
+
+    def __init__(self, vm_id=None, vm_port=None, operation_id=None, count=None):
         self.set_vm_id(vm_id)
         self.set_vm_port(vm_port)
         self.set_operation_id(operation_id)
+        self.set_count(count)
 
     def get_type(self):
         return PORT_CONFIG
@@ -112,26 +135,50 @@ class PortConfig(IPCMessage):
         except:
             self.operation_id = 0
 
+    def get_count(self):
+        return self.count
+
+    def set_count(self, count):
+        count = 0 if count is None else count
+        try:
+            self.count = int(count)
+        except:
+            self.count = 0
+
     def from_dict(self, data):
         self.set_vm_id(data["vm_id"])
         self.set_vm_port(data["vm_port"])
         self.set_operation_id(data["operation_id"])
+        self.set_count(data.get("count"))
 
     def to_dict(self):
         data = {}
         data["vm_id"] = str(self.get_vm_id())
         data["vm_port"] = str(self.get_vm_port())
         data["operation_id"] = str(self.get_operation_id())
+        data["count"] = str(self.get_count())
         return data
 
+    def from_binary(self, data):
+        (self.vm_id, self.vm_port, self.operation_id, self.count,) = self._fixed.unpack_from(data, 0)
+        offset = self._fixed.size
+
+    def to_binary(self):
+        parts = [self._fixed.pack(self.vm_id, self.vm_port, self.operation_id, self.count)]
+        return "".join(parts)
+
     def __str__(self):
         s = "PortConfig\n"
         s += "  vm_id: " + format_id(self.get_vm_id()) + "\n"
         s += "  vm_port: " + str(self.get_vm_port()) + "\n"
         s += "  operation_id: " + str(self.get_operation_id()) + "\n"
+        s += "  count: " + str(self.get_count()) + "\n"
         return s
 
 class DatapathPortRegister(IPCMessage):
+    __slots__ = ("ct_id", "dp_id", "dp_port",)
+    _fixed = struct.Struct("!QQI")
+
     def __init__(self, ct_id=None, dp_id=None, dp_port=None):
         self.set_ct_id(ct_id)
         self.set_dp_id(dp_id)
@@ -182,6 +229,14 @@ class DatapathPortRegister(IPCMessage):
         data["dp_port"] = str(self.get_dp_port())
         return data
 
+    def from_binary(self, data):
+        (self.ct_id, self.dp_id, self.dp_port,) = self._fixed.unpack_from(data, 0)
+        offset = self._fixed.size
+
+    def to_binary(self):
+        parts = [self._fixed.pack(self.ct_id, self.dp_id, self.dp_port)]
+        return "".join(parts)
+
     def __str__(self):
         s = "DatapathPortRegister\n"
         s += "  ct_id: " + format_id(self.get_ct_id()) + "\n"
@@ -190,6 +245,9 @@ class DatapathPortRegister(IPCMessage):
         return s
 
 class DatapathDown(IPCMessage):
+    __slots__ = ("ct_id", "dp_id",)
+    _fixed = struct.Struct("!QQ")
+
     def __init__(self, ct_id=None, dp_id=None):
         self.set_ct_id(ct_id)
         self.set_dp_id(dp_id)
@@ -227,6 +285,14 @@ class DatapathDown(IPCMessage):
         data["dp_id"] = str(self.get_dp_id())
         return data
 
+    def from_binary(self, data):
+        (self.ct_id, self.dp_id,) = self._fixed.unpack_from(data, 0)
+        offset = self._fixed.size
+
+    def to_binary(self):
+        parts = [self._fixed.pack(self.ct_id, self.dp_id)]
+        return "".join(parts)
+
     def __str__(self):
         s = "DatapathDown\n"
         s += "  ct_id: " + format_id(self.get_ct_id()) + "\n"
@@ -234,6 +300,9 @@ class DatapathDown(IPCMessage):
         return s
 
 class VirtualPlaneMap(IPCMessage):
+    __slots__ = ("vm_id", "vm_port", "vs_id", "vs_port",)
+    _fixed = struct.Struct("!QIQI")
+
     def __init__(self, vm_id=None, vm_port=None, vs_id=None, vs_port=None):
         self.set_vm_id(vm_id)
         self.set_vm_port(vm_port)
@@ -297,6 +366,14 @@ class VirtualPlaneMap(IPCMessage):
         data["vs_port"] = str(self.get_vs_port())
         return data
 
+    def from_binary(self, data):
+        (self.vm_id, self.vm_port, self.vs_id, self.vs_port,) = self._fixed.unpack_from(data, 0)
+        offset = self._fixed.size
+
+    def to_binary(self):
+        parts = [self._fixed.pack(self.vm_id, self.vm_port, self.vs_id, self.vs_port)]
+        return "".join(parts)
+
     def __str__(self):
         s = "VirtualPlaneMap\n"
         s += "  vm_id: " + format_id(self.get_vm_id()) + "\n"
@@ -306,6 +383,9 @@ class VirtualPlaneMap(IPCMessage):
         return s
 
 class DataPlaneMap(IPCMessage):
+    __slots__ = ("ct_id", "dp_id", "dp_port", "vs_id", "vs_port",)
+    _fixed = struct.Struct("!QQIQI")
+
     def __init__(self, ct_id=None, dp_id=None, dp_port=None, vs_id=None, vs_port=None):
         self.set_ct_id(ct_id)
         self.set_dp_id(dp_id)
@@ -382,6 +462,14 @@ class DataPlaneMap(IPCMessage):
         data["vs_port"] = str(self.get_vs_port())
         return data
 
+    def from_binary(self, data):
+        (self.ct_id, self.dp_id, self.dp_port, self.vs_id, self.vs_port,) = self._fixed.unpack_from(data, 0)
+        offset = self._fixed.size
+
+    def to_binary(self):
+        parts = [self._fixed.pack(self.ct_id, self.dp_id, self.dp_port, self.vs_id, self.vs_port)]
+        return "".join(parts)
+
     def __str__(self):
         s = "DataPlaneMap\n"
         s += "  ct_id: " + format_id(self.get_ct_id()) + "\n"
@@ -392,8 +480,10 @@ class DataPlaneMap(IPCMessage):
         return s
 
 class RouteMod(IPCMessage):
-    def __init__(self, mod=None, id=None, vm_port=None, table=None, group=None,
-                 matches=None, actions=None, options=None):
+    __slots__ = ("mod", "id", "vm_port", "table", "group", "matches", "actions", "options",)
+    _fixed = struct.Struct("!BQQQQ")
+
+    def __init__(self, mod=None, id=None, vm_port=None, table=None, group=None, matches=None, actions=None, options=None):
         self.set_mod(mod)
         self.set_id(id)
         self.set_vm_port(vm_port)
@@ -509,7 +599,7 @@ class RouteMod(IPCMessage):
         data = {}
         data["mod"] = str(self.get_mod())
         data["id"] = str(self.get_id())
-        data["vm_port"] = str(self.get_vm_port)
+        data["vm_port"] = str(self.get_vm_port())
         data["table"] = str(self.get_table())
         data["group"] = str(self.get_group())
         data["matches"] = self.get_matches()
@@ -517,13 +607,27 @@ class RouteMod(IPCMessage):
         data["options"] = self.get_options()
         return data
 
+    def from_binary(self, data):
+        (self.mod, self.id, self.vm_port, self.table, self.group,) = self._fixed.unpack_from(data, 0)
+        offset = self._fixed.size
+        (self.matches, offset) = unpack_tlvs(data, offset)
+        (self.actions, offset) = unpack_tlvs(data, offset)
+        (self.options, offset) = unpack_tlvs(data, offset)
+
+    def to_binary(self):
+        parts = [self._fixed.pack(self.mod, self.id, self.vm_port, self.table, self.group)]
+        pack_tlvs(parts, self.matches)
+        pack_tlvs(parts, self.actions)
+        pack_tlvs(parts, self.options)
+        return "".join(parts)
+
     def __str__(self):
         s = "RouteMod\n"
         s += "  mod: " + str(self.get_mod()) + "\n"
         s += "  id: " + format_id(self.get_id()) + "\n"
-        s += "  vm_port: " + str(self.get_vm_port()) + "\n"
-        s += "  table: " + str(self.get_table()) + "\n"
-        s += "  group: " + str(self.get_group()) + "\n"
+        s += "  vm_port: " + format_id(self.get_vm_port()) + "\n"
+        s += "  table: " + format_id(self.get_table()) + "\n"
+        s += "  group: " + format_id(self.get_group()) + "\n"
         s += "  matches:\n"
         for match in self.get_matches():
             s += "    " + str(Match.from_dict(match)) + "\n"
@@ -534,3 +638,93 @@ class RouteMod(IPCMessage):
         for option in self.get_options():
             s += "    " + str(Option.from_dict(option)) + "\n"
         return s
+
+class RouteModBatch(IPCMessage):
+    __slots__ = ("routemods",)
+    _fixed = struct.Struct("!")
+
+    def __init__(self, routemods=None):
+        self.set_routemods(routemods)
+
+    def get_type(self):
+        return ROUTE_MOD_BATCH
+
+    def get_routemods(self):
+        return self.routemods
+
+    def set_routemods(self, routemods):
+        routemods = list() if routemods is None else routemods
+        try:
+            self.routemods = list(routemods)
+        except:
+            self.routemods = list()
+
+    def add_routemod(self, routemod):
+        self.routemods.append(routemod.to_dict())
+
+    def from_dict(self, data):
+        self.set_routemods(data["routemods"])
+
+    def to_dict(self):
+        data = {}
+        data["routemods"] = self.get_routemods()
+        return data
+
+    def from_binary(self, data):
+        offset = self._fixed.size
+        (self.routemods, offset) = unpack_messages(data, offset, RouteMod)
+
+    def to_binary(self):
+        parts = [self._fixed.pack()]
+        pack_messages(parts, RouteMod, self.routemods)
+        return "".join(parts)
+
+    def __str__(self):
+        s = "RouteModBatch\n"
+        s += "  routemods:\n"
+        for routemod in self.get_routemods():
+            msg = RouteMod()
+            msg.from_dict(routemod)
+            s += "    " + str(msg).rstrip("\n").replace("\n", "\n    ") + "\n"
+        return s
+
+class ProfileRequest(IPCMessage):
+    __slots__ = ("duration",)
+    _fixed = struct.Struct("!I")
+
+    def __init__(self, duration=None):
+        self.set_duration(duration)
+
+    def get_type(self):
+        return PROFILE_REQUEST
+
+    def get_duration(self):
+        return self.duration
+
+    def set_duration(self, duration):
+        duration = 0 if duration is None else duration
+        try:
+            self.duration = int(duration)
+        except:
+            self.duration = 0
+
+    def from_dict(self, data):
+        self.set_duration(data["duration"])
+
+    def to_dict(self):
+        data = {}
+        data["duration"] = str(self.get_duration())
+        return data
+
+    def from_binary(self, data):
+        (self.duration,) = self._fixed.unpack_from(data, 0)
+        offset = self._fixed.size
+
+    def to_binary(self):
+        parts = [self._fixed.pack(self.duration)]
+        return "".join(parts)
+
+    def __str__(self):
+        s = "ProfileRequest\n"
+        s += "  duration: " + str(self.get_duration()) + "\n"
+        return s
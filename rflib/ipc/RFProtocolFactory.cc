@@ -16,6 +16,10 @@ IPCMessage* RFProtocolFactory::buildForType(int type) {
             return new DataPlaneMap();
         case ROUTE_MOD:
             return new RouteMod();
+        case ROUTE_MOD_BATCH:
+            return new RouteModBatch();
+        case PROFILE_REQUEST:
+            return new ProfileRequest();
         default:
             return NULL;
     }
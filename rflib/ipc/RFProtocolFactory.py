@@ -17,3 +17,7 @@ class RFProtocolFactory(IPC.IPCMessageFactory):
             return DataPlaneMap()
         if type_ == ROUTE_MOD:
             return RouteMod()
+        if type_ == ROUTE_MOD_BATCH:
+            return RouteModBatch()
+        if type_ == PROFILE_REQUEST:
+            return ProfileRequest()
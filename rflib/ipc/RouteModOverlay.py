@@ -0,0 +1,56 @@
+from rflib.ipc.RFProtocol import RouteMod
+
+LIST_FIELDS = ("matches", "actions", "options")
+
+def _overlay_list(field):
+    """Returns a property combining a shared prefix with the overlay's items.
+
+    The prefix is the base RouteMod's list as it was when the overlay was
+    created. Only its length is recorded, lists in RouteMod are only ever
+    appended to or replaced, so later additions to the base are not seen.
+    """
+    def get(self):
+        (prefix, length, extra) = self._lists[field]
+        return prefix[:length] + extra
+
+    def set(self, value):
+        self._lists[field] = (value, len(value), [])
+
+    return property(get, set)
+
+
+class RouteModOverlay(RouteMod):
+    """A RouteMod that shares its matches, actions and options with another.
+
+    This replaces copy.deepcopy() when the same RouteMod is sent with small
+    per-port differences. Extra matches, actions and options are kept by the
+    overlay, and the match/action/option dicts of the base are shared rather
+    than copied. Replacing a list (e.g. set_actions) only affects the overlay.
+    """
+
+    matches = _overlay_list("matches")
+    actions = _overlay_list("actions")
+    options = _overlay_list("options")
+
+    def __init__(self, base):
+        self._lists = {}
+        self.mod = base.get_mod()
+        self.id = base.get_id()
+        self.vm_port = base.get_vm_port()
+        self.table = base.get_table()
+        self.group = base.get_group()
+        for field in LIST_FIELDS:
+            if isinstance(base, RouteModOverlay):
+                self._lists[field] = base._lists[field][:2] + (
+                    list(base._lists[field][2]),)
+            else:
+                setattr(self, field, getattr(base, field))
+
+    def add_match(self, match):
+        self._lists["matches"][2].append(match.to_dict())
+
+    def add_action(self, action):
+        self._lists["actions"][2].append(action.to_dict())
+
+    def add_option(self, option):
+        self._lists["options"][2].append(option.to_dict())
@@ -0,0 +1,346 @@
+import errno
+import fcntl
+import logging
+import mmap
+import os
+import Queue
+import select
+import struct
+import threading
+import time
+
+from rflib.defs import *
+import rflib.ipc.IPC as IPC
+import rflib.metrics as metrics
+from rflib.ipc.ZeroMQIPC import ZeroMQIPCMessageService
+
+# Ring header: bytes written (head), bytes read (tail), whether the owner is
+# waiting to be woken, and the owner's pid
+HEADER = struct.Struct("=QQII")
+HEADER_SIZE = 64
+HEAD = struct.Struct("=Q")
+TAIL = struct.Struct("=Q")
+TAIL_OFFSET = 8
+SLEEPING = struct.Struct("=I")
+SLEEPING_OFFSET = 16
+
+# Record header: record length, channel length, address length and type
+# frame, followed by the channel, address and payload. Records are padded to
+# 8 bytes, a zero length marks a jump back to the start of the ring.
+RECORD = struct.Struct("=IHHB3x")
+RECORD_LENGTH = struct.Struct("=I")
+ALIGN = 8
+
+# Seconds the owner sleeps between checks if a wake-up is missed
+WAIT_INTERVAL = 0.1
+# Seconds to wait for space in a full ring before sending with ZeroMQ instead
+SEND_TIMEOUT = 1.0
+# Seconds before checking again whether a peer without a ring has one
+PEER_RECHECK = 1.0
+
+SHM_FALLBACK = metrics.counter('ipc_shm_fallback_total',
+                               'Messages sent with ZeroMQ because the peer\'s '
+                               'ring stayed full for SEND_TIMEOUT',
+                               ('channel',))
+
+_logger = logging.getLogger(__name__)
+_handler    = logging.StreamHandler()
+_log_format = '%(asctime)s %(name)-12s %(levelname)-8s %(message)s'
+_formatter  = logging.Formatter(_log_format, '%b %d %H:%M:%S')
+_handler.setFormatter(_formatter)
+_logger.addHandler(_handler)
+_logger.propagate = 0
+_logger.setLevel(logging.INFO)
+
+def _align(n):
+    return (n + ALIGN - 1) & ~(ALIGN - 1)
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno != errno.ESRCH
+    return True
+
+
+class ShmRing(object):
+    """A ring buffer of messages in a memory-mapped file.
+
+    The process that creates the ring (the owner) is its only reader. Any
+    number of processes may write to it, serialised with flock. The owner
+    sleeps on a FIFO next to the ring, and writers wake it only when it has
+    said it is sleeping. The owner says so holding the flock, so a writer
+    either sees it or has already published its record.
+    """
+
+    def __init__(self, path, size=None):
+        self.path = path
+        self.owner = size is not None
+        if self.owner:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0600)
+            os.ftruncate(fd, HEADER_SIZE + size)
+        else:
+            fd = os.open(path, os.O_RDWR)
+            size = os.fstat(fd).st_size - HEADER_SIZE
+        self.fd = fd
+        self.size = size
+        self.map = mmap.mmap(fd, HEADER_SIZE + size)
+        # Serialises this process's writers, and close() with them
+        self.lock = threading.Lock()
+        self.closed = False
+
+        wake_path = path + ".wake"
+        if self.owner:
+            HEADER.pack_into(self.map, 0, 0, 0, 0, os.getpid())
+            if os.path.exists(wake_path):
+                os.unlink(wake_path)
+            os.mkfifo(wake_path, 0600)
+            # Opened for writing too, so the FIFO never reports EOF
+            self.wake = os.open(wake_path, os.O_RDWR | os.O_NONBLOCK)
+        else:
+            self.pid = HEADER.unpack_from(self.map, 0)[3]
+            self.checked = time.time()
+            try:
+                # Fails with ENXIO if nobody has the FIFO open for reading
+                self.wake = os.open(wake_path, os.O_WRONLY | os.O_NONBLOCK)
+            except OSError:
+                self.map.close()
+                os.close(fd)
+                raise
+
+    def close(self):
+        # Waits for a write in progress, its fds could otherwise be closed or
+        # reused under it
+        with self.lock:
+            self.closed = True
+            self.map.close()
+            os.close(self.fd)
+            os.close(self.wake)
+
+    def alive(self):
+        """Returns whether the owner this ring was opened for still reads it"""
+        if self.owner:
+            return True
+        with self.lock:
+            if self.closed:
+                return False
+            self.checked = time.time()
+            return (HEADER.unpack_from(self.map, 0)[3] == self.pid and
+                    _pid_alive(self.pid))
+
+    def write(self, data):
+        """Appends a record, returns False if the ring has no room for it or
+        has been closed"""
+        n = len(data)
+        with self.lock:
+            if self.closed:
+                return False
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                (head, tail, sleeping, pid) = HEADER.unpack_from(self.map, 0)
+                pos = head % self.size
+                pad = self.size - pos if pos + n > self.size else 0
+                if head + pad + n - tail > self.size:
+                    return False
+                if pad:
+                    RECORD_LENGTH.pack_into(self.map, HEADER_SIZE + pos, 0)
+                    pos = 0
+                start = HEADER_SIZE + pos
+                self.map[start:start + n] = data
+                HEAD.pack_into(self.map, 0, head + pad + n)
+                sleeping = SLEEPING.unpack_from(self.map, SLEEPING_OFFSET)[0]
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+            if sleeping:
+                try:
+                    os.write(self.wake, "\0")
+                except OSError as e:
+                    # A full FIFO already holds a wake-up
+                    if e.errno != errno.EAGAIN:
+                        raise
+        return True
+
+    def read(self):
+        """Returns the next (channel, addr, type_, payload), or None if the
+        ring is empty. Only the owner reads."""
+        (head, tail) = struct.unpack_from("=QQ", self.map, 0)
+        while tail < head:
+            pos = tail % self.size
+            length = RECORD_LENGTH.unpack_from(self.map, HEADER_SIZE + pos)[0]
+            if length == 0:
+                tail += self.size - pos
+                continue
+            start = HEADER_SIZE + pos
+            (length, channel_len, addr_len, type_) = \
+                RECORD.unpack_from(self.map, start)
+            offset = start + RECORD.size
+            channel = self.map[offset:offset + channel_len]
+            offset += channel_len
+            addr = self.map[offset:offset + addr_len]
+            offset += addr_len
+            # Copied out, the space is reused once the tail moves past it
+            payload = self.map[offset:start + length]
+            TAIL.pack_into(self.map, TAIL_OFFSET, tail + _align(length))
+            return (channel, addr, type_, payload)
+        TAIL.pack_into(self.map, TAIL_OFFSET, tail)
+        return None
+
+    def wait(self, timeout):
+        """Sleeps until a writer wakes the owner or timeout seconds pass"""
+        with self.lock:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                SLEEPING.pack_into(self.map, SLEEPING_OFFSET, 1)
+                (head, tail) = struct.unpack_from("=QQ", self.map, 0)
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+        if tail >= head:
+            select.select([self.wake], [], [], timeout)
+            try:
+                os.read(self.wake, 4096)
+            except OSError as e:
+                if e.errno != errno.EAGAIN:
+                    raise
+        SLEEPING.pack_into(self.map, SLEEPING_OFFSET, 0)
+
+    @staticmethod
+    def record(channel, addr, type_, payload):
+        length = RECORD.size + len(channel) + len(addr) + len(payload)
+        return "".join((RECORD.pack(length, len(channel), len(addr), type_),
+                        channel, addr, payload,
+                        "\0" * (_align(length) - length)))
+
+
+class _Frame(object):
+    # The attributes of a zmq.Frame used by _deliver
+    __slots__ = ('bytes', 'buffer')
+
+    def __init__(self, data):
+        self.bytes = data
+        self.buffer = data
+
+
+class ShmIPCMessageService(ZeroMQIPCMessageService):
+    """IPC over shared memory rings between services on the same host.
+
+    Each service owns a ShmRing in SHM_IPC_PATH named after its id. Messages
+    to a peer with a live ring there are written to it, skipping the TCP
+    stack. Messages to other peers, and from them, use the ZeroMQ transport
+    this extends, so remote and C++ services keep working. Messages from
+    both transports are delivered to a listener by the same worker.
+    """
+
+    def __init__(self, address, path, id_, threading_, bind):
+        ZeroMQIPCMessageService.__init__(self, address, id_, threading_, bind)
+        self._path = path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self._ring = ShmRing(self._ring_path(id_), SHM_IPC_SIZE)
+        # Peer id -> ShmRing, or the time to check again for a ring
+        self._peers = {}
+        self._peers_lock = threading.Lock()
+
+        worker = self._threading.Thread(target=self._shm_worker,
+                                        name="ipc-shm-worker")
+        worker.start()
+
+    def _ring_path(self, id_):
+        return os.path.join(self._path, id_)
+
+    def listen(self, channel_id, factory, processor, block=True):
+        self._ready.wait()
+        # Records from the ring are put on the listener's queue, with 'direct'
+        # dispatch so are ZeroMQ messages, otherwise they are forwarded to it.
+        # Either way processor is only called by one worker, in order.
+        queue = Queue.Queue(ZEROMQ_DISPATCH_QUEUE_SIZE)
+        self._queues.setdefault(channel_id, []).append(queue)
+        if not self._direct:
+            forwarder = self._threading.Thread(target=self._sub_forwarder,
+                                               args=(channel_id, queue),
+                                               name=("ipc-channel-" + channel_id + "-forwarder"))
+            forwarder.start()
+        worker = self._threading.Thread(target=self._queue_worker,
+                                        args=(queue, factory, processor),
+                                        name=("ipc-channel-" + channel_id + "-worker"))
+        worker.start()
+        if block:
+            worker.join()
+
+    def send(self, channel_id, to, msg):
+        ring = self._peer_ring(to)
+        if ring is None:
+            return ZeroMQIPCMessageService.send(self, channel_id, to, msg)
+
+        _logger.debug('send on ch %s to %s:\n%s', channel_id, to, msg)
+        type_, payload = self._encode(to, msg)
+        data = ShmRing.record(channel_id, self._id, type_, payload)
+        if len(data) > ring.size // 2:
+            return ZeroMQIPCMessageService.send(self, channel_id, to, msg)
+        deadline = None
+        while not ring.write(data):
+            if not ring.alive():
+                self._drop_peer(to, ring)
+                return ZeroMQIPCMessageService.send(self, channel_id, to, msg)
+            if deadline is None:
+                deadline = time.time() + SEND_TIMEOUT
+            elif time.time() > deadline:
+                _logger.warning("ring for %s full for %gs, sending with "
+                                "ZeroMQ", to, SEND_TIMEOUT)
+                SHM_FALLBACK.labels(channel_id).inc()
+                return ZeroMQIPCMessageService.send(self, channel_id, to, msg)
+            self._threading.sleep(0.001)
+        self._count('send', channel_id, payload)
+        return True
+
+    def _peer_ring(self, to):
+        with self._peers_lock:
+            ring = self._peers.get(to)
+            if isinstance(ring, ShmRing):
+                # The owner may have exited, or restarted and made a new ring
+                if ring.checked + PEER_RECHECK > time.time() or ring.alive():
+                    return ring
+                ring.close()
+            elif ring is not None and ring > time.time():
+                return None
+            try:
+                ring = ShmRing(self._ring_path(to))
+            except (OSError, ValueError, mmap.error):
+                ring = None
+            if ring is not None and not ring.alive():
+                ring.close()
+                ring = None
+            if ring is None:
+                self._peers[to] = time.time() + PEER_RECHECK
+                return None
+            self._peers[to] = ring
+            return ring
+
+    def _drop_peer(self, to, ring):
+        with self._peers_lock:
+            if self._peers.get(to) is ring:
+                self._peers[to] = time.time() + PEER_RECHECK
+                ring.close()
+
+    def _sub_forwarder(self, channel_id, queue):
+        subscriber = self._subscribe(channel_id)
+        while True:
+            queue.put(subscriber.recv_multipart(copy=False))
+
+    def _shm_worker(self):
+        while True:
+            record = self._ring.read()
+            if record is None:
+                self._ring.wait(WAIT_INTERVAL)
+                continue
+            (channel, addr, type_, payload) = record
+            parts = [_Frame(channel), _Frame(addr),
+                     _Frame(struct.pack('B', type_)), _Frame(payload)]
+            # As with 'direct' dispatch a full queue makes the writers wait,
+            # they see the ring fill up
+            for queue in self._queues.get(channel, ()):
+                queue.put(parts)
+
+
+def buildIPC(role, id_, threading_):
+    return ShmIPCMessageService(ZEROMQ_ADDRESS, SHM_IPC_PATH, id_,
+                                threading_, role == IPC.IPCRole.server)
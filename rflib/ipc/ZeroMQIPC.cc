@@ -14,6 +14,11 @@
 #define DEBUG false
 #endif
 
+/* Set in the type frame of messages encoded with to_binary rather than BSON */
+#define BINARY_CODEC_FLAG 0x80
+
+static const char* binaryPeers[] = IPC_BINARY_PEERS;
+
 static void messageString(zmq::message_t &msg, const string &str) {
     size_t len = str.size();
     msg.rebuild(len);
@@ -217,12 +222,37 @@ void ZeroMQIPCMessageService::subWorker(const string &channelId,
             }
 
             if (type.size() == 1) {
-                IPCMessage *msg = factory->buildForType(static_cast<const char*>(type.data())[0]);
-                msg->from_BSON(static_cast<const char*>(payload.data()));
+                uint8_t typeId = static_cast<const uint8_t*>(type.data())[0];
+                bool binary = typeId & BINARY_CODEC_FLAG;
+                std::string from(static_cast<const char*>(addr.data()), addr.size());
+
+                IPCMessage *msg = factory->buildForType(typeId & ~BINARY_CODEC_FLAG);
+                if (msg == NULL) {
+                    std::cerr << "[ZMQIPC subWorker] unknown message type "
+                        << static_cast<int>(typeId) << " from " << from
+                        << std::endl;
+                    continue;
+                }
+                try {
+                    if (binary) {
+                        msg->from_binary(static_cast<const char*>(payload.data()), payload.size());
+                    } else {
+                        msg->from_BSON(static_cast<const char*>(payload.data()));
+                    }
+                } catch (const BinaryDecodeError &err) {
+                    std::cerr << "[ZMQIPC subWorker from_binary] " << err.what()
+                        << " from " << from << std::endl;
+                    delete msg;
+                    continue;
+                }
+
+                {
+                    boost::lock_guard<boost::mutex> lock(peerLock);
+                    peerBinary[from] = binary;
+                }
 
                 if (DEBUG) {
                     std::string ch(static_cast<const char*>(channel.data()), channel.size());
-                    std::string from(static_cast<const char*>(addr.data()), addr.size());
 
                     std::cerr << "[ZMQIPC subWorker subscribe.recv] " << id
                         << " ch " << ch << " from " << from
@@ -286,14 +316,29 @@ bool ZeroMQIPCMessageService::send(const string &channelId, const string &to, IP
         zmq::message_t channel;
         messageString(channel, channelId);
 
-        zmq::message_t type(1);
-        static_cast<char *>(type.data())[0] = (char)msg.get_type();
+        zmq::message_t payload;
+        bool binary = sendBinary(to);
+        if (binary) {
+            try {
+                std::string data = msg.to_binary();
+                payload.rebuild(data.size());
+                memcpy(payload.data(), data.data(), data.size());
+            } catch (const std::length_error &err) {
+                // e.g. a string too long for its length, BSON has no limits
+                binary = false;
+            }
+        }
+        if (!binary) {
+            const char* msgBSONBytes = msg.to_BSON();
+            size_t msgBSONSize = mongo::BSONObj(msgBSONBytes).objsize();
+            payload.rebuild(msgBSONSize);
+            memcpy(payload.data(), msgBSONBytes, msgBSONSize);
+            delete msgBSONBytes;
+        }
 
-        const char* msgBSONBytes = msg.to_BSON();
-        size_t msgBSONSize = mongo::BSONObj(msgBSONBytes).objsize();
-        zmq::message_t payload(msgBSONSize);
-        memcpy(payload.data(), msgBSONBytes, msgBSONSize);
-        delete msgBSONBytes;
+        zmq::message_t type(1);
+        int typeId = msg.get_type() | (binary ? BINARY_CODEC_FLAG : 0);
+        static_cast<char *>(type.data())[0] = (char)typeId;
 
         this->sender->send(destination, ZMQ_SNDMORE);
         this->sender->send(channel, ZMQ_SNDMORE);
@@ -308,6 +353,25 @@ bool ZeroMQIPCMessageService::send(const string &channelId, const string &to, IP
 }
 
 
+/** Returns whether to send binary to a peer: if it last sent binary, or if
+it has not been heard from and is in IPC_BINARY_PEERS. Other peers are sent
+BSON, so those without the binary codec keep working. */
+bool ZeroMQIPCMessageService::sendBinary(const string &to) {
+    if (!IPC_BINARY_CODEC)
+        return false;
+
+    boost::lock_guard<boost::mutex> lock(peerLock);
+    std::map<std::string, bool>::iterator iter = peerBinary.find(to);
+    if (iter != peerBinary.end())
+        return iter->second;
+    for (size_t i = 0; i < sizeof(binaryPeers) / sizeof(binaryPeers[0]); ++i) {
+        if (to == binaryPeers[i])
+            return true;
+    }
+    return false;
+}
+
+
 IPCMessageService* IPCMessageServiceFactory::forServer(const string& server, const string& id) {
     return new ZeroMQIPCMessageService(server, id, true);
 }
@@ -2,6 +2,7 @@
 #define __ZEROMQIPC_H__
 
 #include <boost/thread.hpp>
+#include <map>
 #include <string>
 #include <zmq.hpp>
 
@@ -20,7 +21,11 @@ class ZeroMQIPCMessageService : public IPCMessageService {
         zmq::context_t* ctx;
         zmq::socket_t* sender;
         boost::mutex ready;
+        /* Whether each peer last sent binary, see sendBinary */
+        std::map<std::string, bool> peerBinary;
+        boost::mutex peerLock;
 
+        bool sendBinary(const string &to);
         void mainWorker(const string &serverAddress, bool bind);
         void subWorker(const string &channelId,
             IPCMessageFactory *factory, IPCMessageProcessor *processor);
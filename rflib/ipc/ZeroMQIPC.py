@@ -1,6 +1,10 @@
+import collections
 import logging
+import Queue
 import struct
 import sys
+import threading
+import time
 
 if 'eventlet' in sys.modules:
     from eventlet.green import zmq
@@ -11,10 +15,27 @@ else:
 
 from rflib.defs import *
 import rflib.ipc.IPC as IPC
+import rflib.metrics as metrics
 
 INTERNAL_SEND_CHANNEL = "inproc://sender"
 INTERNAL_PUBLISH_CHANNEL = "inproc://channeler"
 
+# Set in the type frame when the payload uses IPCMessage.to_binary rather
+# than BSON
+BINARY_CODEC_FLAG = 0x80
+
+# A connecting service retries sending to an unreachable peer every
+# RETRY_INTERVAL seconds, giving up on a message after RETRY_ATTEMPTS
+RETRY_INTERVAL = 0.5
+RETRY_ATTEMPTS = 30
+
+IPC_MESSAGES = metrics.counter('ipc_messages_total',
+                               'IPC messages sent and received',
+                               ('direction', 'channel'))
+IPC_BYTES = metrics.counter('ipc_bytes_total',
+                            'Payload bytes of IPC messages sent and received',
+                            ('direction', 'channel'))
+
 _logger = logging.getLogger(__name__)
 _handler    = logging.StreamHandler()
 _log_format = '%(asctime)s %(name)-12s %(levelname)-8s %(message)s'
@@ -25,15 +46,37 @@ _logger.propagate = 0
 _logger.setLevel(logging.INFO)
 
 class ZeroMQIPCMessageService(IPC.IPCMessageService):
-    def __init__(self, address, id_, threading_, bind):
+    """IPC over a ZeroMQ ROUTER socket.
+
+    A single worker owns the external socket. With dispatch 'pubsub' it
+    republishes received messages on an inproc PUB socket that each listen()
+    subscribes to. With 'direct' it puts them straight onto a bounded queue
+    per listener, saving a socket hop per message. Eventlet services always
+    use 'pubsub', as the queues would block the hub.
+    """
+    def __init__(self, address, id_, threading_, bind,
+                 dispatch=ZEROMQ_DISPATCH):
         self._id = id_
         self._threading = threading_
+        self._direct = (dispatch == 'direct' and not __using_eventlet__)
+        # Channel id -> queues of the channel's listeners, filled by the main
+        # worker with 'direct' dispatch only
+        self._queues = {}
         self._ctx = zmq.Context(1)
         self._sender = self._ctx.socket(zmq.PAIR)
         self._sender.bind(INTERNAL_SEND_CHANNEL)
+        # ZeroMQ sockets are not thread safe, so senders take turns
+        self._send_lock = threading.Lock()
 
         self._ready = self._threading.Event()
 
+        # Peer id -> True if the peer last sent us a binary payload. With
+        # IPC_CODEC 'binary' a peer is only sent binary payloads once it has
+        # sent one, or if it is in IPC_BINARY_PEERS, so services without the
+        # binary codec enabled (e.g. C++ ones built without IPC_BINARY_CODEC)
+        # keep receiving BSON.
+        self._peer_binary = {}
+
         worker = self._threading.Thread(target=self._main_worker,
                                         args=(address, bind),
                                         name="ipc-main-worker")
@@ -41,21 +84,45 @@ class ZeroMQIPCMessageService(IPC.IPCMessageService):
 
     def listen(self, channel_id, factory, processor, block=True):
         self._ready.wait()
-        worker = self._threading.Thread(target=self._sub_worker,
-                                        args=(channel_id, factory, processor),
+        if self._direct:
+            queue = Queue.Queue(ZEROMQ_DISPATCH_QUEUE_SIZE)
+            self._queues.setdefault(channel_id, []).append(queue)
+            target = self._queue_worker
+            args = (queue, factory, processor)
+        else:
+            target = self._sub_worker
+            args = (channel_id, factory, processor)
+        worker = self._threading.Thread(target=target, args=args,
                                         name=("ipc-channel-" + channel_id + "-worker"))
         worker.start()
         if block:
             worker.join()
 
     def send(self, channel_id, to, msg):
-        _logger.debug('send on ch %s to %s:\n%s', channel_id, to, str(msg))
-        self._sender.send(to, zmq.SNDMORE)
-        self._sender.send(channel_id, zmq.SNDMORE)
-        self._sender.send(struct.pack('B', msg.get_type()), zmq.SNDMORE)
-        self._sender.send(msg.to_bson())
+        _logger.debug('send on ch %s to %s:\n%s', channel_id, to, msg)
+        type_, payload = self._encode(to, msg)
+        with self._send_lock:
+            self._sender.send(to, zmq.SNDMORE)
+            self._sender.send(channel_id, zmq.SNDMORE)
+            self._sender.send(struct.pack('B', type_), zmq.SNDMORE)
+            self._sender.send(payload)
+        self._count('send', channel_id, payload)
         return True
 
+    def _count(self, direction, channel_id, payload):
+        IPC_MESSAGES.labels(direction, channel_id).inc()
+        IPC_BYTES.labels(direction, channel_id).inc(len(payload))
+
+    def _encode(self, to, msg):
+        if (IPC_CODEC == 'binary' and
+            self._peer_binary.get(to, to in IPC_BINARY_PEERS)):
+            try:
+                return (msg.get_type() | BINARY_CODEC_FLAG, msg.to_binary())
+            except (struct.error, NotImplementedError):
+                # e.g. a value out of range for its field, BSON has no limits
+                pass
+        return (msg.get_type(), msg.to_bson())
+
     def _main_worker(self, address, bind):
         external = self._ctx.socket(zmq.ROUTER)
         external.identity = self._id
@@ -72,8 +139,9 @@ class ZeroMQIPCMessageService(IPC.IPCMessageService):
         mailbox.connect(INTERNAL_SEND_CHANNEL)
 
         # The publisher will publish messages received from the external socket
-        publisher = self._ctx.socket(zmq.PUB)
-        publisher.bind(INTERNAL_PUBLISH_CHANNEL)
+        if not self._direct:
+            publisher = self._ctx.socket(zmq.PUB)
+            publisher.bind(INTERNAL_PUBLISH_CHANNEL)
 
         def handle_external():
             # Copy message from external to publisher... however:
@@ -83,30 +151,91 @@ class ZeroMQIPCMessageService(IPC.IPCMessageService):
             parts = external.recv_multipart(copy=False)
             if len(parts) >= 2:
                 parts[0], parts[1] = parts[1], parts[0]
-                publisher.send_multipart(parts, copy=False)
+                if self._direct:
+                    dispatch(parts)
+                else:
+                    publisher.send_multipart(parts, copy=False)
+
+        def dispatch(parts):
+            # Like PUB/SUB, messages for channels nobody listens on are
+            # dropped
+            for queue in self._queues.get(parts[0].bytes, ()):
+                while True:
+                    try:
+                        queue.put_nowait(parts)
+                        break
+                    except Queue.Full:
+                        # Keep sending while the listener catches up, it
+                        # may itself be blocked sending
+                        if mailbox.poll(10):
+                            handle_mailbox()
+                        retry_pending()
+
+        # Peer -> messages waiting for the peer to become reachable, and
+        # [failed attempts for the first message, time of the next attempt].
+        # Each peer is retried independently, so an unreachable peer does
+        # not hold up messages to the others.
+        pending = {}
+        retries = {}
+
+        def send_external(parts):
+            try:
+                external.send_multipart(parts, copy=False)
+                return True
+            except zmq.ZMQError as e:
+                if e.errno == zmq.EHOSTUNREACH:
+                    return False
+                raise
 
         def handle_mailbox():
             # Copy messages from mailbox to external. Retry if sending fails,
             # as the external socket may take time to connect.
             parts = mailbox.recv_multipart(copy=False)
-            retry = False
-            for attempt in xrange(1 if bind else 30, 0, -1):
-                try:
-                    external.send_multipart(parts, copy=False)
-                    if retry:
-                        _logger.warning("external send succeeded")
-                    break
-                except zmq.ZMQError as e:
-                    if e.errno == zmq.EHOSTUNREACH:
-                        if attempt > 1:
-                            _logger.warning("external send failed, sleeping")
-                            self._threading.sleep(0.5)
-                            retry = True
-                        else:
-                            _logger.error("external send failed, gave up")
-                            pass # dropped unroutable message
-                    else:
-                        raise
+            peer = parts[0].bytes
+            backlog = pending.get(peer)
+            if backlog is not None:
+                if len(backlog) >= ZEROMQ_PEER_HWM:
+                    _logger.error("%d messages waiting for %s, dropped "
+                                  "message", len(backlog), peer)
+                else:
+                    backlog.append(parts)
+            elif not send_external(parts):
+                if bind:
+                    _logger.error("external send failed, gave up")
+                    return # dropped unroutable message
+                _logger.warning("external send to %s failed, retrying", peer)
+                pending[peer] = collections.deque([parts])
+                retries[peer] = [1, time.time() + RETRY_INTERVAL]
+
+        def retry_pending():
+            # Returns the time in seconds until a retry is next due, or None
+            now = time.time()
+            for peer in pending.keys():
+                retry = retries[peer]
+                if retry[1] > now:
+                    continue
+                backlog = pending[peer]
+                while backlog and send_external(backlog[0]):
+                    backlog.popleft()
+                    retry[0] = 0
+                if not backlog:
+                    _logger.warning("external send to %s succeeded", peer)
+                    del pending[peer]
+                    del retries[peer]
+                    continue
+                retry[0] += 1
+                if retry[0] >= RETRY_ATTEMPTS:
+                    _logger.error("external send to %s failed, gave up", peer)
+                    backlog.popleft() # dropped unroutable message
+                    retry[0] = 0
+                    if not backlog:
+                        del pending[peer]
+                        del retries[peer]
+                        continue
+                retry[1] = now + RETRY_INTERVAL
+            if not retries:
+                return None
+            return max(0, min(retry[1] for retry in retries.itervalues()) - now)
 
         def loop_external():
             while True:
@@ -116,6 +245,11 @@ class ZeroMQIPCMessageService(IPC.IPCMessageService):
             while True:
                 handle_mailbox()
 
+        def loop_retry():
+            while True:
+                self._threading.sleep(RETRY_INTERVAL)
+                retry_pending()
+
         self._ready.set()
 
         if __using_eventlet__:
@@ -127,6 +261,8 @@ class ZeroMQIPCMessageService(IPC.IPCMessageService):
                                    name="ipc-main-external").start()
             self._threading.Thread(target=loop_mailbox,
                                    name="ipc-main-mailbox").start()
+            self._threading.Thread(target=loop_retry,
+                                   name="ipc-main-retry").start()
         else:
             # Since we must read and write external from the same OS thread (a
             # ZMQ constraint), and we read mailbox to write external, this code,
@@ -137,7 +273,11 @@ class ZeroMQIPCMessageService(IPC.IPCMessageService):
             poller.register(mailbox, zmq.POLLIN)
 
             while True:
-                ready = dict(poller.poll())
+                wait = retry_pending()
+                if wait is None:
+                    ready = dict(poller.poll())
+                else:
+                    ready = dict(poller.poll(int(wait * 1000) + 1))
 
                 if external in ready and ready[external] == zmq.POLLIN:
                     handle_external()
@@ -147,22 +287,44 @@ class ZeroMQIPCMessageService(IPC.IPCMessageService):
 
 
 
-    def _sub_worker(self, channel_id, factory, processor):
+    def _subscribe(self, channel_id):
         subscriber = self._ctx.socket(zmq.SUB)
         subscriber.subscribe = channel_id
         subscriber.connect(INTERNAL_PUBLISH_CHANNEL)
         _logger.debug('subscribing to ch %s', channel_id)
+        return subscriber
 
+    def _sub_worker(self, channel_id, factory, processor):
+        subscriber = self._subscribe(channel_id)
+        while True:
+            # Frames are not copied, the payload is decoded from the frame's
+            # buffer by LazyMessage if and when the message is used
+            parts = subscriber.recv_multipart(copy=False)
+            self._deliver(parts, factory, processor)
+
+    def _queue_worker(self, queue, factory, processor):
         while True:
-            parts = subscriber.recv_multipart()
-            if len(parts) != 4:
-                continue
-
-            (channel, addr, type_, payload) = parts
-            msg = factory.build_for_type(struct.unpack('B', type_)[0])
-            msg.from_bson(payload)
-            _logger.debug('receive on ch %s from %s:\n%s', channel, addr, str(msg))
-            processor.process(addr, self._id, channel, msg)
+            self._deliver(queue.get(), factory, processor)
+
+    def _deliver(self, parts, factory, processor):
+        """Passes the frames <channel>,<addr>,<type>,<msg> to processor"""
+        if len(parts) != 4:
+            return
+
+        channel = parts[0].bytes
+        addr = parts[1].bytes
+        type_ = struct.unpack('B', parts[2].bytes)[0]
+        binary = bool(type_ & BINARY_CODEC_FLAG)
+        self._peer_binary[addr] = binary
+        msg = factory.build_for_type(type_ & ~BINARY_CODEC_FLAG)
+        if msg is None:
+            _logger.warning('unknown message type %d on ch %s from %s',
+                            type_, channel, addr)
+            return
+        self._count('receive', channel, parts[3].buffer)
+        msg = IPC.LazyMessage(msg, parts[3].buffer, binary)
+        _logger.debug('receive on ch %s from %s:\n%s', channel, addr, msg)
+        processor.process(addr, self._id, channel, msg)
 
 
 def buildIPC(role, id_, threading_):
@@ -1,6 +1,9 @@
 import sys
 
 messages = []
+# Message name -> fields declared "optional". These take their default value
+# when missing from a BSON message, e.g. one sent by an older version.
+optional = {}
 
 # C++
 typesMap = {
@@ -59,6 +62,34 @@ importType = {
 "option[]": "OptionList::to_vector({0}.Array())",
 }
 
+# Compact binary codec, see pyStructType below: packed with the helpers from
+# IPC.h, in the same order as in Python
+binaryPack = {
+"i8": "pack_uint8(data, {0});",
+"i32": "pack_uint32(data, {0});",
+"i64": "pack_uint64(data, {0});",
+"bool": "pack_bool(data, {0});",
+"ip": "pack_string(data, {0}.toString());",
+"mac": "pack_string(data, {0}.toString());",
+"string": "pack_string(data, {0});",
+"match[]": "pack_tlvs(data, {0});",
+"action[]": "pack_tlvs(data, {0});",
+"option[]": "pack_tlvs(data, {0});",
+}
+
+binaryUnpack = {
+"i8": "unpack_uint8(data, size, offset)",
+"i32": "unpack_uint32(data, size, offset)",
+"i64": "unpack_uint64(data, size, offset)",
+"bool": "unpack_bool(data, size, offset)",
+"ip": "IPAddress(IPV4, unpack_string(data, size, offset))",
+"mac": "MACAddress(unpack_string(data, size, offset))",
+"string": "unpack_string(data, size, offset)",
+"match[]": "unpack_tlvs<Match>(data, size, offset)",
+"action[]": "unpack_tlvs<Action>(data, size, offset)",
+"option[]": "unpack_tlvs<Option>(data, size, offset)",
+}
+
 # Python
 pyTypesMap = {
 "match" : "Match",
@@ -105,6 +136,57 @@ pyImportType = {
 "option[]": "list({0})",
 }
 
+# Compact binary codec: fixed size fields are packed with struct, the others
+# with the named helper from IPC.py
+pyStructType = {
+"i8": "B",
+"i32": "I",
+"i64": "Q",
+"bool": "?",
+}
+
+pyPackType = {
+"ip": "string",
+"mac": "string",
+"string": "string",
+"match[]": "tlvs",
+"action[]": "tlvs",
+"option[]": "tlvs",
+}
+
+def addmsgtypes(messages):
+    """Allows lists of other messages (e.g. routemod[]) to be used as fields.
+
+    Each message class can be carried as a list of embedded documents. In C++
+    these are converted by a generated <Name>List namespace, in Python they
+    are stored as the dicts produced by to_dict().
+    """
+    for name, msg in messages:
+        t = name.lower()
+        typesMap[t] = name + "&"
+        typesMap[t + "[]"] = "std::vector<{0}>".format(name)
+        defaultValues[t + "[]"] = "std::vector<{0}>()".format(name)
+        exportType[t + "[]"] = name + "List::to_BSON({0})"
+        importType[t + "[]"] = name + "List::to_vector({0}.Array())"
+        binaryPack[t + "[]"] = "pack_messages(data, {0});"
+        binaryUnpack[t + "[]"] = ("unpack_messages<" + name +
+                                  ">(data, size, offset)")
+        pyTypesMap[t] = name
+        pyDefaultValues[t + "[]"] = "list()"
+        pyExportType[t + "[]"] = "{0}"
+        pyImportType[t + "[]"] = "list({0})"
+        pyPackType[t + "[]"] = "messages"
+
+def listmsgtypes(messages):
+    """Returns the messages that are used as list fields of other messages"""
+    names = dict((name.lower(), name) for name, msg in messages)
+    used = []
+    for name, msg in messages:
+        for t, f in msg:
+            if t[-2:] == "[]" and t[:-2] in names and names[t[:-2]] not in used:
+                used.append(names[t[:-2]])
+    return used
+
 def convmsgtype(string):
     result = ""
     i = 0
@@ -190,6 +272,8 @@ def genH(messages, fname):
         g.addLine("virtual int get_type();")
         g.addLine("virtual void from_BSON(const char* data);")
         g.addLine("virtual const char* to_BSON();")
+        g.addLine("virtual void from_binary(const char* data, size_t size);")
+        g.addLine("virtual string to_binary();")
         g.addLine("virtual string str();")
         g.decreaseIndent();
         g.blankLine()
@@ -201,8 +285,18 @@ def genH(messages, fname):
         g.decreaseIndent();
         g.addLine("};")
         g.blankLine();
+
+    for name in listmsgtypes(messages):
+        g.addLine("namespace {0}List {{".format(name))
+        g.increaseIndent()
+        g.addLine("mongo::BSONArray to_BSON(std::vector<{0}> list);".format(name))
+        g.addLine("std::vector<{0}> to_vector(std::vector<mongo::BSONElement> array);".format(name))
+        g.decreaseIndent()
+        g.addLine("}")
+        g.blankLine();
         
     g.addLine("#endif /* __" + fname.upper() + "_H__ */")
+    g.blankLine()
     return str(g)
     
 def genCPP(messages, fname):
@@ -265,7 +359,17 @@ def genCPP(messages, fname):
         g.addLine("mongo::BSONObj obj(data);")
         for t, f in msg:
             value = "obj[\"{0}\"]".format(f)
-            g.addLine("set_{0}({1});".format(f, importType[t].format(value)))
+            if f in optional.get(name, ()):
+                g.addLine("if (obj.hasField(\"{0}\"))".format(f))
+                g.increaseIndent()
+                g.addLine("set_{0}({1});".format(f, importType[t].format(value)))
+                g.decreaseIndent()
+                g.addLine("else")
+                g.increaseIndent()
+                g.addLine("set_{0}({1});".format(f, defaultValues[t]))
+                g.decreaseIndent()
+            else:
+                g.addLine("set_{0}({1});".format(f, importType[t].format(value)))
         g.decreaseIndent()
         g.addLine("}")
         g.blankLine();
@@ -287,6 +391,29 @@ def genCPP(messages, fname):
         g.addLine("}")
         g.blankLine();
         
+        # Fixed size fields first, as in the Python codec
+        binary = ([(t, f) for t, f in msg if t in pyStructType] +
+                  [(t, f) for t, f in msg if t not in pyStructType])
+
+        g.addLine("void {0}::from_binary(const char* data, size_t size) {{".format(name))
+        g.increaseIndent();
+        g.addLine("size_t offset = 0;")
+        for t, f in binary:
+            g.addLine("set_{0}({1});".format(f, binaryUnpack[t]))
+        g.decreaseIndent()
+        g.addLine("}")
+        g.blankLine();
+
+        g.addLine("string {0}::to_binary() {{".format(name))
+        g.increaseIndent();
+        g.addLine("string data;")
+        for t, f in binary:
+            g.addLine(binaryPack[t].format("get_{0}()".format(f)))
+        g.addLine("return data;")
+        g.decreaseIndent()
+        g.addLine("}")
+        g.blankLine();
+
         g.addLine("string {0}::str() {{".format(name))
         g.increaseIndent();
         g.addLine("stringstream ss;")
@@ -299,6 +426,46 @@ def genCPP(messages, fname):
         g.decreaseIndent()
         g.addLine("}")
         g.blankLine();
+
+    for name in listmsgtypes(messages):
+        g.addLine("namespace {0}List {{".format(name))
+        g.increaseIndent()
+        g.addLine("mongo::BSONArray to_BSON(std::vector<{0}> list) {{".format(name))
+        g.increaseIndent()
+        g.addLine("std::vector<{0}>::iterator iter;".format(name))
+        g.addLine("mongo::BSONArrayBuilder builder;")
+        g.blankLine()
+        g.addLine("for (iter = list.begin(); iter != list.end(); ++iter) {")
+        g.increaseIndent()
+        g.addLine("const char* data = iter->to_BSON();")
+        g.addLine("builder.append(mongo::BSONObj(data).getOwned());")
+        g.addLine("delete[] data;")
+        g.decreaseIndent()
+        g.addLine("}")
+        g.blankLine()
+        g.addLine("return builder.arr();")
+        g.decreaseIndent()
+        g.addLine("}")
+        g.blankLine()
+        g.addLine("std::vector<{0}> to_vector(std::vector<mongo::BSONElement> array) {{".format(name))
+        g.increaseIndent()
+        g.addLine("std::vector<mongo::BSONElement>::iterator iter;")
+        g.addLine("std::vector<{0}> list;".format(name))
+        g.blankLine()
+        g.addLine("for (iter = array.begin(); iter != array.end(); ++iter) {")
+        g.increaseIndent()
+        g.addLine("{0} msg;".format(name))
+        g.addLine("msg.from_BSON(iter->Obj().objdata());")
+        g.addLine("list.push_back(msg);")
+        g.decreaseIndent()
+        g.addLine("}")
+        g.blankLine()
+        g.addLine("return list;")
+        g.decreaseIndent()
+        g.addLine("}")
+        g.decreaseIndent()
+        g.addLine("}")
+        g.blankLine();
         
     return str(g)
 
@@ -357,12 +524,17 @@ def genCPPFactory(messages, fname):
 
 def genPy(messages, fname):
     g = CodeGenerator()
+    msgnames = [name.lower() for name, msg in messages]
 
+    g.addLine("import struct")
+    g.blankLine()
     g.addLine("import bson")    
     g.blankLine()
     for tlv in ["Match","Action","Option"]:
         g.addLine("from rflib.types.{0} import {0}".format(tlv))
     g.addLine("from IPC import IPCMessage")
+    g.addLine("from IPC import pack_string, pack_tlvs, pack_messages")
+    g.addLine("from IPC import unpack_string, unpack_tlvs, unpack_messages")
     g.blankLine()
     g.addLine("format_id = lambda dp_id: hex(dp_id).rstrip('L')")
     g.blankLine()
@@ -373,8 +545,13 @@ def genPy(messages, fname):
         v += 1
     g.blankLine()
     for name, msg in messages:
+        fixed = [(t, f) for t, f in msg if t in pyStructType]
+        packed = [(t, f) for t, f in msg if t not in pyStructType]
         g.addLine("class {0}(IPCMessage):".format(name))
         g.increaseIndent()
+        g.addLine("__slots__ = ({0},)".format(", ".join(["\"{0}\"".format(f) for t, f in msg])))
+        g.addLine("_fixed = struct.Struct(\"!{0}\")".format("".join([pyStructType[t] for t, f in fixed])))
+        g.blankLine()
         g.addLine("def __init__(self, {0}):".format(", ".join([f + "=None" for t, f in msg])))
         g.increaseIndent()
         for t, f in msg:
@@ -420,7 +597,10 @@ def genPy(messages, fname):
         g.addLine("def from_dict(self, data):")
         g.increaseIndent();
         for t, f in msg:
-            g.addLine("self.set_{0}(data[\"{0}\"])".format(f))
+            if f in optional.get(name, ()):
+                g.addLine("self.set_{0}(data.get(\"{0}\"))".format(f))
+            else:
+                g.addLine("self.set_{0}(data[\"{0}\"])".format(f))
         g.decreaseIndent()
         g.blankLine();
         
@@ -434,12 +614,45 @@ def genPy(messages, fname):
         g.decreaseIndent()
         g.blankLine();
         
+        g.addLine("def from_binary(self, data):")
+        g.increaseIndent()
+        if fixed:
+            g.addLine("({0},) = self._fixed.unpack_from(data, 0)".format(", ".join(["self." + f for t, f in fixed])))
+        g.addLine("offset = self._fixed.size")
+        for t, f in packed:
+            if pyPackType[t] == "messages":
+                g.addLine("(self.{0}, offset) = unpack_messages(data, offset, {1})".format(f, pyTypesMap[t[:-2]]))
+            else:
+                g.addLine("(self.{0}, offset) = unpack_{1}(data, offset)".format(f, pyPackType[t]))
+        g.decreaseIndent()
+        g.blankLine();
+
+        g.addLine("def to_binary(self):")
+        g.increaseIndent()
+        g.addLine("parts = [self._fixed.pack({0})]".format(", ".join(["self." + f for t, f in fixed])))
+        for t, f in packed:
+            if pyPackType[t] == "messages":
+                g.addLine("pack_messages(parts, {0}, self.{1})".format(pyTypesMap[t[:-2]], f))
+            else:
+                g.addLine("pack_{0}(parts, self.{1})".format(pyPackType[t], f))
+        g.addLine("return \"\".join(parts)")
+        g.decreaseIndent()
+        g.blankLine();
+
         g.addLine("def __str__(self):")
         g.increaseIndent();
         g.addLine("s = \"{0}\\n\"".format(name))
         for t, f in msg:
             value = "self.get_{0}()".format(f)
-            if t[-2:] == "[]":
+            if t[-2:] == "[]" and t[:-2] in msgnames:
+                g.addLine("s += \"  {0}:\\n\"".format(f))
+                g.addLine("for {0} in {1}:".format(t[:-2], value))
+                g.increaseIndent()
+                g.addLine("msg = {0}()".format(pyTypesMap[t[:-2]]))
+                g.addLine("msg.from_dict({0})".format(t[:-2]))
+                g.addLine("s += \"    \" + str(msg).rstrip(\"\\n\").replace(\"\\n\", \"\\n    \") + \"\\n\"")
+                g.decreaseIndent()
+            elif t[-2:] == "[]":
                 g.addLine("s += \"  {0}:\\n\"".format(f))
                 g.addLine("for {0} in {1}:".format(t[:-2], value))
                 g.increaseIndent()
@@ -493,13 +706,17 @@ for line in lines:
     elif len(parts) == 1:
         currentMessage = parts[0]
         messages.append((currentMessage, []))
-    elif len(parts) == 2:
+    elif len(parts) == 2 or (len(parts) == 3 and parts[2] == "optional"):
         if currentMessage is None:
             print "Error: message not declared"
         messages[-1][1].append((parts[0], parts[1]))
+        if len(parts) == 3:
+            optional.setdefault(currentMessage, set()).add(parts[1])
     else:
         print "Error: invalid line"
 
+addmsgtypes(messages)
+
 f = open(fname + ".h", "w")
 f.write(genH(messages, fname))
 f.close()
@@ -0,0 +1,303 @@
+"""Counters, gauges and histograms for instrumenting the services.
+
+Metrics are registered on REGISTRY when their module is imported, and
+serve() exposes them over HTTP in the Prometheus text format:
+
+    ROUTEMODS = metrics.counter('rfserver_routemods_total',
+                                'RouteMods translated', ('translator',))
+    ROUTEMODS.labels('DefaultRouteModTranslator').inc(len(rms))
+
+Updates are cheap enough for the hot path. Histograms bucket values
+HDR-style, with a fixed number of linear sub-buckets per power of two, so
+recording one needs no search. Timing every call would still cost two
+clock reads, so timers only time 1 in every METRICS_SAMPLE calls, see
+Histogram.start().
+"""
+import BaseHTTPServer
+import threading
+import time
+
+from rflib.defs import METRICS_SAMPLE
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Each power of two is split into 2 ** SUB_BITS buckets, so a value is
+# recorded to within 25%
+SUB_BITS = 2
+SUB_BUCKETS = 1 << SUB_BITS
+
+
+def _bucket_of(v):
+    if v < SUB_BUCKETS:
+        return v
+    shift = v.bit_length() - SUB_BITS - 1
+    return (shift << SUB_BITS) + (v >> shift)
+
+def _bucket_bound(i):
+    """Returns the smallest value above bucket i"""
+    if i < SUB_BUCKETS:
+        return i + 1
+    shift = (i >> SUB_BITS) - 1
+    return ((i & (SUB_BUCKETS - 1)) + SUB_BUCKETS + 1) << shift
+
+def _escape(value):
+    return (str(value).replace('\\', r'\\').replace('\n', r'\n')
+            .replace('"', r'\"'))
+
+def _format_labels(names, values):
+    return ",".join('%s="%s"' % (name, _escape(value))
+                    for (name, value) in zip(names, values))
+
+def _series(name, labels):
+    if labels:
+        return "%s{%s}" % (name, labels)
+    return name
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+class CounterValue(object):
+    __slots__ = ('value', 'lock')
+
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, n=1):
+        with self.lock:
+            self.value += n
+
+    def samples(self, name, labels):
+        yield (_series(name, labels), self.value)
+
+
+class GaugeValue(object):
+    __slots__ = ('value', 'function')
+
+    def __init__(self):
+        self.value = 0
+        self.function = None
+
+    def set(self, value):
+        self.value = value
+
+    def set_function(self, function):
+        """Reads the gauge from function() when exposed, e.g. a queue size"""
+        self.function = function
+
+    def samples(self, name, labels):
+        if self.function is not None:
+            yield (_series(name, labels), self.function())
+        else:
+            yield (_series(name, labels), self.value)
+
+
+class HistogramValue(object):
+    __slots__ = ('unit', 'sample', 'calls', 'buckets', 'count', 'sum',
+                 'lock')
+
+    def __init__(self, unit, sample):
+        self.unit = unit
+        self.sample = sample
+        self.calls = 0
+        self.buckets = []
+        self.count = 0
+        self.sum = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        # Timers use the wall clock, which may step back between start()
+        # and stop()
+        value = max(value, 0)
+        i = _bucket_of(int(value / self.unit))
+        with self.lock:
+            if i >= len(self.buckets):
+                self.buckets.extend([0] * (i + 1 - len(self.buckets)))
+            self.buckets[i] += 1
+            self.count += 1
+            self.sum += value
+
+    def sampled(self):
+        """Returns True for 1 in every sample calls"""
+        # Unlocked, a lost update only shifts which call is sampled
+        self.calls += 1
+        return self.calls % self.sample == 0
+
+    def start(self):
+        """Returns a start time to pass to stop(), or None if this call is
+        not sampled"""
+        if self.sampled():
+            return time.time()
+        return None
+
+    def stop(self, start):
+        if start is not None:
+            self.observe(time.time() - start)
+
+    def samples(self, name, labels):
+        with self.lock:
+            buckets = list(self.buckets)
+            (count, sum_) = (self.count, self.sum)
+        # Only buckets that were used are exposed. Buckets are cumulative
+        # and never emptied, so each series is stable once it appears.
+        prefix = labels + "," if labels else ""
+        cumulative = 0
+        for (i, n) in enumerate(buckets):
+            if n:
+                cumulative += n
+                le = "%.6g" % (_bucket_bound(i) * self.unit)
+                yield (_series(name + "_bucket", prefix + 'le="%s"' % le),
+                       cumulative)
+        yield (_series(name + "_bucket", prefix + 'le="+Inf"'), count)
+        yield (_series(name + "_sum", labels), sum_)
+        yield (_series(name + "_count", labels), count)
+
+
+class Metric(object):
+    """A metric family, with one value per combination of label values"""
+
+    type_ = None
+
+    def __init__(self, name, help_, labelnames=()):
+        self.name = name
+        self.help = help_
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def _new_value(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        """Returns the value for these label values, creating it if needed.
+
+        Callers on the hot path may keep the returned value to skip this
+        lookup.
+        """
+        value = self.values.get(values)
+        if value is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError("%s takes labels %s" %
+                                 (self.name, self.labelnames))
+            with self.lock:
+                value = self.values.setdefault(values, self._new_value())
+        return value
+
+    def __getattr__(self, name):
+        # Unlabelled metrics are used directly, e.g. metric.inc()
+        if self.labelnames or name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.labels(), name)
+
+    def expose(self):
+        lines = ["# HELP %s %s" % (self.name, self.help.replace('\n', ' ')),
+                 "# TYPE %s %s" % (self.name, self.type_)]
+        with self.lock:
+            values = sorted(self.values.items())
+        for (labelvalues, value) in values:
+            labels = _format_labels(self.labelnames, labelvalues)
+            for (series, sample) in value.samples(self.name, labels):
+                lines.append("%s %s" % (series, _format_value(sample)))
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type_ = "counter"
+
+    def _new_value(self):
+        return CounterValue()
+
+
+class Gauge(Metric):
+    type_ = "gauge"
+
+    def _new_value(self):
+        return GaugeValue()
+
+
+class Histogram(Metric):
+    """A histogram of values recorded to multiples of unit, e.g. 1e-6 for
+    times in seconds recorded to the microsecond"""
+
+    type_ = "histogram"
+
+    def __init__(self, name, help_, labelnames=(), unit=1e-6,
+                 sample=METRICS_SAMPLE):
+        Metric.__init__(self, name, help_, labelnames)
+        self.unit = unit
+        self.sample = max(sample, 1)
+
+    def _new_value(self):
+        return HistogramValue(self.unit, self.sample)
+
+
+class Registry(object):
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self, cls, name, *args, **kwargs):
+        """Returns the metric called name, creating it if needed"""
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = cls(name, *args, **kwargs)
+                self.metrics[name] = metric
+            elif not isinstance(metric, cls):
+                raise ValueError("%s is already registered as a %s" %
+                                 (name, metric.type_))
+            return metric
+
+    def expose(self):
+        """Returns every metric in the Prometheus text format"""
+        with self.lock:
+            metrics = sorted(self.metrics.items())
+        return "".join(metric.expose() + "\n" for (name, metric) in metrics)
+
+
+REGISTRY = Registry()
+
+def counter(name, help_, labelnames=()):
+    return REGISTRY.register(Counter, name, help_, labelnames)
+
+def gauge(name, help_, labelnames=()):
+    return REGISTRY.register(Gauge, name, help_, labelnames)
+
+def histogram(name, help_, labelnames=(), unit=1e-6, sample=METRICS_SAMPLE):
+    return REGISTRY.register(Histogram, name, help_, labelnames, unit=unit,
+                             sample=sample)
+
+
+class _MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.registry.expose()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes are too frequent to log
+        pass
+
+
+def serve(port, address='', registry=REGISTRY):
+    """Serves registry at http://address:port/metrics from a daemon thread"""
+    class Handler(_MetricsHandler):
+        pass
+    Handler.registry = registry
+    server = BaseHTTPServer.HTTPServer((address, port), Handler)
+    thread = threading.Thread(target=server.serve_forever,
+                              name="metrics-server")
+    thread.daemon = True
+    thread.start()
+    return server
@@ -0,0 +1,156 @@
+"""A sampling profiler that can be switched on in a running service.
+
+While it runs, the profiler wakes every interval seconds and records the
+stack of each thread whose name matches a pattern. When the window ends it
+writes the stacks in the collapsed format read by flamegraph.pl, and a
+report of the tracked classes' methods by cumulative time. When it is not
+running nothing is sampled or hooked, so it costs nothing.
+
+Only OS threads are seen, under eventlet the green threads all share the
+stacks of one thread.
+"""
+import collections
+import inspect
+import logging
+import os
+import re
+import signal
+import sys
+import threading
+import time
+
+# Seconds between samples
+SAMPLE_INTERVAL = 0.005
+# Methods listed in the report
+REPORT_TOP = 20
+
+
+def _frame_label(code):
+    return "%s (%s:%d)" % (code.co_name, os.path.basename(code.co_filename),
+                           code.co_firstlineno)
+
+
+class SamplingProfiler(object):
+    """Samples the stacks of the threads matching a name pattern.
+
+    track is a list of classes whose methods are reported by cumulative
+    time, i.e. the time spent in a method including the methods it calls.
+    """
+
+    def __init__(self, threads, duration, directory, name, track=(),
+                 interval=SAMPLE_INTERVAL, log=None):
+        self.threads = re.compile(threads)
+        self.duration = duration
+        self.directory = directory
+        self.name = name
+        self.interval = interval
+        self.log = log or logging.getLogger(name)
+        self.lock = threading.Lock()
+        self.running = False
+        # Code object -> "Class.method" of the tracked methods
+        self.tracked = {}
+        for cls in track:
+            for klass in cls.__mro__:
+                for (attr, value) in vars(klass).iteritems():
+                    if inspect.isfunction(value):
+                        self.tracked.setdefault(value.func_code, "%s.%s" %
+                                                (klass.__name__, attr))
+
+    def start(self, duration=None):
+        """Profiles for duration seconds, or the default if None or 0.
+        Returns False if the profiler is already running."""
+        with self.lock:
+            if self.running:
+                return False
+            self.running = True
+        worker = threading.Thread(target=self._run,
+                                  args=(duration or self.duration,),
+                                  name=self.name + "-profiler")
+        worker.daemon = True
+        worker.start()
+        return True
+
+    def _run(self, duration):
+        try:
+            self.log.info("Profiling for %gs" % duration)
+            (stacks, samples) = self.sample(duration)
+            self.write(stacks, samples, duration)
+        except Exception:
+            self.log.exception("Profiling failed")
+        finally:
+            with self.lock:
+                self.running = False
+
+    def sample(self, duration):
+        """Returns {(thread name, stack): samples} and the number of
+        samples taken. Stacks are tuples of code objects, innermost first."""
+        stacks = collections.defaultdict(int)
+        samples = 0
+        names = {}
+        deadline = time.time() + duration
+        while time.time() < deadline:
+            frames = sys._current_frames()
+            if any(ident not in names for ident in frames):
+                names = dict((thread.ident, thread.name)
+                             for thread in threading.enumerate())
+            for (ident, frame) in frames.iteritems():
+                name = names.get(ident)
+                if name is None or not self.threads.match(name):
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(frame.f_code)
+                    frame = frame.f_back
+                stacks[(name, tuple(stack))] += 1
+            # Dropped, so the sampled frames are not kept alive
+            frame = frames = None
+            samples += 1
+            time.sleep(self.interval)
+        return (stacks, samples)
+
+    def write(self, stacks, samples, duration):
+        prefix = os.path.join(self.directory, "%s-profile-%s" %
+                              (self.name, time.strftime("%Y%m%d-%H%M%S")))
+        cumulative = collections.defaultdict(int)
+        own = collections.defaultdict(int)
+        with open(prefix + ".folded", "w") as f:
+            for ((name, stack), count) in sorted(stacks.iteritems()):
+                labels = [_frame_label(code) for code in reversed(stack)]
+                f.write("%s;%s %d\n" % (name, ";".join(labels), count))
+                # Recursive methods only count once per sample
+                for label in set(self.tracked[code] for code in stack
+                                 if code in self.tracked):
+                    cumulative[label] += count
+                if stack and stack[0] in self.tracked:
+                    own[self.tracked[stack[0]]] += count
+
+        # Sampling takes time too, so samples are further apart than interval
+        period = float(duration) / max(samples, 1)
+        top = sorted(cumulative.iteritems(), key=lambda item: -item[1])
+        with open(prefix + ".txt", "w") as f:
+            f.write("%d samples every %.2fms over %gs\n" %
+                    (samples, period * 1000, duration))
+            f.write("%12s %12s  %s\n" % ("cumulative", "self", "method"))
+            for (method, count) in top[:REPORT_TOP]:
+                f.write("%11.3fs %11.3fs  %s\n" %
+                        (count * period, own.get(method, 0) * period, method))
+        self.log.info("Profile written to %s.folded and %s.txt" %
+                      (prefix, prefix))
+
+
+def on_signal(signum, callback):
+    """Calls callback() when signum is received.
+
+    Python only runs signal handlers on the main thread, between bytecodes,
+    so callback must return quickly and the main thread must not block
+    without a timeout (e.g. in Thread.join()), see wait_for(). Must be set
+    up from the main thread.
+    """
+    signal.signal(signum, lambda signum, frame: callback())
+
+
+def wait_for(thread, interval=1):
+    """Waits for thread from the main thread while still running signal
+    handlers, which a join() without a timeout holds off"""
+    while thread.is_alive():
+        thread.join(interval)
@@ -33,8 +33,11 @@ class Action : public TLV {
         bool operator==(const Action& other);
         virtual std::string type_to_string() const;
         virtual mongo::BSONObj to_BSON() const;
+        virtual std::string value_to_binary() const;
 
         static Action* from_BSON(mongo::BSONObj);
+        static Action* from_binary(uint8_t type, const uint8_t* value,
+                                   size_t len);
     private:
         static size_t type_to_length(uint8_t);
         static byte_order type_to_byte_order(uint8_t);
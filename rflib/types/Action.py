@@ -46,7 +46,7 @@ ACTION_BIN = (
 class Action(TLV):
 
     def __init__(self, actionType=None, value=None):
-        super(Action, self).__init__(actionType, self.type_to_bin(actionType, value))
+        self._init_encoded(actionType, value)
 
     def __str__(self):
         return "%s : %s" % (self.type_to_str(self._type), self.get_value())
@@ -148,3 +148,4 @@ class Action(TLV):
 
     def set_value(self, value):
         self._value = Binary(self.type_to_bin(self._type, value), 0)
+        self._dict = None
@@ -92,6 +92,11 @@ mongo::BSONObj Match::to_BSON() const {
     return TLV::TLV_to_BSON(this, order);
 }
 
+std::string Match::value_to_binary() const {
+    byte_order order = type_to_byte_order(type);
+    return TLV::value_to_network(this, order);
+}
+
 /**
  * Constructs a new TLV object based on the given BSONObj. Converts values
  * formatted in network byte-order to host byte-order.
@@ -113,6 +118,23 @@ Match* Match::from_BSON(const mongo::BSONObj bson) {
     return new Match(type, value);
 }
 
+/**
+ * Constructs a new TLV object from the len bytes of value, in network
+ * byte-order, as received by the binary IPC codec.
+ *
+ * It is the caller's responsibility to free the returned object. If the type
+ * is unknown or value too short for it, this method returns NULL.
+ */
+Match* Match::from_binary(uint8_t type, const uint8_t* value, size_t len) {
+    if (type == 0 || len < type_to_length(type))
+        return NULL;
+
+    byte_order order = type_to_byte_order(type);
+    boost::shared_array<uint8_t> arr = TLV::value_from_network(value, len,
+                                                               order);
+    return new Match((MatchType)type, arr);
+}
+
 namespace MatchList {
     mongo::BSONArray to_BSON(const std::vector<Match> list) {
         std::vector<Match>::const_iterator iter;
@@ -33,8 +33,11 @@ class Match : public TLV {
         const ip6_match* getIPv6() const;
         virtual std::string type_to_string() const;
         virtual mongo::BSONObj to_BSON() const;
+        virtual std::string value_to_binary() const;
 
         static Match* from_BSON(mongo::BSONObj);
+        static Match* from_binary(uint8_t type, const uint8_t* value,
+                                  size_t len);
     private:
         static size_t type_to_length(uint8_t);
         static byte_order type_to_byte_order(uint8_t);
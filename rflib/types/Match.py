@@ -27,7 +27,7 @@ typeStrings = {
 
 class Match(TLV):
     def __init__(self, matchType=None, value=None):
-        super(Match, self).__init__(matchType, self.type_to_bin(matchType, value))
+        self._init_encoded(matchType, value)
 
     def __str__(self):
         return "%s : %s" % (self.type_to_str(self._type), self.get_value())
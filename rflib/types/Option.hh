@@ -26,8 +26,11 @@ class Option : public TLV {
         bool operator==(const Option& other);
         virtual std::string type_to_string() const;
         virtual mongo::BSONObj to_BSON() const;
+        virtual std::string value_to_binary() const;
 
         static Option* from_BSON(mongo::BSONObj bson);
+        static Option* from_binary(uint8_t type, const uint8_t* value,
+                                   size_t len);
     private:
         static size_t type_to_length(uint8_t type);
         static byte_order type_to_byte_order(uint8_t);
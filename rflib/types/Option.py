@@ -16,7 +16,7 @@ typeStrings = {
 
 class Option(TLV):
     def __init__(self, optionType=None, value=None):
-        super(Option, self).__init__(optionType, self.type_to_bin(optionType, value))
+        self._init_encoded(optionType, value)
 
     def __str__(self):
         return "%s : %s" % (self.type_to_str(self._type), self.get_value())
@@ -147,6 +147,13 @@ mongo::BSONObj TLV::to_BSON() const {
     return TLV_to_BSON(this, ORDER_HOST);
 }
 
+/**
+ * Returns the value in network byte-order, as carried by the binary IPC codec.
+ */
+std::string TLV::value_to_binary() const {
+    return value_to_network(this, ORDER_HOST);
+}
+
 /**
  * Serialises the TLV object to BSON in the following format:
  * {
@@ -157,6 +164,44 @@ mongo::BSONObj TLV::to_BSON() const {
  * Where "value" is converted from "byte_order" to network byte-order.
  */
 mongo::BSONObj TLV::TLV_to_BSON(const TLV* tlv, byte_order order) {
+    std::string value = value_to_network(tlv, order);
+
+    mongo::BSONObjBuilder builder;
+    builder.append("type", tlv->type);
+    builder.appendBinData("value", value.size(), mongo::BinDataGeneral,
+                          value.data());
+
+    return builder.obj();
+}
+
+uint8_t TLV::type_from_BSON(mongo::BSONObj bson) {
+    const mongo::BSONElement& btype = bson["type"];
+
+    if (btype.type() != mongo::NumberInt)
+        return 0;
+
+    return static_cast<uint8_t>(btype.Int());
+}
+
+boost::shared_array<uint8_t> TLV::value_from_BSON(mongo::BSONObj bson,
+                                                  byte_order order) {
+    boost::shared_array<uint8_t> arr;
+
+    const mongo::BSONElement& bvalue = bson["value"];
+    if (bvalue.type() != mongo::BinData)
+        return arr;
+
+    int len = bvalue.valuesize();
+    const uint8_t* value = reinterpret_cast<const uint8_t*>
+                           (bvalue.binData(len));
+
+    return value_from_network(value, len, order);
+}
+
+/**
+ * Returns the TLV's value converted from "byte_order" to network byte-order.
+ */
+std::string TLV::value_to_network(const TLV* tlv, byte_order order) {
     const uint8_t* value = tlv->getValue();
 
     boost::scoped_array<uint8_t> arr(new uint8_t[tlv->length]);
@@ -185,35 +230,19 @@ mongo::BSONObj TLV::TLV_to_BSON(const TLV* tlv, byte_order order) {
         }
     }
 
-    mongo::BSONObjBuilder builder;
-    builder.append("type", tlv->type);
-    builder.appendBinData("value", tlv->length, mongo::BinDataGeneral, value);
-
-    return builder.obj();
-}
-
-uint8_t TLV::type_from_BSON(mongo::BSONObj bson) {
-    const mongo::BSONElement& btype = bson["type"];
-
-    if (btype.type() != mongo::NumberInt)
-        return 0;
-
-    return static_cast<uint8_t>(btype.Int());
+    if (tlv->length == 0)
+        return std::string();
+    return std::string(reinterpret_cast<const char*>(value), tlv->length);
 }
 
-boost::shared_array<uint8_t> TLV::value_from_BSON(mongo::BSONObj bson,
-                                                  byte_order order) {
-    boost::shared_array<uint8_t> arr;
-
-    const mongo::BSONElement& bvalue = bson["value"];
-    if (bvalue.type() != mongo::BinData)
-        return arr;
-
-    int len = bvalue.valuesize();
-    const uint8_t* value = reinterpret_cast<const uint8_t*>
-                           (bvalue.binData(len));
-
-    arr.reset(new uint8_t[len]);
+/**
+ * Returns a copy of the len bytes of value, converted from network
+ * byte-order to "byte_order".
+ */
+boost::shared_array<uint8_t> TLV::value_from_network(const uint8_t* value,
+                                                     size_t len,
+                                                     byte_order order) {
+    boost::shared_array<uint8_t> arr(new uint8_t[len]);
     if (order == ORDER_HOST) {
         switch (len) {
             case sizeof(uint16_t): {
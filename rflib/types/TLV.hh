@@ -30,6 +30,7 @@ struct ip6_match {
 class TLV {
     public:
         TLV(const TLV& other);
+        virtual ~TLV() { }
         TLV(uint8_t, size_t, boost::shared_array<uint8_t> value);
         TLV(uint8_t, size_t, const uint8_t* value);
         TLV(uint8_t, size_t, uint8_t value);
@@ -55,6 +56,7 @@ class TLV {
         virtual std::string type_to_string() const;
         virtual bool optional() const;
         virtual mongo::BSONObj to_BSON() const;
+        virtual std::string value_to_binary() const;
 
     protected:
         uint8_t type;
@@ -66,6 +68,10 @@ class TLV {
         static uint8_t type_from_BSON(mongo::BSONObj bson);
         static boost::shared_array<uint8_t> value_from_BSON(mongo::BSONObj,
                                                             byte_order);
+        static std::string value_to_network(const TLV*, byte_order);
+        static boost::shared_array<uint8_t> value_from_network(const uint8_t*,
+                                                               size_t,
+                                                               byte_order);
 
     private:
         void init(uint8_t type, size_t, boost::shared_array<uint8_t> value);
@@ -1,10 +1,22 @@
+import struct
 from socket import *
 from binascii import *
 from bson.binary import Binary
 
 OPTIONAL_MASK = 1 << 7
 
+# Encoded TLV dicts keyed by (class, type, value). The same ports, MAC
+# addresses and ethertypes are encoded over and over by the translators, so
+# the encoding is done once and the resulting dict is shared. Shared dicts must
+# not be modified. Once TLV_CACHE_SIZE values are cached no more are added,
+# so lookups need no lock and no eviction.
+TLV_CACHE_SIZE = 4096
+tlv_cache = {}
+
 class TLV(object):
+    # Shared dict returned by to_dict, set for TLVs created through the cache
+    _dict = None
+
     def __init__(self, _type=None, _value=None):
         self._type = _type
         if(_type != None):
@@ -12,6 +24,29 @@ class TLV(object):
         else:
             self._value = _value
 
+    def _init_encoded(self, _type, value):
+        """Initialises the TLV from an unencoded value using type_to_bin.
+
+        The encoding is looked up in tlv_cache first, and TLVs created with
+        the same type and value share a single dict.
+        """
+        key = (self.__class__, _type, value)
+        try:
+            d = tlv_cache.get(key)
+        except TypeError:
+            # Unhashable value, e.g. a list
+            key = d = None
+        if d is None:
+            TLV.__init__(self, _type, self.type_to_bin(_type, value))
+            if (key is not None and _type is not None and
+                    len(tlv_cache) < TLV_CACHE_SIZE):
+                self._dict = TLV.to_dict(self)
+                tlv_cache[key] = self._dict
+        else:
+            self._type = d['type']
+            self._value = d['value']
+            self._dict = d
+
     def optional(self):
         if self._type & OPTIONAL_MASK:
             return True;
@@ -21,11 +56,23 @@ class TLV(object):
         return self._value
 
     def to_dict(self):
+        if self._dict is not None:
+            return self._dict
         return { 'type' : self._type, 'value' : self._value }
 
 def hex_int_extend(num, length):
     return ((length/4 - len(num)) * '0') + num
 
+# Packers for the integer lengths used by Match, Action and Option
+INT_STRUCTS = {
+    8: struct.Struct('!B'),
+    16: struct.Struct('!H'),
+    32: struct.Struct('!I'),
+    64: struct.Struct('!Q'),
+}
+
+INT_STRUCTS_BY_SIZE = dict((s.size, s) for s in INT_STRUCTS.itervalues())
+
 def int_to_bin(num, length):
     """Converts an integer into a fixed-length integer in network byte order.
 
@@ -38,11 +85,21 @@ def int_to_bin(num, length):
 
         int_to_bin(0xabcd, 16) returns '\xab\xcd'
     """
+    packer = INT_STRUCTS.get(length)
+    if packer is not None:
+        try:
+            return packer.pack(num)
+        except struct.error:
+            # Out of range, fall back to the hex conversion
+            pass
     hexnum = hex(num)[2:].rstrip('L')
     hexnum = hexnum if len(hexnum) % 2 == 0 else '0' + hexnum
     return a2b_hex(hex_int_extend(hexnum, length))
 
 def bin_to_int(value):
+    unpacker = INT_STRUCTS_BY_SIZE.get(len(value))
+    if unpacker is not None:
+        return unpacker.unpack(value)[0]
     return int(b2a_hex(value), 16)
 
 def ether_to_bin(ethaddr):
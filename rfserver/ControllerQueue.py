@@ -0,0 +1,161 @@
+import collections
+import Queue
+import threading
+import time
+
+from rflib.defs import *
+
+# Seconds to wait for rfproxy to acknowledge a message before assuming the
+# acks were lost and carrying on
+ACK_TIMEOUT = 5
+# At most this many times hwm RouteMods are passed on to be sent, the rest
+# wait in the controller's overflow list
+QUEUE_LIMIT = 2
+
+
+class ControllerQueue:
+    """Messages for one controller's rfproxy, sent by their own thread.
+
+    rfproxy acknowledges each RouteMod or RouteModBatch it handles with a
+    RouteMod. At most window messages are sent without an ack, so a
+    controller that falls behind only holds up its own queue.
+
+    RouteMod acks to clients are held while more than hwm RouteMods for the
+    controller are queued or awaiting an ack. The clients feeding a slow
+    controller therefore stop sending until it catches up, which bounds the
+    queues in front of it. Should clients keep sending regardless,
+    RouteMods beyond QUEUE_LIMIT * hwm wait in the controller's own overflow
+    list, rather than in the dp_workers' queues shared with the other
+    controllers, until its acks make room for them.
+    """
+
+    def __init__(self, ct_id, ipc_send, send_acks, window, hwm, log):
+        self.ct_id = str(ct_id)
+        self.ipc_send = ipc_send
+        self.send_acks = send_acks
+        self.window = window
+        self.hwm = hwm
+        self.log = log
+        # Bounded by limit, as only reserved RouteMods are put
+        self.queue = Queue.Queue()
+        self.limit = max(QUEUE_LIMIT * hwm, window, 1)
+        self.cond = threading.Condition()
+        # Number of RouteMods in each message awaiting an ack
+        self.inflight = collections.deque()
+        # RouteMods deferred, reserved, queued or awaiting an ack
+        self.backlog = 0
+        # (queue, item, count) deferred by reserve(), and their RouteMods
+        self.overflow = collections.deque()
+        self.deferred = 0
+        self.acks = 0
+        # Acks still expected for messages given up on after ACK_TIMEOUT,
+        # ignored rather than taken for acks of the messages sent since.
+        # Expected until stale_until, after which they are assumed lost.
+        self.stale = 0
+        self.stale_until = 0
+        # (vm_id, PortConfig) acks held for clients
+        self.held_acks = []
+        worker = threading.Thread(target=self._worker,
+                                  name="ct-" + self.ct_id + "-worker")
+        worker.daemon = True
+        worker.start()
+
+    def reserve(self, queue, item, count=1):
+        """Puts item, holding count translated RouteMods, on queue to be
+        sent, counting them towards the backlog before they reach put().
+
+        Once limit RouteMods are reserved, item is deferred in order with
+        those before it until acks make room.
+        """
+        with self.cond:
+            self.backlog += count
+            if self.overflow or self.backlog - self.deferred > self.limit:
+                self.overflow.append((queue, item, count))
+                self.deferred += count
+            else:
+                queue.put(item)
+
+    def _release_overflow(self):
+        # Called holding cond, so deferred items are put in order
+        while self.overflow:
+            (queue, item, count) = self.overflow[0]
+            if self.backlog - self.deferred + count > self.limit:
+                break
+            self.overflow.popleft()
+            self.deferred -= count
+            queue.put(item)
+
+    def put(self, msg, count=1):
+        """Queues msg, which holds count reserved RouteMods"""
+        self.queue.put((msg, count))
+
+    def queue_ack(self, vm_id, ack):
+        with self.cond:
+            self.held_acks.append((vm_id, ack))
+            acks = self._release_acks()
+        self._send_acks(acks)
+
+    def ack(self):
+        """Handles an ack from rfproxy"""
+        with self.cond:
+            if self.stale and time.time() < self.stale_until:
+                # rfproxy acks in order, so this is for a message sent
+                # before the timeout
+                self.stale -= 1
+                return
+            self.stale = 0
+            if self.inflight:
+                self.backlog -= self.inflight.popleft()
+                self.acks += 1
+                self.cond.notify()
+                self._release_overflow()
+            acks = self._release_acks()
+        self._send_acks(acks)
+
+    def _release_acks(self):
+        if self.backlog > self.hwm:
+            return []
+        acks = self.held_acks
+        self.held_acks = []
+        return acks
+
+    def _send_acks(self, acks):
+        if acks:
+            self.send_acks(acks)
+
+    def _worker(self):
+        while True:
+            (msg, count) = self.queue.get()
+            acks = []
+            with self.cond:
+                while len(self.inflight) >= self.window:
+                    last = self.acks
+                    self.cond.wait(ACK_TIMEOUT)
+                    if self.acks == last and self.inflight:
+                        self.log.warning("No ack from controller %s in %gs, "
+                                         "resuming (unacked=%d)" %
+                                         (self.ct_id, ACK_TIMEOUT,
+                                          len(self.inflight)))
+                        self.backlog -= sum(self.inflight)
+                        self.stale += len(self.inflight)
+                        self.stale_until = time.time() + ACK_TIMEOUT
+                        self.inflight.clear()
+                        self._release_overflow()
+                        acks = self._release_acks()
+                self.inflight.append(count)
+            self._send_acks(acks)
+            try:
+                self.ipc_send(RFSERVER_RFPROXY_CHANNEL, self.ct_id, msg)
+            except Exception:
+                self.log.exception("Failed to send to controller %s:\n%s" %
+                                   (self.ct_id, msg))
+                # No ack will come for it
+                with self.cond:
+                    if self.inflight:
+                        self.inflight.pop()
+                        self.backlog -= count
+                    self.cond.notify()
+                    self._release_overflow()
+                    acks = self._release_acks()
+                self._send_acks(acks)
+            self.queue.task_done()
@@ -0,0 +1,155 @@
+import threading
+
+from rflib.defs import *
+from rflib.types.Option import *
+from rflib.ipc.RFProtocol import RouteMod
+
+def tlv_key(tlvs, skip=()):
+    """Returns a hashable, order independent key for a list of TLV dicts"""
+    return tuple(sorted([(d['type'], str(d['value'])) for d in tlvs
+                         if d['type'] not in skip]))
+
+def _priority_of(rm):
+    for option in rm.get_options():
+        if option['type'] == RFOT_PRIORITY:
+            return option
+    return None
+
+
+class FlowShadow:
+    """The flows and groups RFServer believes are installed on a datapath.
+
+    Flows are keyed by (table, priority, matches) and groups by group id.
+    Every RouteMod sent to the datapath is applied to the shadow, see apply().
+    When a datapath reconnects reconcile() compares the shadow with a fresh
+    configure_datapath() rather than wiping and reinstalling everything. This
+    relies on the datapath keeping its flows while disconnected from the
+    controller (fail secure mode).
+    """
+
+    def __init__(self, dp_id):
+        self.dp_id = dp_id
+        # (table, priority, matches) -> (actions, options, rm)
+        self.flows = {}
+        # group -> actions
+        self.groups = {}
+        # Flow and group keys installed by configure_datapath
+        self.base_flows = set()
+        self.base_groups = set()
+        # Held while a RouteMod is applied and queued, so the shadow and the
+        # datapath see RouteMods in the same order
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def flow_key(rm):
+        priority = _priority_of(rm)
+        if priority is not None:
+            priority = str(priority['value'])
+        return (rm.get_table(), priority, tlv_key(rm.get_matches()))
+
+    @staticmethod
+    def flow_value(rm):
+        return (tlv_key(rm.get_actions()),
+                tlv_key(rm.get_options(), skip=(RFOT_PRIORITY, RFOT_CT_ID)))
+
+    def apply(self, rm):
+        """Records rm in the shadow.
+
+        Returns False if rm would not change the datapath, i.e. it adds a
+        flow or group that is already installed, otherwise True.
+        """
+        mod = rm.get_mod()
+        if mod in (RMT_ADD, RMT_CONTROLLER):
+            key = self.flow_key(rm)
+            value = self.flow_value(rm)
+            old = self.flows.get(key)
+            if old is not None and old[:2] == value:
+                return False
+            self.flows[key] = value + (rm,)
+        elif mod == RMT_DELETE:
+            if not rm.get_matches():
+                self.flows.clear()
+                self.base_flows.clear()
+            else:
+                key = self.flow_key(rm)
+                self.flows.pop(key, None)
+                self.base_flows.discard(key)
+        elif mod == RMT_ADD_GROUP:
+            value = tlv_key(rm.get_actions())
+            if self.groups.get(rm.get_group()) == value:
+                return False
+            self.groups[rm.get_group()] = value
+        elif mod == RMT_DELETE_GROUP:
+            # Group ids start at CONTROLLER_GROUP, 0 deletes all groups
+            if rm.get_group() == 0:
+                self.groups.clear()
+                self.base_groups.clear()
+            else:
+                self.groups.pop(rm.get_group(), None)
+                self.base_groups.discard(rm.get_group())
+        return True
+
+    def _configured(self, rms):
+        """Returns a shadow of a datapath configured with rms, and the
+        RouteMods that add its groups and flows"""
+        wanted = FlowShadow(self.dp_id)
+        flow_rms = []
+        group_rms = []
+        for rm in rms:
+            if not wanted.apply(rm):
+                continue
+            if rm.get_mod() in (RMT_ADD, RMT_CONTROLLER):
+                flow_rms.append(rm)
+            elif rm.get_mod() == RMT_ADD_GROUP:
+                group_rms.append(rm)
+        return (wanted, flow_rms, group_rms)
+
+    def set_base(self, rms):
+        """Records the flows and groups of rms, the output of
+        configure_datapath, as installed by configure_datapath"""
+        wanted = self._configured(rms)[0]
+        self.base_flows = set(wanted.flows)
+        self.base_groups = set(wanted.groups)
+
+    def reconcile(self, rms):
+        """Returns the RouteMods needed to bring the datapath from the shadow
+        to the state installed by rms, the output of configure_datapath.
+
+        Flows and groups added since (e.g. routes) are left alone, only those
+        previously installed by configure_datapath are deleted if no longer
+        wanted. The result still needs to be applied as it is sent.
+        """
+        (wanted, flow_rms, group_rms) = self._configured(rms)
+
+        delta = []
+        for rm in group_rms:
+            group = rm.get_group()
+            if group not in wanted.groups:
+                continue
+            if self.groups.get(group) != wanted.groups[group]:
+                if group in self.groups:
+                    delta.append(RouteMod(RMT_DELETE_GROUP, self.dp_id,
+                                          group=group))
+                delta.append(rm)
+        for rm in flow_rms:
+            key = self.flow_key(rm)
+            if key not in wanted.flows:
+                continue
+            old = self.flows.get(key)
+            if old is None or old[:2] != wanted.flows[key][:2]:
+                delta.append(rm)
+
+        for key in self.base_flows - set(wanted.flows):
+            old_rm = self.flows[key][2]
+            rm = RouteMod(RMT_DELETE, self.dp_id, table=old_rm.get_table(),
+                          matches=list(old_rm.get_matches()))
+            priority = _priority_of(old_rm)
+            if priority is not None:
+                rm.add_option(Option.from_dict(priority))
+            delta.append(rm)
+        for group in self.base_groups - set(wanted.groups):
+            delta.append(RouteMod(RMT_DELETE_GROUP, self.dp_id, group=group))
+
+        self.base_flows = set(wanted.flows)
+        self.base_groups = set(wanted.groups)
+        return delta
@@ -1,37 +1,182 @@
+import threading
+
 from rflib.defs import *
+import rflib.metrics as metrics
+
+_missing = object()
+
+SCANNED_ROWS = metrics.histogram('rftable_scanned_rows',
+                                 'Rows examined by table lookups (sampled)',
+                                 ('table',), unit=1)
 
 class MemoryTable:
-    def __init__(self, name, address=None):
+    """In-process table storage.
+
+    By default rows are stored as dicts, like MongoTable. When DB_TYPE is
+    'memory-native' the table stores entry objects directly (see
+    get_objects/set_object) and EntryTable bypasses the dict conversion.
+    """
+
+    def __init__(self, name, address=None, indexes=(), unique_indexes=()):
         self.name = name
+        self.native_entries = (DB_TYPE == 'memory-native')
         self._next_id = 1000
         self._data = {}
+        # Each index maps a tuple of field names to a dict of
+        # {tuple of field values: set of _ids}. Uniqueness is not enforced,
+        # unique_indexes are used for lookups like the others.
+        self._indexes = dict((tuple(fields), {}) for fields in
+                             tuple(indexes) + tuple(unique_indexes))
+        self._query_index = {}
+        # Individual operations are atomic so the table can be shared by
+        # RFServer's worker threads.
+        self._lock = threading.RLock()
+        self._scanned = SCANNED_ROWS.labels(name)
+
+    def _id_of(self, item):
+        if self.native_entries:
+            return item.id
+        return item['_id']
+
+    def _index_key(self, item, fields):
+        """Returns the values of fields in item, or None if one is missing"""
+        try:
+            if self.native_entries:
+                return tuple([getattr(item, f) for f in fields])
+            return tuple([item[f] for f in fields])
+        except (KeyError, AttributeError):
+            # Rows missing a field can never match a query on it
+            return None
+
+    def _index_add(self, item):
+        for (fields, index) in self._indexes.iteritems():
+            key = self._index_key(item, fields)
+            if key is not None:
+                index.setdefault(key, set()).add(self._id_of(item))
+
+    def _index_remove(self, item):
+        for (fields, index) in self._indexes.iteritems():
+            key = self._index_key(item, fields)
+            ids = index.get(key)
+            if ids is not None:
+                ids.discard(self._id_of(item))
+                if not ids:
+                    del index[key]
+
+    def _find_index(self, keys):
+        """Returns the widest declared index covered by the query keys"""
+        keys = frozenset(keys)
+        if keys not in self._query_index:
+            best = None
+            for fields in self._indexes:
+                if keys.issuperset(fields):
+                    if best is None or len(fields) > len(best):
+                        best = fields
+            self._query_index[keys] = best
+        return self._query_index[keys]
 
-    def get_dicts(self, **kwargs):
-        if len(kwargs) == 0:
-            return self._data.values()
-
-        results = []
-        for d in self._data.itervalues():
-            add = True
-            for (k,v) in kwargs.iteritems():
-                if k not in d or d[k] != v:
-                    add = False
-                    break
-            if add:
-                results.append(d)
-        return results
+    def _candidates(self, kwargs):
+        fields = self._find_index(kwargs)
+        if fields is None:
+            candidates = self._data.itervalues()
+            scanned = len(self._data)
+        else:
+            key = tuple([kwargs[f] for f in fields])
+            ids = self._indexes[fields].get(key, ())
+            candidates = [self._data[_id] for _id in ids]
+            scanned = len(candidates)
+        if self._scanned.sampled():
+            self._scanned.observe(scanned)
+        return candidates
+
+    def get_dicts(self, fields=None, **kwargs):
+        # fields is a hint for remote backends, rows here are already loaded
+        if self.native_entries:
+            return [obj.to_dict() for obj in self.get_objects(**kwargs)]
+
+        with self._lock:
+            if len(kwargs) == 0:
+                return self._data.values()
+
+            results = []
+            for d in self._candidates(kwargs):
+                add = True
+                for (k,v) in kwargs.iteritems():
+                    if k not in d or d[k] != v:
+                        add = False
+                        break
+                if add:
+                    results.append(d)
+            return results
 
     def set_dict(self, d):
-        if '_id' not in d:
-            self._next_id += 1
-            d['_id'] = self._next_id
-        _id = d['_id']
-        self._data[_id] = d
-        return _id
+        if self.native_entries:
+            raise TypeError("Table %s stores entry objects, use set_object"
+                            % self.name)
+        with self._lock:
+            if '_id' not in d:
+                self._next_id += 1
+                d['_id'] = self._next_id
+            _id = d['_id']
+            if _id in self._data:
+                self._index_remove(self._data[_id])
+            self._data[_id] = d
+            self._index_add(d)
+            return _id
+
+    def get_objects(self, **kwargs):
+        """Returns the stored entry objects matching kwargs.
+
+        The returned objects are the table contents themselves, no copy is
+        made, so they are read-only. Modify a copy() and store it with
+        set_object.
+        """
+        with self._lock:
+            if len(kwargs) == 0:
+                return self._data.values()
+
+            results = []
+            for obj in self._candidates(kwargs):
+                add = True
+                for (k,v) in kwargs.iteritems():
+                    if getattr(obj, k, _missing) != v:
+                        add = False
+                        break
+                if add:
+                    results.append(obj)
+            return results
+
+    def set_object(self, obj):
+        """Stores a copy of obj, which stays private to the caller"""
+        with self._lock:
+            if obj._owner is self:
+                # Read from this table, so unchanged
+                return obj.id
+            if obj.id is None:
+                self._next_id += 1
+                obj.id = self._next_id
+            _id = obj.id
+            stored = obj.copy()
+            old = self._data.get(_id)
+            if old is not None:
+                self._index_remove(old)
+            self._data[_id] = stored
+            self._index_add(stored)
+            stored.set_owner(self)
+            return _id
 
     def remove_id(self, _id):
-        if _id in self._data:
-            del self._data[_id]
+        with self._lock:
+            if _id in self._data:
+                self._index_remove(self._data[_id])
+                del self._data[_id]
+
+    def sync(self):
+        """Nothing is buffered, see MongoTable.sync"""
+        pass
 
     def clear(self):
-        self._data = {}
+        with self._lock:
+            self._data = {}
+            for index in self._indexes.itervalues():
+                index.clear()
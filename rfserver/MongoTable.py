@@ -1,24 +1,155 @@
+import logging
+import threading
+import time
+
 import pymongo as mongo
+from pymongo.errors import OperationFailure
+from bson.objectid import ObjectId
 
 from rflib.defs import *
 from rflib.ipc.MongoIPC import format_address
+from MemoryTable import MemoryTable
+
+log = logging.getLogger("rftable")
 
 class MongoTable:
-    def __init__(self, name, address=MONGO_ADDRESS):
+    """Table storage in a MongoDB collection.
+
+    When DB_TYPE is 'mongo-writebehind' reads are served from an in-process
+    mirror of the collection and writes are collected and flushed to MongoDB
+    every MONGO_WRITE_BEHIND_INTERVAL seconds, or when sync() is called.
+    """
+    native_entries = False
+
+    def __init__(self, name, address=MONGO_ADDRESS, indexes=(),
+                 unique_indexes=()):
         self.name = name
+        self.indexes = indexes
+        self.unique_indexes = unique_indexes
         self.address = format_address(address)
         self.connection = mongo.Connection(*self.address)
         self.data = self.connection[MONGO_DB_NAME][name]
+        # Unique indexes created without unique=True, see _ensure_indexes
+        self._non_unique = []
+        self._ensure_indexes()
+
+        self.write_behind = (DB_TYPE == 'mongo-writebehind')
+        if self.write_behind:
+            self._mirror = MemoryTable(name, indexes=indexes,
+                                       unique_indexes=unique_indexes)
+            for d in self.data.find():
+                self._mirror.set_dict(d)
+            # _id -> document to upsert, or None to remove
+            self._dirty = {}
+            self._cleared = False
+            self._lock = threading.Lock()
+            # Serialises flushes so they reach MongoDB in order
+            self._sync_lock = threading.Lock()
+            flusher = threading.Thread(target=self._flush_worker)
+            flusher.daemon = True
+            flusher.start()
+
+    def _ensure_indexes(self):
+        for fields in self.unique_indexes:
+            keys = [(field, mongo.ASCENDING) for field in fields]
+            try:
+                self.data.ensure_index(keys, unique=True)
+            except OperationFailure:
+                # The collection already holds duplicates, e.g. written
+                # before the index was declared or by a previous run. The
+                # index is made unique once the collection is cleared.
+                self.data.ensure_index(keys)
+                self._non_unique.append(keys)
+        for fields in self.indexes:
+            self.data.ensure_index([(field, mongo.ASCENDING)
+                                    for field in fields])
 
-    def get_dicts(self, **kwargs):
+    def _remove_all(self):
+        self.data.remove()
+        # Empty now, so there can be no duplicates
+        while self._non_unique:
+            keys = self._non_unique.pop()
+            self.data.drop_index(keys)
+            self.data.create_index(keys, unique=True)
+
+    def get_dicts(self, fields=None, **kwargs):
+        if self.write_behind:
+            return self._mirror.get_dicts(**kwargs)
+        if fields is not None:
+            return self.data.find(kwargs, fields=list(fields))
         return self.data.find(kwargs)
 
     def set_dict(self, d):
-        # TODO: enforce (*_id, *_port) uniqueness restriction
+        if self.write_behind:
+            if '_id' not in d:
+                d['_id'] = ObjectId()
+            with self._lock:
+                self._mirror.set_dict(d)
+                self._dirty[d['_id']] = d
+            return d['_id']
+        # Uniqueness of (*_id, *_port) is enforced by the declared
+        # unique_indexes, a duplicate raises DuplicateKeyError
         return self.data.save(d)
 
     def remove_id(self, _id):
+        if self.write_behind:
+            with self._lock:
+                self._mirror.remove_id(_id)
+                self._dirty[_id] = None
+            return
         self.data.remove(_id)
 
     def clear(self):
-        self.data.remove()
+        if self.write_behind:
+            with self._lock:
+                self._mirror.clear()
+                self._dirty = {}
+                self._cleared = True
+            return
+        self._remove_all()
+
+    def sync(self):
+        """Writes pending changes to MongoDB, a no-op unless write-behind"""
+        if not self.write_behind:
+            return
+        with self._sync_lock:
+            with self._lock:
+                dirty = self._dirty
+                cleared = self._cleared
+                self._dirty = {}
+                self._cleared = False
+            try:
+                self._write(dirty, cleared)
+            except Exception:
+                with self._lock:
+                    # Kept for the next sync, unless cleared since. Changes
+                    # made since are newer so take precedence.
+                    if not self._cleared:
+                        dirty.update(self._dirty)
+                        self._dirty = dirty
+                        self._cleared = cleared
+                raise
+
+    def _write(self, dirty, cleared):
+        if cleared:
+            self._remove_all()
+        if not dirty:
+            return
+        # Only the latest state of each document is kept, so the operations
+        # are independent, can be unordered and are safe to repeat
+        bulk = self.data.initialize_unordered_bulk_op()
+        for (_id, d) in dirty.iteritems():
+            if d is None:
+                bulk.find({'_id': _id}).remove_one()
+            else:
+                bulk.find({'_id': _id}).upsert().replace_one(d)
+        bulk.execute()
+
+    def _flush_worker(self):
+        while True:
+            time.sleep(MONGO_WRITE_BEHIND_INTERVAL)
+            try:
+                self.sync()
+            except Exception:
+                log.exception("Failed to write %s to MongoDB, retrying" %
+                              self.name)
@@ -166,10 +166,12 @@ def shortest_recursive(labeller, log, check_set, conf, fpconf, islconf):
             ports = []
         for port in ports:
             if not hasattr(port, "fp_label"):
+                port = port.copy()
                 port.fp_label = labeller.allocate_label()
                 conf.set_entry(port)
                 # Format (label, direct connection, vm port (i.e. dp0 port))
-                link.fast_paths.append((port.fp_label, port.vm_port))
+                link.fast_paths = link.fast_paths + [(port.fp_label,
+                                                      port.vm_port)]
             else:
                 # Someones already tagged this
                 log.info("Skipping dp_id %d already fastpath'd" % my_dpid)
@@ -195,6 +197,7 @@ def shortest_recursive(labeller, log, check_set, conf, fpconf, islconf):
             # Build a list of isl to check next iteration
             for next_isl in islconf.get_entries_by_dpid(ct_id, my_dpid):
                 if not hasattr(next_isl, "fast_paths"):
+                    next_isl = next_isl.copy()
                     next_isl.fast_paths = []
                     islconf.set_entry(next_isl)
                     next_set.append((ct_id, my_dpid, next_isl))
@@ -208,7 +211,7 @@ def shortest_recursive(labeller, log, check_set, conf, fpconf, islconf):
     for _, parent_dpid, next_isl in next_set:
         while (x.dp_id != parent_dpid and (x.rem_id if hasattr(x,"rem_id") else -1) != parent_dpid):
             x = it.next()[2]
-        x.fast_paths += next_isl.fast_paths
+        x.fast_paths = x.fast_paths + next_isl.fast_paths
         if isinstance(x, RFISLConfEntry):
             islconf.set_entry(x)
         elif isinstance(x, RFFPConfEntry):
@@ -232,7 +235,8 @@ def fp_allocate_labels(labeller, log, conf, fpconf, islconf):
 
     next_set = []
     for fplink in fplinks:
-        next_set.append((fplink.ct_id, -1, fplink))
+        # Modified as labels are allocated, so work on copies
+        next_set.append((fplink.ct_id, -1, fplink.copy()))
 
     shortest_recursive(labeller, log, next_set, conf, fpconf, islconf)
     return
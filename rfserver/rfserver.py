@@ -6,10 +6,12 @@ import sys
 import logging
 import binascii
 import argparse
+import signal
+import tempfile
 import time
-import copy
 import Queue
 import threading
+import collections
 
 from bson.binary import Binary
 
@@ -17,13 +19,18 @@ import rflib.ipc.IPC as IPC
 import rflib.ipc.IPCService as IPCService
 from rflib.ipc.RFProtocol import *
 from rflib.ipc.RFProtocolFactory import RFProtocolFactory
+from rflib.ipc.RouteModOverlay import RouteModOverlay
 from rflib.defs import *
+import rflib.metrics as metrics
+from rflib.profiler import SamplingProfiler, on_signal, wait_for
 from rflib.types.Match import *
 from rflib.types.Action import *
 from rflib.types.Option import *
 
 from rftable import *
 from rffastpath import *
+from FlowShadow import FlowShadow, tlv_key
+from ControllerQueue import ControllerQueue
 
 logging.basicConfig(
     level=logging.INFO,
@@ -36,6 +43,38 @@ REGISTER_IDLE = 0
 REGISTER_ASSOCIATED = 1
 REGISTER_ISL = 2
 
+# Message type -> class name, to label metrics with
+MESSAGE_NAMES = dict((type_, RFProtocolFactory().build_for_type(type_)
+                      .__class__.__name__)
+                     for type_ in (PORT_REGISTER, PORT_CONFIG,
+                                   DATAPATH_PORT_REGISTER, DATAPATH_DOWN,
+                                   VIRTUAL_PLANE_MAP, DATA_PLANE_MAP,
+                                   ROUTE_MOD, ROUTE_MOD_BATCH,
+                                   PROFILE_REQUEST))
+
+MESSAGES = metrics.counter('rfserver_messages_total',
+                           'Messages processed', ('channel', 'type'))
+PROCESS_SECONDS = metrics.histogram('rfserver_process_seconds',
+                                    'Time to process a message (sampled)',
+                                    ('type',))
+TRANSLATED_ROUTEMODS = metrics.counter('rfserver_translated_routemods_total',
+                                       'RouteMods emitted by translators',
+                                       ('translator',))
+TRANSLATE_SECONDS = metrics.histogram('rfserver_translate_seconds',
+                                      'Time spent in a translator (sampled)',
+                                      ('translator',))
+SEND_SECONDS = metrics.histogram('rfserver_send_seconds',
+                                 'Time to send a message to a controller, or '
+                                 'queue it with flow control (sampled)')
+QUEUE_DEPTH = metrics.gauge('rfserver_queue_depth',
+                            'Messages waiting in RFServer queues',
+                            ('queue',))
+
+# Threads sampled by the profiler: the workers sending RouteMods and
+# processing sharded messages, and the IPC threads processing the rest
+PROFILED_THREADS = r"rfserver-(dp|shard)_worker|ipc-(channel|shm)-"
+PROFILE_SECONDS = 10
+
 class RouteModTranslator(object):
 
     DROP_PRIORITY = Option.PRIORITY(PRIORITY_LOWEST + PRIORITY_BAND)
@@ -47,6 +86,11 @@ class RouteModTranslator(object):
     #The table used to tag fastpath packets
     FP_TABLE = 1
 
+    # (class, fastpath enabled) -> the RouteMods of _pipeline(), built once
+    # with this dp_id and stamped out for each datapath by stamp_pipeline()
+    TEMPLATE_DP_ID = 0
+    _templates = {}
+
     def __init__(self, dp_id, ct_id, rftable, isltable, conf, islconf, fpconf, log, labeller):
         self.dp_id = dp_id
         self.ct_id = ct_id
@@ -57,10 +101,54 @@ class RouteModTranslator(object):
         self.conf = conf
         self.labeller = labeller
         self.log = log
+        # Held by RFServer while translating, as translators keep state and
+        # may be used from more than one worker in sharded mode.
+        self.lock = threading.Lock()
+        # Cached (generation, client ports, client and ISL ports), see
+        # get_active_ports
+        self._active_ports = None
+        self._active_ports_gen = 0
+        self.translated = TRANSLATED_ROUTEMODS.labels(type(self).__name__)
+        self.translate_time = TRANSLATE_SECONDS.labels(type(self).__name__)
 
     def configure_datapath(self):
         raise Exception
 
+    def _pipeline(self, dp_id):
+        """Returns the RouteMods setting up the pipeline of datapath dp_id"""
+        raise Exception
+
+    def _pipeline_is_static(self):
+        """Returns whether _pipeline() only depends on dp_id, so that it can
+        be built once as a template"""
+        return True
+
+    def stamp_pipeline(self):
+        """Returns the RouteMods of _pipeline() for this datapath.
+
+        Every datapath of a class gets the same pipeline bar its dp_id, so
+        rather than building and encoding each Match, Action and Option again
+        for every datapath that connects, the pipeline is built once per class
+        and each datapath gets RouteModOverlays of it with its own dp_id. The
+        template is never modified, anything added to a stamped RouteMod is
+        kept by its overlay.
+        """
+        if not self._pipeline_is_static():
+            return self._pipeline(self.dp_id)
+        key = (type(self), self.fpconf.enabled)
+        template = self._templates.get(key)
+        if template is None:
+            # Translators may be used concurrently, the worst case is that
+            # two identical templates are built
+            template = self._pipeline(self.TEMPLATE_DP_ID)
+            RouteModTranslator._templates[key] = template
+        rms = []
+        for rm in template:
+            stamp = RouteModOverlay(rm)
+            stamp.set_id(self.dp_id)
+            rms.append(stamp)
+        return rms
+
     def handle_controller_route_mod(self, entry, rm):
         raise Exception
 
@@ -70,6 +158,33 @@ class RouteModTranslator(object):
     def handle_isl_route_mod(self, entry, rm):
         raise Exception
 
+    def invalidate_active_ports(self):
+        """Called by RFServer when the status of a port on this datapath may
+        have changed"""
+        self._active_ports_gen += 1
+
+    def get_active_ports(self, include_isl=True):
+        """Returns a list of (dp_port, eth_addr) for the active client ports,
+        and if include_isl the active ISL ports, of this datapath"""
+        cached = self._active_ports
+        gen = self._active_ports_gen
+        if cached is None or cached[0] != gen:
+            rf_ports = [(e.dp_port, e.eth_addr) for e in
+                        self.rftable.get_entries(dp_id=self.dp_id,
+                                                 ct_id=self.ct_id)
+                        if e.get_status() == RFENTRY_ACTIVE]
+            isl_ports = [(e.dp_port, e.eth_addr) for e in
+                         self.isltable.get_entries(dp_id=self.dp_id,
+                                                   ct_id=self.ct_id)
+                         if e.get_status() == RFISL_ACTIVE]
+            # gen was read before the tables, so a concurrent invalidation
+            # leaves this stale and it is rebuilt on the next call
+            cached = (gen, rf_ports, rf_ports + isl_ports)
+            self._active_ports = cached
+        if include_isl:
+            return cached[2]
+        return cached[1]
+
     def _get_fastpath_port(self):
         """Returns the fastpath port towards the controller"""
         master = []
@@ -180,57 +295,64 @@ class RouteModTranslator(object):
 
 class DefaultRouteModTranslator(RouteModTranslator):
 
-    def _send_rm_with_matches(self, rm, out_port, entries):
+    def _send_rm_with_matches(self, rm, out_port, ports):
         rms = []
-        for entry in entries:
-            if out_port != entry.dp_port:
-                if (entry.get_status() == RFENTRY_ACTIVE or
-                    entry.get_status() == RFISL_ACTIVE):
-                    local_rm = copy.deepcopy(rm)
-                    local_rm.add_match(Match.ETHERNET(entry.eth_addr))
-                    local_rm.add_match(Match.IN_PORT(entry.dp_port))
-                    rms.append(local_rm)
+        for (dp_port, eth_addr) in ports:
+            if out_port != dp_port:
+                local_rm = RouteModOverlay(rm)
+                local_rm.add_match(Match.ETHERNET(eth_addr))
+                local_rm.add_match(Match.IN_PORT(dp_port))
+                rms.append(local_rm)
         return rms
 
     def configure_datapath(self):
+        rms = self.stamp_pipeline()
+
+        # Register fastpath rules
+        if self.fpconf.enabled:
+            rms += self._register_fastpaths(False)
+
+        return rms
+
+    def _pipeline_is_static(self):
+        # Controller-bound flows go to this datapath's fastpath ports
+        return not self.fpconf.enabled
+
+    def _pipeline(self, dp_id):
         rms = []
 
         # delete all groups
-        rm = RouteMod(RMT_DELETE_GROUP, self.dp_id)
+        rm = RouteMod(RMT_DELETE_GROUP, dp_id)
         rms.append(rm)
 
         # delete all flows
-        rm = RouteMod(RMT_DELETE, self.dp_id)
+        rm = RouteMod(RMT_DELETE, dp_id)
         rms.append(rm)
 
         # catch ipv4 and ipv6 and send to the controller so we can
         # do arp and install a rule for the flow
-        rm = RouteMod(RMT_ADD, self.dp_id)
+        rm = RouteMod(RMT_ADD, dp_id)
         rm.add_option(self.ESTABLISH_PRIORITY)
         rm.add_match(Match.ETHERTYPE(ETHERTYPE_IP))
         rms.extend(self.handle_controller_route_mod(self,rm))
 
-        rm = RouteMod(RMT_ADD, self.dp_id)
+        rm = RouteMod(RMT_ADD, dp_id)
         rm.add_option(self.ESTABLISH_PRIORITY)
         rm.add_match(Match.ETHERTYPE(ETHERTYPE_IPV6))
         rms.extend(self.handle_controller_route_mod(self,rm))
 
         # default drop
-        rm = RouteMod(RMT_ADD, self.dp_id)
+        rm = RouteMod(RMT_ADD, dp_id)
         #rm.add_match(Match.ETHERTYPE(ETHERTYPE_IP))
         rm.add_option(self.DROP_PRIORITY)
         rms.append(rm)
 
         # ARP
-        rm = RouteMod(RMT_ADD, self.dp_id)
+        rm = RouteMod(RMT_ADD, dp_id)
         rm.add_match(Match.ETHERTYPE(ETHERTYPE_ARP))
         rm.add_option(self.CONTROLLER_PRIORITY)
         rms.extend(self.handle_controller_route_mod(self, rm))
 
-        # Register fastpath rules
-        if self.fpconf.enabled:
-            rms += self._register_fastpaths(False)
-
         return rms
 
     def handle_controller_route_mod(self, entry, rm):
@@ -251,7 +373,7 @@ class DefaultRouteModTranslator(RouteModTranslator):
             if ports == None:
                 ports = []
             for port in ports:
-                new_rm = copy.deepcopy(rm)
+                new_rm = RouteModOverlay(rm)
                 new_rm.add_match(Match.IN_PORT(port.dp_port))
                 self.labeller.rfaction_push_meta(port.fp_label, new_rm)
                 new_rm.add_action(Action.OUTPUT(master_port))
@@ -263,15 +385,12 @@ class DefaultRouteModTranslator(RouteModTranslator):
 
     def handle_route_mod(self, entry, rm):
         rms = []
-        entries = self.rftable.get_entries(dp_id=entry.dp_id,
-                                           ct_id=entry.ct_id)
-        entries.extend(self.isltable.get_entries(dp_id=entry.dp_id,
-                                                 ct_id=entry.ct_id))
+        ports = self.get_active_ports()
 
         # Replace the VM port with the datapath port
         rm.add_action(Action.OUTPUT(entry.dp_port))
 
-        rms.extend(self._send_rm_with_matches(rm, entry.dp_port, entries))
+        rms.extend(self._send_rm_with_matches(rm, entry.dp_port, ports))
         return rms
 
     def handle_isl_route_mod(self, r, rm):
@@ -282,8 +401,8 @@ class DefaultRouteModTranslator(RouteModTranslator):
         rm.add_action(Action.SET_ETH_SRC(r.eth_addr))
         rm.add_action(Action.SET_ETH_DST(r.rem_eth_addr))
         rm.add_action(Action.OUTPUT(r.dp_port))
-        entries = self.rftable.get_entries(dp_id=r.dp_id, ct_id=r.ct_id)
-        rms.extend(self._send_rm_with_matches(rm, r.dp_port, entries))
+        ports = self.get_active_ports(include_isl=False)
+        rms.extend(self._send_rm_with_matches(rm, r.dp_port, ports))
         return rms
 
 
@@ -309,8 +428,8 @@ class SatelliteRouteModTranslator(DefaultRouteModTranslator):
                 rm.add_action(Action.SET_ETH_SRC(r.eth_addr))
                 rm.add_action(Action.SET_ETH_DST(r.rem_eth_addr))
                 rm.add_action(Action.OUTPUT(r.dp_port))
-                entries = self.rftable.get_entries(dp_id=r.dp_id, ct_id=r.ct_id)
-                rms.extend(self._send_rm_with_matches(rm, r.dp_port, entries))
+                ports = self.get_active_ports(include_isl=False)
+                rms.extend(self._send_rm_with_matches(rm, r.dp_port, ports))
         return rms
 
 
@@ -323,75 +442,78 @@ class NoviFlowMultitableRouteModTranslator(RouteModTranslator):
         super(NoviFlowMultitableRouteModTranslator, self).__init__(
             dp_id, ct_id, rftable, isltable, conf, islconf, fpconf, log, labeller)
 
-    def _send_rm_with_matches(self, rm, out_port, entries):
+    def _send_rm_with_matches(self, rm, out_port, ports):
         rms = []
-        for entry in entries:
-            if out_port != entry.dp_port:
-                if (entry.get_status() == RFENTRY_ACTIVE or
-                    entry.get_status() == RFISL_ACTIVE):
-                    rms.append(rm)
-                    break
+        for (dp_port, eth_addr) in ports:
+            if out_port != dp_port:
+                rms.append(rm)
+                break
         return rms
 
     def configure_datapath(self):
+        rms = self.stamp_pipeline()
+
+        # Register fastpath rules
+        if self.fpconf.enabled:
+            rms += self._register_fastpaths(True)
+
+        return rms
+
+    def _pipeline(self, dp_id):
         rms = []
 
         # delete all groups
-        rm = RouteMod(RMT_DELETE_GROUP, self.dp_id)
+        rm = RouteMod(RMT_DELETE_GROUP, dp_id)
         rms.append(rm)
         # default group - send to controller
-        rm = RouteMod(RMT_ADD_GROUP, self.dp_id)
+        rm = RouteMod(RMT_ADD_GROUP, dp_id)
         rm.set_group(CONTROLLER_GROUP);
         rm.add_action(Action.CONTROLLER())
         rms.append(rm)
 
         # delete all flows
-        rm = RouteMod(RMT_DELETE, self.dp_id)
+        rm = RouteMod(RMT_DELETE, dp_id)
         rms.append(rm)
 
         # catch ipv4 and ipv6 and send to the controller so we can
         # do arp and install a rule for the flow
-        rm = RouteMod(RMT_ADD, self.dp_id)
+        rm = RouteMod(RMT_ADD, dp_id)
         rm.add_option(self.ESTABLISH_PRIORITY)
         rm.add_match(Match.ETHERTYPE(ETHERTYPE_IP))
         # Noviflow sets all controller actions on the ether table for performance reasons but this
         # will not work there. TODO test this on hardware and see if its a problem.
         rms.extend([(x.set_table(self.FIB_TABLE), x)[1] for x in self.handle_controller_route_mod(self,rm)])
 
-        rm = RouteMod(RMT_ADD, self.dp_id)
+        rm = RouteMod(RMT_ADD, dp_id)
         rm.add_option(self.ESTABLISH_PRIORITY)
         rm.add_match(Match.ETHERTYPE(ETHERTYPE_IPV6))
         rms.extend([(x.set_table(self.FIB_TABLE), x)[1] for x in self.handle_controller_route_mod(self,rm)])
 
         # default drop
         for table_id in (0, self.ETHER_TABLE, self.FIB_TABLE):
-            rm = RouteMod(RMT_ADD, self.dp_id)
+            rm = RouteMod(RMT_ADD, dp_id)
             rm.set_table(table_id)
             rm.add_option(self.DROP_PRIORITY)
             rms.append(rm)
-        rm = RouteMod(RMT_ADD, self.dp_id)
+        rm = RouteMod(RMT_ADD, dp_id)
         rm.add_match(Match.ETHERNET("ff:ff:ff:ff:ff:ff"))
         rm.add_action(Action.GOTO(self.ETHER_TABLE))
         rm.add_option(self.CONTROLLER_PRIORITY)
         rms.append(rm)
         # ARP
-        rm = RouteMod(RMT_ADD, self.dp_id)
+        rm = RouteMod(RMT_ADD, dp_id)
         rm.set_table(self.ETHER_TABLE)
         rm.add_match(Match.ETHERTYPE(ETHERTYPE_ARP))
         rm.add_option(self.CONTROLLER_PRIORITY)
         rms.extend(self.handle_controller_route_mod(self, rm))
         # IPv4
-        rm = RouteMod(RMT_ADD, self.dp_id)
+        rm = RouteMod(RMT_ADD, dp_id)
         rm.set_table(self.ETHER_TABLE)
         rm.add_match(Match.ETHERTYPE(ETHERTYPE_IP))
         rm.add_option(self.DEFAULT_PRIORITY)
         rm.add_action(Action.GOTO(self.FIB_TABLE))
         rms.append(rm)
 
-        # Register fastpath rules
-        if self.fpconf.enabled:
-            rms += self._register_fastpaths(True)
-
         return rms
 
     def handle_controller_route_mod(self, entry, rm):
@@ -427,10 +549,7 @@ class NoviFlowMultitableRouteModTranslator(RouteModTranslator):
 
     def handle_route_mod(self, entry, rm):
         rms = []
-        entries = self.rftable.get_entries(dp_id=entry.dp_id,
-                                           ct_id=entry.ct_id)
-        entries.extend(self.isltable.get_entries(dp_id=entry.dp_id,
-                                                 ct_id=entry.ct_id))
+        ports = self.get_active_ports()
 
         # Replace the VM port with the datapath port
         rm.add_action(Action.OUTPUT(entry.dp_port))
@@ -440,7 +559,7 @@ class NoviFlowMultitableRouteModTranslator(RouteModTranslator):
         rm.set_options(None)
         rm.add_option(self.CONTROLLER_PRIORITY)
 
-        rms.extend(self._send_rm_with_matches(rm, entry.dp_port, entries))
+        rms.extend(self._send_rm_with_matches(rm, entry.dp_port, ports))
         return rms
 
     def handle_isl_route_mod(self, r, rm):
@@ -453,11 +572,11 @@ class NoviFlowMultitableRouteModTranslator(RouteModTranslator):
         rm.add_action(Action.SET_ETH_SRC(r.eth_addr))
         rm.add_action(Action.SET_ETH_DST(r.rem_eth_addr))
         rm.add_action(Action.OUTPUT(r.dp_port))
-        entries = self.rftable.get_entries(dp_id=r.dp_id, ct_id=r.ct_id)
-        rms.extend(self._send_rm_with_matches(rm, r.dp_port, entries))
+        ports = self.get_active_ports(include_isl=False)
+        rms.extend(self._send_rm_with_matches(rm, r.dp_port, ports))
 
         # Add entry to table 0 to match the ISL MAC and passes the packet to FIB table
-        rm = copy.deepcopy(rm)
+        rm = RouteModOverlay(rm)
         rm.set_table(0)
         rm.set_actions(None)
         rm.add_action(Action.GOTO(self.FIB_TABLE))
@@ -491,45 +610,48 @@ class CorsaMultitableRouteModTranslator(RouteModTranslator):
         self.actions_to_groupid = {}
 
     def configure_datapath(self):
+        return self.stamp_pipeline()
+
+    def _pipeline(self, dp_id):
         rms = []
 
         # delete all groups
-        rm = RouteMod(RMT_DELETE_GROUP, self.dp_id)
+        rm = RouteMod(RMT_DELETE_GROUP, dp_id)
         rms.append(rm)
 
         # delete all flows
-        rm = RouteMod(RMT_DELETE, self.dp_id)
+        rm = RouteMod(RMT_DELETE, dp_id)
         rms.append(rm)
 
         # default drop
         for table_id in (0, self.VLAN_MPLS_TABLE, self.VLAN_TABLE,
                          self.ETHER_TABLE, self.FIB_TABLE):
-            rm = RouteMod(RMT_ADD, self.dp_id)
+            rm = RouteMod(RMT_ADD, dp_id)
             rm.set_table(table_id)
             rm.add_option(self.DROP_PRIORITY)
             rms.append(rm)
 
         ## Table 0
-        rm = RouteMod(RMT_ADD, self.dp_id)
+        rm = RouteMod(RMT_ADD, dp_id)
         rm.add_match(Match.ETHERNET("ff:ff:ff:ff:ff:ff"))
         rm.add_action(Action.GOTO(self.VLAN_MPLS_TABLE))
         rm.add_option(self.CONTROLLER_PRIORITY)
         rms.append(rm)
 
         ## VLAN/MPLS table 1
-        rm = RouteMod(RMT_ADD, self.dp_id)
+        rm = RouteMod(RMT_ADD, dp_id)
         rm.set_table(self.VLAN_MPLS_TABLE)
         rm.add_match(Match.ETHERTYPE(ETHERTYPE_IP))
         rm.add_action(Action.GOTO(self.VLAN_TABLE))
         rm.add_option(self.CONTROLLER_PRIORITY)
         rms.append(rm)
-        rm = RouteMod(RMT_ADD, self.dp_id)
+        rm = RouteMod(RMT_ADD, dp_id)
         rm.set_table(self.VLAN_MPLS_TABLE)
         rm.add_match(Match.ETHERTYPE(ETHERTYPE_ARP))
         rm.add_action(Action.GOTO(self.VLAN_TABLE))
         rm.add_option(self.CONTROLLER_PRIORITY)
         rms.append(rm)
-        rm = RouteMod(RMT_ADD, self.dp_id)
+        rm = RouteMod(RMT_ADD, dp_id)
         rm.set_table(self.VLAN_MPLS_TABLE)
         rm.add_match(Match.ETHERTYPE(0x8100))
         rm.add_action(Action.GOTO(self.VLAN_TABLE))
@@ -541,14 +663,14 @@ class CorsaMultitableRouteModTranslator(RouteModTranslator):
 
         ## Ether type table 3
         # ARP
-        rm = RouteMod(RMT_ADD, self.dp_id)
+        rm = RouteMod(RMT_ADD, dp_id)
         rm.set_table(self.ETHER_TABLE)
         rm.add_match(Match.ETHERTYPE(ETHERTYPE_ARP))
         rm.add_action(Action.CONTROLLER())
         rm.add_option(self.CONTROLLER_PRIORITY)
         rms.append(rm)
         # IPv4
-        rm = RouteMod(RMT_ADD, self.dp_id)
+        rm = RouteMod(RMT_ADD, dp_id)
         rm.set_table(self.ETHER_TABLE)
         rm.add_match(Match.ETHERTYPE(ETHERTYPE_IP))
         rm.add_option(self.CONTROLLER_PRIORITY)
@@ -556,14 +678,14 @@ class CorsaMultitableRouteModTranslator(RouteModTranslator):
         rms.append(rm)
 
         # COS table 5 (just map to FIB table)
-        rm = RouteMod(RMT_ADD, self.dp_id)
+        rm = RouteMod(RMT_ADD, dp_id)
         rm.set_table(self.COS_MAP_TABLE)
         rm.add_action(Action.GOTO(self.FIB_TABLE))
         rm.add_option(self.DROP_PRIORITY)
         rms.append(rm)
 
         ## Local table temporary catch-all entry (table 9)
-        rm = RouteMod(RMT_ADD, self.dp_id)
+        rm = RouteMod(RMT_ADD, dp_id)
         rm.set_table(self.LOCAL_TABLE)
         rm.add_action(Action.CONTROLLER())
         rm.add_option(self.CONTROLLER_PRIORITY)
@@ -571,38 +693,36 @@ class CorsaMultitableRouteModTranslator(RouteModTranslator):
 
         return rms
 
-    def _send_rm_with_matches(self, rm, out_port, entries):
+    def _send_rm_with_matches(self, rm, out_port, ports):
         rms = []
-        for entry in entries:
-            if out_port != entry.dp_port:
-                if (entry.get_status() == RFENTRY_ACTIVE or
-                    entry.get_status() == RFISL_ACTIVE):
-                    dst_eth = None
-                    actions = rm.actions
-                    rm.set_actions(None)
-                    for action_dict in actions:
-                        action = Action.from_dict(action_dict)
-                        action_type = action.type_to_str(action._type)
-                        if action_type == 'RFAT_SET_ETH_DST':
-                            dst_eth = action.get_value()
-                        elif action_type == 'RFAT_SWAP_VLAN_ID':
-                            vlan_id = action.get_value()
-                            action = Action.SET_VLAN_ID(vlan_id)
-                        rm.add_action(action)
-                    if dst_eth not in self.actions_to_groupid:
-                        self.last_groupid += 1
-                        new_groupid = self.last_groupid
-                        self.actions_to_groupid[dst_eth] = new_groupid
-                        group_rm = RouteMod(RMT_ADD_GROUP, self.dp_id)
-                        group_rm.set_group(new_groupid)
-                        group_rm.set_actions(rm.actions)
-                        rms.append(group_rm)
-                        self.log.info("adding new group %u for Ethernet destination %s" % (
-                            new_groupid, dst_eth))
-                    rm.set_actions(None)
-                    rm.add_action(Action.GROUP(self.actions_to_groupid[dst_eth]))
-                    rms.append(rm)
-                    break
+        for (dp_port, eth_addr) in ports:
+            if out_port != dp_port:
+                dst_eth = None
+                actions = rm.actions
+                rm.set_actions(None)
+                for action_dict in actions:
+                    action = Action.from_dict(action_dict)
+                    action_type = action.type_to_str(action._type)
+                    if action_type == 'RFAT_SET_ETH_DST':
+                        dst_eth = action.get_value()
+                    elif action_type == 'RFAT_SWAP_VLAN_ID':
+                        vlan_id = action.get_value()
+                        action = Action.SET_VLAN_ID(vlan_id)
+                    rm.add_action(action)
+                if dst_eth not in self.actions_to_groupid:
+                    self.last_groupid += 1
+                    new_groupid = self.last_groupid
+                    self.actions_to_groupid[dst_eth] = new_groupid
+                    group_rm = RouteMod(RMT_ADD_GROUP, self.dp_id)
+                    group_rm.set_group(new_groupid)
+                    group_rm.set_actions(rm.actions)
+                    rms.append(group_rm)
+                    self.log.info("adding new group %u for Ethernet destination %s" % (
+                        new_groupid, dst_eth))
+                rm.set_actions(None)
+                rm.add_action(Action.GROUP(self.actions_to_groupid[dst_eth]))
+                rms.append(rm)
+                break
         return rms
 
     def handle_controller_route_mod(self, entry, rm):
@@ -653,22 +773,22 @@ class CorsaMultitableRouteModTranslator(RouteModTranslator):
 
     def handle_route_mod(self, entry, rm):
         rms = []
-        entries = self.rftable.get_entries(dp_id=entry.dp_id,
-                                           ct_id=entry.ct_id)
-        entries.extend(self.isltable.get_entries(dp_id=entry.dp_id,
-                                                 ct_id=entry.ct_id))
+        ports = self.get_active_ports()
 
         # Replace the VM port with the datapath port
         rm.add_action(Action.OUTPUT(entry.dp_port))
 
         rm.set_table(self.FIB_TABLE)
 
-        rms.extend(self._send_rm_with_matches(rm, entry.dp_port, entries))
+        rms.extend(self._send_rm_with_matches(rm, entry.dp_port, ports))
         return rms
 
 class RFServer(RFProtocolFactory, IPC.IPCMessageProcessor):
 
-    def __init__(self, configfile, islconffile, multitabledps, satellitedps, fpconf):
+    def __init__(self, configfile, islconffile, multitabledps, satellitedps, fpconf,
+                 shards=0, batch_size=0, batch_interval=0.005, reconcile=False,
+                 coalesce_interval=0, window=0, hwm=1000,
+                 aggregate_acks=False, profiler=None):
         self.config = RFConfig(configfile)
         self.islconf = RFISLConf(islconffile)
         self.fpconf = RFFPConf(fpconf)
@@ -688,10 +808,22 @@ class RFServer(RFProtocolFactory, IPC.IPCMessageProcessor):
         self.isltable = RFISLTable()
 
         self.route_mod_translator = {}
+        # With reconcile, a FlowShadow of every configured datapath is kept
+        # and datapaths that went down are reconciled against it when they
+        # reconnect, rather than left with whatever flows they kept.
+        self.reconcile = reconcile
+        self.flow_shadows = {}
+        self.reconcile_dps = set()
 
         # Logging
         self.log = logging.getLogger("rfserver")
 
+        # Started by a ProfileRequest, or SIGUSR1 when run from the command
+        # line
+        if profiler is None:
+            profiler = make_profiler(tempfile.gettempdir(), PROFILE_SECONDS)
+        self.profiler = profiler
+
         if self.satellitedps:
             self.log.info("Datapaths that are ISL satellites: %s",
                           list(self.satellitedps))
@@ -713,57 +845,273 @@ class RFServer(RFProtocolFactory, IPC.IPCMessageProcessor):
         else:
             self.log.info("Fastpath is disabled")
         fp_allocate_labels(self.labeller, self.log, self.config, self.fpconf, self.islconf)
+        # Configuration is loaded, write it out if the tables buffer writes
+        for table in (self.config, self.islconf, self.fpconf):
+            table.sync()
 
         self.ack_q = Queue.Queue()
-        self.dp_q = Queue.Queue()
-        self.ipc_lock = threading.Lock()
+        # Serialises port and datapath state changes, which may touch entries
+        # belonging to other datapaths (e.g. both ends of an ISL).
+        self.state_lock = threading.RLock()
         self.routemod_outstanding = threading.Event()
         self.ipc = IPCService.for_server(RFSERVER_ID)
 
-        self.worker = threading.Thread(target=self.dp_worker)
-        self.worker.daemon = True
-        self.worker.start()
+        # In sharded mode messages are processed by one of N workers picked by
+        # (ct_id, dp_id), and RouteMods are sent from N outbound queues picked
+        # the same way. This keeps per-datapath ordering while unrelated
+        # datapaths proceed in parallel.
+        self.shards = shards
+        # With batch_size > 0, RouteMods for the same controller are sent
+        # together as a RouteModBatch of up to batch_size messages, waiting at
+        # most batch_interval seconds for a batch to fill.
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.dp_qs = [Queue.Queue() for _ in xrange(max(shards, 1))]
+        self.dp_q = self.dp_qs[0]
+        self.workers = []
+        for dp_q in self.dp_qs:
+            self._start_worker(self.dp_worker, dp_q)
+        self.shard_qs = [Queue.Queue() for _ in xrange(shards)]
+        for shard_q in self.shard_qs:
+            self._start_worker(self.shard_worker, shard_q)
+        if shards:
+            self.log.info("Processing messages on %d shards", shards)
+        # With coalesce_interval > 0, client RouteMods adding or deleting a
+        # flow are held for that many seconds per datapath, and only the last
+        # RouteMod for each (table, matches) is translated and sent.
+        self.coalesce_interval = coalesce_interval
+        self.coalesce_lock = threading.Lock()
+        # Without shards, coalesce_worker flushes held RouteMods alongside
+        # the thread processing messages, this keeps them in order
+        self.coalesce_flush_lock = threading.Lock()
+        self.coalesce_pending = {}
+        self.coalesce_q = Queue.Queue()
+        if coalesce_interval > 0:
+            self._start_worker(self.coalesce_worker, self.coalesce_q)
+        # With window > 0, messages for each controller are sent from its own
+        # ControllerQueue, with at most window awaiting an ack from rfproxy.
+        # Acks to clients are then held per controller while it has more than
+        # hwm RouteMods outstanding, rather than until any rfproxy acks.
+        self.window = window
+        self.hwm = hwm
+        self.ct_lock = threading.Lock()
+        self.ct_queues = {}
+        if window > 0:
+            self.log.info("Flow control: window=%d, hwm=%d" % (window, hwm))
+        # With aggregate_acks, RouteMod acks sent together to the same client
+        # port are merged into one ack carrying their count.
+        self.aggregate_acks = aggregate_acks
+
+        self.send_time = SEND_SECONDS.labels()
+        QUEUE_DEPTH.labels('dp_q').set_function(
+            lambda: sum(dp_q.qsize() for dp_q in self.dp_qs))
+        QUEUE_DEPTH.labels('ack_q').set_function(self.ack_q.qsize)
+        QUEUE_DEPTH.labels('shard_q').set_function(
+            lambda: sum(shard_q.qsize() for shard_q in self.shard_qs))
+        QUEUE_DEPTH.labels('controller_q').set_function(
+            lambda: sum(ct_queue.queue.qsize() + len(ct_queue.overflow)
+                        for ct_queue in self.ct_queues.values()))
 
         self.ipc.listen(RFCLIENT_RFSERVER_CHANNEL, self, self, False)
         self.ipc.listen(RFSERVER_RFPROXY_CHANNEL, self, self, True)
 
     def ipc_send(self, channel, channel_id, msg):
-        self.ipc_lock.acquire()
+        # Not serialised here, the IPC services are safe to send from any
+        # thread, and a send waiting on one peer (e.g. a full shm ring) must
+        # not hold up the others
         self.ipc.send(channel, channel_id, msg)
-        self.ipc_lock.release()
 
-    def dp_worker(self):
+    def _start_worker(self, target, queue):
+        name = "rfserver-%s-%d" % (target.__name__, len(self.workers))
+        worker = threading.Thread(target=target, args=(queue,), name=name)
+        worker.daemon = True
+        worker.start()
+        self.workers.append(worker)
+
+    def _shard_of(self, ct_id, dp_id, queues):
+        return queues[hash((ct_id, dp_id)) % len(queues)]
+
+    def controller_queue(self, ct_id):
+        ct_id = str(ct_id)
+        with self.ct_lock:
+            ct_queue = self.ct_queues.get(ct_id)
+            if ct_queue is None:
+                ct_queue = ControllerQueue(ct_id, self.ipc_send,
+                                           self.send_acks, self.window,
+                                           self.hwm, self.log)
+                self.ct_queues[ct_id] = ct_queue
+            return ct_queue
+
+    def send_to_controller(self, ct_id, msg, count=1):
+        """Sends msg, holding count RouteMods, to a controller's rfproxy"""
+        start = self.send_time.start()
+        if self.window > 0:
+            self.controller_queue(ct_id).put(msg, count)
+        else:
+            self.ipc_send(RFSERVER_RFPROXY_CHANNEL, ct_id, msg)
+        self.send_time.stop(start)
+
+    def dp_worker(self, dp_q):
+        if self.batch_size > 0:
+            self.dp_batch_worker(dp_q)
+        while True:
+            (ct_id, rm) = dp_q.get(block=True)
+            try:
+                self.send_to_controller(ct_id, rm)
+            except Exception:
+                self.log.exception("Failed to send to controller %s:\n%s" %
+                                   (ct_id, rm))
+            dp_q.task_done()
+
+    def dp_batch_worker(self, dp_q):
+        def flush(ct_id, batch):
+            try:
+                self.send_route_mod_batch(ct_id, batch)
+            except Exception:
+                self.log.exception("Failed to send %d RouteMods to "
+                                   "controller %s" % (len(batch), ct_id))
+            for rm in batch:
+                dp_q.task_done()
+
+        while True:
+            batches = {}
+            item = dp_q.get(block=True)
+            deadline = time.time() + self.batch_interval
+            while True:
+                (ct_id, rm) = item
+                batch = batches.setdefault(ct_id, [])
+                batch.append(rm)
+                if len(batch) >= self.batch_size:
+                    flush(ct_id, batch)
+                    del batches[ct_id]
+                    if not batches:
+                        # Nothing left waiting, start a new round
+                        break
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = dp_q.get(block=True, timeout=timeout)
+                except Queue.Empty:
+                    break
+            for (ct_id, batch) in batches.iteritems():
+                flush(ct_id, batch)
+
+    def send_route_mod_batch(self, ct_id, rms):
+        if len(rms) == 1:
+            msg = rms[0]
+        else:
+            msg = RouteModBatch()
+            for rm in rms:
+                msg.add_routemod(rm)
+        self.send_to_controller(ct_id, msg, len(rms))
+
+    def shard_worker(self, shard_q):
         while True:
-            (ct_id, rm) = self.dp_q.get(block=True)
-            self.ipc_send(RFSERVER_RFPROXY_CHANNEL, ct_id, rm)
-            self.dp_q.task_done()
+            (function, args) = shard_q.get(block=True)
+            try:
+                function(*args)
+            except Exception:
+                self.log.exception("Failed to process message:\n%s" %
+                                   args[-1])
+            shard_q.task_done()
 
     def send_routemod_acks(self):
+        acks = []
         while not self.ack_q.empty():
-            (vm_id, ack) = self.ack_q.get()
-            self.ipc_send(RFCLIENT_RFSERVER_CHANNEL, vm_id, ack)
+            acks.append(self.ack_q.get())
+        self.send_acks(acks)
+        for ack in acks:
             self.ack_q.task_done()
 
+    def send_acks(self, acks):
+        """Sends a list of (vm_id, PortConfig) RouteMod acks"""
+        if self.aggregate_acks:
+            merged = collections.OrderedDict()
+            for (vm_id, ack) in acks:
+                key = (vm_id, ack.get_vm_port())
+                if key in merged:
+                    first = merged[key][1]
+                    first.set_count(first.get_count() + ack.get_count())
+                else:
+                    merged[key] = (vm_id, ack)
+            acks = merged.values()
+        for (vm_id, ack) in acks:
+            self.ipc_send(RFCLIENT_RFSERVER_CHANNEL, vm_id, ack)
+
     def process(self, from_, to, channel, msg):
+        if self.shards:
+            key = self.shard_key(channel, msg)
+            if key is not None:
+                shard_q = self._shard_of(key[0], key[1], self.shard_qs)
+                shard_q.put((self.process_message, (from_, to, channel, msg)))
+                return
+        self.process_message(from_, to, channel, msg)
+
+    def shard_key(self, channel, msg):
+        """Returns the (ct_id, dp_id) a message should be processed under.
+
+        Messages about a client port use the datapath that port is configured
+        against, so that both halves of an association end up on the same
+        shard. Returns None for messages that can be processed immediately.
+        """
+        type_ = msg.get_type()
+        if type_ in (DATAPATH_PORT_REGISTER, DATAPATH_DOWN):
+            return (msg.get_ct_id(), msg.get_dp_id())
+        if channel == RFCLIENT_RFSERVER_CHANNEL and type_ == ROUTE_MOD:
+            vm_id, vm_port = msg.get_id(), msg.get_vm_port()
+        elif type_ in (PORT_REGISTER, VIRTUAL_PLANE_MAP):
+            vm_id, vm_port = msg.get_vm_id(), msg.get_vm_port()
+        else:
+            return None
+        config_entry = self.config.get_config_for_vm_port(vm_id, vm_port)
+        if config_entry is None:
+            return (None, vm_id)
+        return (config_entry.ct_id, config_entry.dp_id)
+
+    def process_message(self, from_, to, channel, msg):
         type_ = msg.get_type()
-        if channel == RFCLIENT_RFSERVER_CHANNEL:
+        name = MESSAGE_NAMES.get(type_, str(type_))
+        MESSAGES.labels(channel, name).inc()
+        timer = PROCESS_SECONDS.labels(name)
+        start = timer.start()
+        if type_ == PROFILE_REQUEST:
+            if from_ != RFPROFILE_ID:
+                self.log.warning("Ignored ProfileRequest from %s, only %s "
+                                 "may profile rfserver" %
+                                 (from_, RFPROFILE_ID))
+            elif not self.profiler.start(msg.get_duration()):
+                self.log.warning("Profiler already running, ignored "
+                                 "request from %s" % from_)
+        elif channel == RFCLIENT_RFSERVER_CHANNEL:
             if type_ == ROUTE_MOD:
-                self.register_route_mod(msg)
+                if self.coalesce_interval > 0:
+                    self.coalesce_route_mod(msg)
+                else:
+                    self.register_route_mod(msg)
             elif type_ == PORT_REGISTER:
-                self.register_vm_port(msg.get_vm_id(), msg.get_vm_port(),
-                                      msg.get_hwaddress())
+                with self.state_lock:
+                    self.register_vm_port(msg.get_vm_id(), msg.get_vm_port(),
+                                          msg.get_hwaddress())
         elif channel == RFSERVER_RFPROXY_CHANNEL:
             if type_ == DATAPATH_PORT_REGISTER:
-                self.register_dp_port(msg.get_ct_id(),
-                                      msg.get_dp_id(),
-                                      msg.get_dp_port())
+                with self.state_lock:
+                    self.register_dp_port(msg.get_ct_id(),
+                                          msg.get_dp_id(),
+                                          msg.get_dp_port())
             elif type_ == DATAPATH_DOWN:
-                self.set_dp_down(msg.get_ct_id(), msg.get_dp_id())
+                with self.state_lock:
+                    self.set_dp_down(msg.get_ct_id(), msg.get_dp_id())
             elif type_ == VIRTUAL_PLANE_MAP:
-                self.map_port(msg.get_vm_id(), msg.get_vm_port(),
-                              msg.get_vs_id(), msg.get_vs_port())
+                with self.state_lock:
+                    self.map_port(msg.get_vm_id(), msg.get_vm_port(),
+                                  msg.get_vs_id(), msg.get_vs_port())
             elif type_ == ROUTE_MOD:
-                self.send_routemod_acks()
+                if self.window > 0:
+                    self.controller_queue(from_).ack()
+                else:
+                    self.send_routemod_acks()
+        timer.stop(start)
 
     # Port register methods
     def register_vm_port(self, vm_id, vm_port, eth_addr):
@@ -793,6 +1141,7 @@ class RFServer(RFProtocolFactory, IPC.IPCMessageProcessor):
                           "vm_port=%i, eth_addr=%s)" % (format_id(vm_id),
                                                         vm_port, eth_addr))
         elif action == REGISTER_ASSOCIATED:
+            entry = entry.copy()
             entry.associate(vm_id, vm_port, eth_addr=eth_addr)
             self.rftable.set_entry(entry)
             self.log.info("Registering client port and associating to "
@@ -802,12 +1151,90 @@ class RFServer(RFProtocolFactory, IPC.IPCMessageProcessor):
                              format_id(entry.dp_id), entry.dp_port))
 
     def queue_routemod_ack(self, ct_id, vm_id, vm_port):
-        self.ack_q.put((str(vm_id),
-                        PortConfig(vm_id=vm_id, vm_port=vm_port, operation_id=PCT_ROUTEMOD_ACK)))
+        ack = PortConfig(vm_id=vm_id, vm_port=vm_port,
+                         operation_id=PCT_ROUTEMOD_ACK, count=1)
+        if self.window > 0:
+            self.controller_queue(ct_id).queue_ack(str(vm_id), ack)
+        else:
+            self.ack_q.put((str(vm_id), ack))
 
     def send_route_mod(self, ct_id, rm):
         rm.add_option(Option.CT_ID(ct_id))
-        self.dp_q.put((str(ct_id), rm))
+        dp_q = self._shard_of(ct_id, rm.get_id(), self.dp_qs)
+        shadow = self.flow_shadows.get(rm.get_id())
+        if shadow is None:
+            self._queue_route_mod(dp_q, ct_id, rm)
+            return
+        with shadow.lock:
+            # Adding an identical flow or group again is a no-op
+            if shadow.apply(rm):
+                self._queue_route_mod(dp_q, ct_id, rm)
+
+    def _queue_route_mod(self, dp_q, ct_id, rm):
+        if self.window > 0:
+            self.controller_queue(ct_id).reserve(dp_q, (str(ct_id), rm))
+        else:
+            dp_q.put((str(ct_id), rm))
+
+    def coalesce_route_mod(self, rm):
+        """Holds rm until its datapath's coalescing window closes.
+
+        A later RouteMod with the same table and matches replaces rm, which
+        is acknowledged there and then without being translated. The client
+        can so keep sending while the window is open.
+        """
+        entry = self.rftable.get_entry_by_vm_port(rm.get_id(),
+                                                  rm.get_vm_port())
+        if entry is None or entry.get_status() == RFENTRY_IDLE_VM_PORT:
+            self.register_route_mod(rm)
+            return
+        if rm.get_mod() not in (RMT_ADD, RMT_DELETE):
+            # Not held, but still sent after those already held
+            with self.coalesce_flush_lock:
+                self.flush_coalesced(entry.dp_id)
+            self.register_route_mod(rm)
+            return
+        key = (rm.get_table(), tlv_key(rm.get_matches()))
+        with self.coalesce_lock:
+            pending = self.coalesce_pending.get(entry.dp_id)
+            if pending is None:
+                pending = collections.OrderedDict()
+                self.coalesce_pending[entry.dp_id] = pending
+                self.coalesce_q.put((time.time() + self.coalesce_interval,
+                                     entry.ct_id, entry.dp_id))
+            old_rm = pending.pop(key, None)
+            pending[key] = rm
+        if old_rm is not None:
+            self.queue_routemod_ack(entry.ct_id, old_rm.get_id(),
+                                    old_rm.get_vm_port())
+
+    def coalesce_worker(self, coalesce_q):
+        while True:
+            (deadline, ct_id, dp_id) = coalesce_q.get(block=True)
+            delay = deadline - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            if self.shards:
+                # Flushed by the datapath's shard, in order with the rest of
+                # its messages
+                shard_q = self._shard_of(ct_id, dp_id, self.shard_qs)
+                shard_q.put((self.flush_coalesced, (dp_id,)))
+            else:
+                with self.coalesce_flush_lock:
+                    self.flush_coalesced(dp_id)
+            coalesce_q.task_done()
+
+    def flush_coalesced(self, dp_id):
+        """Registers the RouteMods held for dp_id, if any"""
+        with self.coalesce_lock:
+            pending = self.coalesce_pending.pop(dp_id, None)
+        if pending is None:
+            return
+        for rm in pending.itervalues():
+            try:
+                self.register_route_mod(rm)
+            except Exception:
+                self.log.exception("Error processing RouteMod")
 
     # Handle RouteMod messages (type ROUTE_MOD)
     #
@@ -835,19 +1262,24 @@ class RFServer(RFProtocolFactory, IPC.IPCMessageProcessor):
         rms = []
 
         if rm.get_mod() is RMT_CONTROLLER:
-            rms.extend(translator.handle_controller_route_mod(entry, rm))
+            rms.extend(self.translate(translator,
+                                      translator.handle_controller_route_mod,
+                                      entry, rm))
 
         elif rm.get_mod() in (RMT_ADD, RMT_DELETE):
-            rms.extend(translator.handle_route_mod(entry, rm))
+            rms.extend(self.translate(translator, translator.handle_route_mod,
+                                      entry, rm))
 
             remote_dps = self.isltable.get_entries(rem_ct=entry.ct_id,
                                                    rem_id=entry.dp_id)
 
             for r in remote_dps:
                 if r.get_status() == RFISL_ACTIVE:
-                    local_rm = copy.deepcopy(rm)
+                    local_rm = RouteModOverlay(rm)
                     remote_translator = self.route_mod_translator[int(r.dp_id)]
-                    rms.extend(remote_translator.handle_isl_route_mod(r, local_rm))
+                    rms.extend(self.translate(
+                        remote_translator,
+                        remote_translator.handle_isl_route_mod, r, local_rm))
         else:
             self.log.info("Received RouteMod with unknown type: %s " % rm)
 
@@ -856,6 +1288,15 @@ class RFServer(RFProtocolFactory, IPC.IPCMessageProcessor):
 
         self.queue_routemod_ack(entry.ct_id, vm_id, vm_port)
 
+    def translate(self, translator, handler, *args):
+        """Calls one of translator's methods, returning the RouteMods"""
+        with translator.lock:
+            start = translator.translate_time.start()
+            rms = handler(*args)
+            translator.translate_time.stop(start)
+        translator.translated.inc(len(rms))
+        return rms
+
     # DatapathPortRegister methods
     def register_dp_port(self, ct_id, dp_id, dp_port):
         stop = self.config_dp(ct_id, dp_id)
@@ -890,6 +1331,7 @@ class RFServer(RFProtocolFactory, IPC.IPCMessageProcessor):
             self.log.info("Registering datapath port as idle (dp_id=%s, "
                           "dp_port=%i)" % (format_id(dp_id), dp_port))
         elif action == REGISTER_ASSOCIATED:
+            entry = entry.copy()
             entry.associate(dp_id, dp_port, ct_id)
             self.rftable.set_entry(entry)
             self.log.info("Registering datapath port and associating to "
@@ -926,6 +1368,7 @@ class RFServer(RFProtocolFactory, IPC.IPCMessageProcessor):
                               "(dp_id=%s, dp_port=%i, eth_addr=%s)" %
                               (format_id(dp_id), dp_port, eth_addr))
             elif entry.get_status() == RFISL_IDLE_DP_PORT:
+                entry = entry.copy()
                 entry.associate(ct_id, dp_id, dp_port, eth_addr)
                 self.isltable.set_entry(entry)
                 n_entry = self.isltable.get_entry_by_remote(entry.ct_id,
@@ -942,6 +1385,7 @@ class RFServer(RFProtocolFactory, IPC.IPCMessageProcessor):
                                          rem_eth_addr=entry.eth_addr)
                     self.isltable.set_entry(n_entry)
                 else:
+                    n_entry = n_entry.copy()
                     n_entry.associate(ct_id, dp_id, dp_port, eth_addr)
                     self.isltable.set_entry(n_entry)
                 self.log.info("Registering ISL port and associating to "
@@ -951,11 +1395,33 @@ class RFServer(RFProtocolFactory, IPC.IPCMessageProcessor):
                                                 dp_port, entry.ct_id,
                                                 format_id(entry.dp_id),
                                                 entry.dp_port))
+                self.invalidate_active_ports(entry.dp_id)
+            self.invalidate_active_ports(dp_id)
+
+    def invalidate_active_ports(self, dp_id):
+        """Must be called after a port of dp_id is activated or put down"""
+        translator = self.route_mod_translator.get(dp_id)
+        if translator is not None:
+            translator.invalidate_active_ports()
 
     def send_datapath_config_messages(self, ct_id, dp_id):
-        rms = self.route_mod_translator[dp_id].configure_datapath()
+        translator = self.route_mod_translator[dp_id]
+        rms = self.translate(translator, translator.configure_datapath)
+        shadow = self.flow_shadows.get(dp_id)
+        if shadow is not None and dp_id in self.reconcile_dps:
+            self.reconcile_dps.discard(dp_id)
+            with shadow.lock:
+                delta = shadow.reconcile(rms)
+            self.log.info("Reconciling datapath (dp_id=%s, changes=%d)" %
+                          (format_id(dp_id), len(delta)))
+            for rm in delta:
+                self.send_route_mod(ct_id, rm)
+            return
         for rm in rms:
             self.send_route_mod(ct_id, rm)
+        if shadow is not None:
+            with shadow.lock:
+                shadow.set_base(rms)
 
     def config_dp(self, ct_id, dp_id):
         if is_rfvs(dp_id):
@@ -963,8 +1429,12 @@ class RFServer(RFProtocolFactory, IPC.IPCMessageProcessor):
         else:
             if (self.rftable.is_dp_registered(ct_id, dp_id) or
                 self.isltable.is_dp_registered(ct_id, dp_id)):
-                if dp_id not in self.route_mod_translator:
+                if dp_id in self.reconcile_dps:
+                    self.send_datapath_config_messages(ct_id, dp_id)
+                elif dp_id not in self.route_mod_translator:
                     self.log.info("Configuring datapath (dp_id=%s)" % format_id(dp_id))
+                    if self.reconcile:
+                        self.flow_shadows[dp_id] = FlowShadow(dp_id)
                     if dp_id in self.multitabledps:
                         self.route_mod_translator[dp_id] = NoviFlowMultitableRouteModTranslator(
                             dp_id, ct_id, self.rftable, self.isltable, self.config, self.islconf,
@@ -985,11 +1455,17 @@ class RFServer(RFProtocolFactory, IPC.IPCMessageProcessor):
             # For every port registered in that datapath, put it down
             self.set_dp_port_down(entry.ct_id, entry.dp_id, entry.dp_port)
         for entry in self.isltable.get_dp_entries(ct_id, dp_id):
+            entry = entry.copy()
             entry.make_idle(RFISL_IDLE_REMOTE)
             self.isltable.set_entry(entry)
         for entry in self.isltable.get_entries(rem_ct=ct_id, rem_id=dp_id):
+            entry = entry.copy()
             entry.make_idle(RFISL_IDLE_DP_PORT)
             self.isltable.set_entry(entry)
+            self.invalidate_active_ports(entry.dp_id)
+        self.invalidate_active_ports(dp_id)
+        if dp_id in self.flow_shadows:
+            self.reconcile_dps.add(dp_id)
         self.log.info("Datapath down (dp_id=%s)" % format_id(dp_id))
 
     def set_dp_port_down(self, ct_id, dp_id, dp_port):
@@ -998,8 +1474,10 @@ class RFServer(RFProtocolFactory, IPC.IPCMessageProcessor):
             # If the DP port is registered, delete it and leave only the
             # associated VM port. Reset this VM port so it can be reused.
             vm_id, vm_port = entry.vm_id, entry.vm_port
+            entry = entry.copy()
             entry.make_idle(RFENTRY_IDLE_VM_PORT)
             self.rftable.set_entry(entry)
+            self.invalidate_active_ports(dp_id)
             if vm_id is not None:
                 self.reset_vm_port(vm_id, vm_port)
             self.log.debug("Datapath port down (dp_id=%s, dp_port=%i)" %
@@ -1019,8 +1497,10 @@ class RFServer(RFProtocolFactory, IPC.IPCMessageProcessor):
         entry = self.rftable.get_entry_by_vm_port(vm_id, vm_port)
         if entry is not None and entry.get_status() == RFENTRY_ASSOCIATED:
             # If the association is valid, activate it
+            entry = entry.copy()
             entry.activate(vs_id, vs_port)
             self.rftable.set_entry(entry)
+            self.invalidate_active_ports(entry.dp_id)
             msg = DataPlaneMap(ct_id=entry.ct_id,
                                dp_id=entry.dp_id, dp_port=entry.dp_port,
                                vs_id=vs_id, vs_port=vs_port)
@@ -1035,6 +1515,14 @@ class RFServer(RFProtocolFactory, IPC.IPCMessageProcessor):
                            format_id(entry.dp_id), entry.dp_port,
                            format_id(entry.vs_id), entry.vs_port))
 
+def make_profiler(directory, duration):
+    translators = (DefaultRouteModTranslator, SatelliteRouteModTranslator,
+                   NoviFlowMultitableRouteModTranslator,
+                   CorsaMultitableRouteModTranslator)
+    return SamplingProfiler(PROFILED_THREADS, duration, directory, "rfserver",
+                            track=translators,
+                            log=logging.getLogger("rfserver"))
+
 if __name__ == "__main__":
     description = 'RFServer co-ordinates RFClient and RFProxy instances, ' \
                   'listens for route updates, and configures flow tables'
@@ -1054,6 +1542,57 @@ if __name__ == "__main__":
                         help='List of datapaths that default forward to ISL peer')
     parser.add_argument('-f', '--fastpaths', default='',
                         help='List of "fastpath" link(s) to the controller')
+    parser.add_argument('-n', '--shards', type=int, default=0,
+                        help='Number of per-datapath worker threads '
+                             '(0 processes messages on the IPC threads)')
+    parser.add_argument('-b', '--batch', type=int, default=0,
+                        help='Maximum number of RouteMods sent to a controller '
+                             'in one batch (0 disables batching)')
+    parser.add_argument('--batch-ms', type=float, default=5,
+                        help='Maximum time in milliseconds to wait for a '
+                             'batch of RouteMods to fill')
+    parser.add_argument('-r', '--reconcile', action='store_true',
+                        help='Track the flows installed on each datapath and '
+                             'only send changes when a datapath reconnects')
+    parser.add_argument('-c', '--coalesce-ms', type=float, default=0,
+                        help='Time in milliseconds to hold RouteMods for a '
+                             'datapath, sending only the last for each flow '
+                             '(0 disables coalescing)')
+    parser.add_argument('-w', '--window', type=int, default=0,
+                        help='Maximum number of messages awaiting an ack from '
+                             'each controller (0 disables flow control)')
+    parser.add_argument('--hwm', type=int, default=1000,
+                        help='Number of RouteMods outstanding for a controller '
+                             'before acks to its clients are held')
+    parser.add_argument('-a', '--aggregate-acks', action='store_true',
+                        help='Send one ack per client port for all the '
+                             'RouteMods it covers')
+    parser.add_argument('--metrics-port', type=int, default=0,
+                        help='Port to serve metrics on, in the Prometheus '
+                             'text format (0 disables the endpoint)')
+    parser.add_argument('--profile-dir', default=tempfile.gettempdir(),
+                        help='Directory to write profiles to, a profile is '
+                             'taken on SIGUSR1 or a ProfileRequest')
+    parser.add_argument('--profile-seconds', type=float,
+                        default=PROFILE_SECONDS,
+                        help='Default time in seconds to profile for')
 
     args = parser.parse_args()
-    server = RFServer(args.configfile, args.islconfig, args.multitabledps, args.satellitedps, args.fastpaths)
+    if args.metrics_port:
+        metrics.serve(args.metrics_port)
+        logging.getLogger("rfserver").info("Serving metrics on port %d",
+                                           args.metrics_port)
+    profiler = make_profiler(args.profile_dir, args.profile_seconds)
+    on_signal(signal.SIGUSR1, profiler.start)
+    # RFServer blocks listening for messages, so it runs on another thread
+    # and the main thread stays free to handle SIGUSR1
+    server = threading.Thread(target=RFServer, name="rfserver-main",
+                              args=(args.configfile, args.islconfig,
+                                    args.multitabledps, args.satellitedps,
+                                    args.fastpaths, args.shards, args.batch,
+                                    args.batch_ms / 1000.0, args.reconcile,
+                                    args.coalesce_ms / 1000.0, args.window,
+                                    args.hwm, args.aggregate_acks, profiler))
+    server.daemon = True
+    server.start()
+    wait_for(server)
@@ -1,6 +1,9 @@
+import logging
+
 from rflib.defs import *
+import rflib.metrics as metrics
 
-if DB_TYPE == 'memory':
+if DB_TYPE in ('memory', 'memory-native'):
     from MemoryTable import MemoryTable as TableBase
 else:
     from MongoTable import MongoTable as TableBase
@@ -19,6 +22,16 @@ RFISLCONFENTRY = 2
 RFISLENTRY = 3
 RFFPCONFENTRY = 4
 
+_missing = object()
+
+log = logging.getLogger("rftable")
+
+GET_ENTRIES = metrics.counter('rftable_get_entries_total',
+                              'Calls to EntryTable.get_entries', ('table',))
+GET_ENTRIES_RESULTS = metrics.histogram('rftable_get_entries_results',
+                                        'Entries returned by get_entries '
+                                        '(sampled)', ('table',), unit=1)
+
 class EntryFactory:
     @staticmethod
     def make(type_):
@@ -34,21 +47,44 @@ class EntryFactory:
             return RFFPConfEntry()
 
 class EntryTable(TableBase):
+    # Field combinations that are commonly queried together. Backends may use
+    # these to avoid scanning the whole table on lookups.
+    INDEXES = ()
+    # Field combinations that identify at most one entry. MongoTable enforces
+    # these with unique indexes.
+    UNIQUE_INDEXES = ()
+
     def __init__(self, name, entry_type):
-        TableBase.__init__(self, name)
+        TableBase.__init__(self, name, indexes=self.INDEXES,
+                           unique_indexes=self.UNIQUE_INDEXES)
         self.entry_type = entry_type
-
-    def get_entries(self, **kwargs):
-        results = self.get_dicts(**kwargs)
-        entries = []
-        for result in results:
-            entry = EntryFactory.make(self.entry_type)
-            entry.from_dict(result)
-            entries.append(entry)
+        self._calls = GET_ENTRIES.labels(name)
+        self._results = GET_ENTRIES_RESULTS.labels(name)
+
+    def get_entries(self, fields=None, **kwargs):
+        """Returns the entries matching kwargs.
+
+        If fields is given only those fields (and id) need to be loaded, and
+        the others may be left unset on the returned entries.
+        """
+        self._calls.inc()
+        if self.native_entries:
+            entries = self.get_objects(**kwargs)
+        else:
+            entries = []
+            for result in self.get_dicts(fields=fields, **kwargs):
+                entry = EntryFactory.make(self.entry_type)
+                entry.from_dict(result)
+                entries.append(entry)
+        if self._results.sampled():
+            self._results.observe(len(entries))
         return entries
 
     def set_entry(self, entry):
-        entry.id = self.set_dict(entry.to_dict())
+        if self.native_entries:
+            self.set_object(entry)
+        else:
+            entry.id = self.set_dict(entry.to_dict())
 
     def remove_entry(self, entry):
         self.remove_id(entry.id)
@@ -61,6 +97,11 @@ class EntryTable(TableBase):
 
 
 class RFTable(EntryTable):
+    INDEXES = (('vm_id', 'vm_port'),
+               ('ct_id', 'dp_id', 'dp_port'),
+               ('ct_id', 'dp_id'),
+               ('vs_id', 'vs_port'))
+
     def __init__(self):
         EntryTable.__init__(self, RFTABLE_NAME, RFENTRY)
 
@@ -90,11 +131,18 @@ class RFTable(EntryTable):
         return self.get_entries(ct_id=ct_id, dp_id=dp_id)
 
     def is_dp_registered(self, ct_id, dp_id):
-        return bool(self.get_dp_entries(ct_id, dp_id))
+        return bool(self.get_entries(fields=('_id',), ct_id=ct_id,
+                                     dp_id=dp_id))
 
 class RFConfig(EntryTable):
+    INDEXES = (('ct_id', 'dp_id'),)
+    UNIQUE_INDEXES = (('vm_id', 'vm_port'),
+                      ('ct_id', 'dp_id', 'dp_port'))
+
     def __init__(self, ifile):
         EntryTable.__init__(self, RFCONFIG_NAME, RFCONFIGENTRY)
+        # The configuration is reloaded from the file on every start
+        self.clear()
         # TODO: perform validation of config
         configfile = file(ifile)
         lines = configfile.readlines()[1:]
@@ -135,6 +183,11 @@ class RFConfig(EntryTable):
         return result
 
 class RFISLTable(EntryTable):
+    INDEXES = (('ct_id', 'dp_id', 'dp_port'),
+               ('ct_id', 'dp_id'),
+               ('rem_ct', 'rem_id', 'rem_port'),
+               ('rem_ct', 'rem_id'))
+
     def __init__(self):
         EntryTable.__init__(self, RFISL_NAME, RFISLENTRY)
 
@@ -156,11 +209,18 @@ class RFISLTable(EntryTable):
         return self.get_entries(ct_id=ct_id, dp_id=dp_id)
 
     def is_dp_registered(self, ct_id, dp_id):
-        return bool(self.get_dp_entries(ct_id, dp_id))
+        return bool(self.get_entries(fields=('_id',), ct_id=ct_id,
+                                     dp_id=dp_id))
 
 class RFISLConf(EntryTable):
+    INDEXES = (('ct_id', 'dp_id', 'dp_port'),
+               ('ct_id', 'dp_id'),
+               ('rem_ct', 'rem_id', 'rem_port'),
+               ('rem_ct', 'rem_id'))
+
     def __init__(self, ifile):
         EntryTable.__init__(self, RFISLCONF_NAME, RFISLCONFENTRY)
+        self.clear()
         # TODO: perform validation of config
         try:
             internalfile = file(ifile)
@@ -194,8 +254,12 @@ class RFISLConf(EntryTable):
         return results
 
 class RFFPConf(EntryTable):
+    INDEXES = (('ct_id', 'dp_id', 'dp_port'),
+               ('ct_id', 'dp_id'))
+
     def __init__(self, ifile):
         EntryTable.__init__(self, RFFPCONF_NAME, RFFPCONFENTRY)
+        self.clear()
         # TODO: perform validation of config
         try:
             internalfile = file(ifile)
@@ -228,15 +292,60 @@ class RFFPConf(EntryTable):
         results = self.get_entries(ct_id=ct, dp_id=dp_id, dp_port=dp_port)
         return results
 
-class BaseEntry:
+class BaseEntry(object):
+    # Entries only carry the fields named in each subclass' __slots__.
+    # Optional fields (e.g. fp_label) are simply left unset until used.
+    __slots__ = ('_owner',)
+
+    def __new__(cls, *args, **kwargs):
+        entry = object.__new__(cls)
+        object.__setattr__(entry, '_owner', None)
+        return entry
+
+    def __setattr__(self, name, value):
+        if self._owner is not None:
+            # Shared with every reader of a native table
+            raise TypeError("%s is stored in table %s, modify a copy()" %
+                            (self.__class__.__name__, self._owner.name))
+        object.__setattr__(self, name, value)
+
+    def set_owner(self, owner):
+        object.__setattr__(self, '_owner', owner)
+
+    def copy(self):
+        # Lists (e.g. fast_paths) are copied too, so that the copy and the
+        # original never share one. Modify them by assigning a new value,
+        # in place changes to a stored entry are not caught.
+        entry = self.__class__.__new__(self.__class__)
+        for field in self.__slots__:
+            if hasattr(self, field):
+                value = getattr(self, field)
+                if isinstance(value, (list, dict)):
+                    value = type(value)(value)
+                object.__setattr__(entry, field, value)
+        return entry
+
     def from_dict(self, data):
-        vars(self).clear()
-        vars(self).update(data)
-        self.id = self._id
-        del self._id
+        unknown = [key for key in data
+                   if key != '_id' and key not in self.__slots__]
+        if unknown:
+            log.warning("Ignoring unknown %s fields %s" %
+                        (self.__class__.__name__, ", ".join(sorted(unknown))))
+        for field in self.__slots__:
+            if field == 'id':
+                value = data.get('_id', _missing)
+            else:
+                value = data.get(field, _missing)
+            if value is not _missing:
+                object.__setattr__(self, field, value)
+            elif hasattr(self, field):
+                object.__delattr__(self, field)
 
     def to_dict(self):
-        data = vars(self).copy()
+        data = {}
+        for field in self.__slots__:
+            if hasattr(self, field):
+                data[field] = getattr(self, field)
         if data['id'] is not None:
             data['_id'] = data['id']
         del data['id']
@@ -244,6 +353,9 @@ class BaseEntry:
 
 
 class RFEntry(BaseEntry):
+    __slots__ = ('id', 'vm_id', 'vm_port', 'ct_id', 'dp_id', 'dp_port',
+                 'vs_id', 'vs_port', 'eth_addr')
+
     def __init__(self, vm_id=None, vm_port=None, ct_id=None, dp_id=None,
                  dp_port=None, vs_id=None, vs_port=None, eth_addr=None):
         self.id = None
@@ -331,6 +443,9 @@ class RFEntry(BaseEntry):
 
 
 class RFISLEntry(BaseEntry):
+    __slots__ = ('id', 'vm_id', 'ct_id', 'dp_id', 'dp_port', 'eth_addr',
+                 'rem_ct', 'rem_id', 'rem_port', 'rem_eth_addr')
+
     def __init__(self, vm_id=None, ct_id=None, dp_id=None,  dp_port=None,
                  eth_addr=None, rem_ct=None, rem_id=None, rem_port=None,
                  rem_eth_addr=None):
@@ -404,6 +519,10 @@ class RFISLEntry(BaseEntry):
 
 
 class RFISLConfEntry(BaseEntry):
+    __slots__ = ('id', 'vm_id', 'ct_id', 'dp_id', 'dp_port', 'eth_addr',
+                 'rem_ct', 'rem_id', 'rem_port', 'rem_eth_addr',
+                 'fast_paths', 'fp_master')
+
     def __init__(self, vm_id=None, ct_id=None, dp_id=None,  dp_port=None,
                  eth_addr=None, rem_ct=None, rem_id=None, rem_port=None,
                  rem_eth_addr=None):
@@ -431,6 +550,9 @@ class RFISLConfEntry(BaseEntry):
         return RFENTRY_ACTIVE
 
 class RFFPConfEntry(BaseEntry):
+    __slots__ = ('id', 'ct_id', 'dp_id', 'dp_port', 'dp0_port',
+                 'fast_paths', 'fp_master')
+
     def __init__(self, ct_id=None, dp_id=None,  dp_port=None,
                  dp0_port=None):
         self.id = None
@@ -449,6 +571,9 @@ class RFFPConfEntry(BaseEntry):
         return RFENTRY_ACTIVE
 
 class RFConfigEntry(BaseEntry):
+    __slots__ = ('id', 'vm_id', 'vm_port', 'ct_id', 'dp_id', 'dp_port',
+                 'fp_label')
+
     def __init__(self, vm_id=None, vm_port=None, ct_id=None, dp_id=None,
                  dp_port=None):
         self.id = None
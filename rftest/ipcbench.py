@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+"""Measures ZeroMQ IPC throughput with each channel dispatch mode.
+
+A client service sends PortRegister messages over loopback TCP to a server
+service, which decodes each one. Run from the repository root:
+
+    PYTHONPATH=. python rftest/ipcbench.py -m 100000
+"""
+import sys
+import time
+import argparse
+import threading
+
+import rflib.ipc.IPCService as IPCService
+import rflib.ipc.ZeroMQIPC as ZeroMQIPC
+from rflib.ipc.RFProtocol import PortRegister
+from rflib.ipc.RFProtocolFactory import RFProtocolFactory
+from rflib.defs import RFCLIENT_RFSERVER_CHANNEL
+
+class DaemonThreading(IPCService.StdThreading):
+    # The services never stop, so let the interpreter exit regardless
+    @staticmethod
+    def Thread(*args, **kwargs):
+        thread = threading.Thread(*args, **kwargs)
+        thread.daemon = True
+        return thread
+
+
+class Counter(RFProtocolFactory):
+    def __init__(self):
+        self.received = 0
+        self.expected = 0
+        self.done = threading.Event()
+
+    def expect(self, count):
+        self.done.clear()
+        self.expected = self.received + count
+
+    def process(self, from_, to, channel, msg):
+        msg.get_hwaddress()
+        self.received += 1
+        if self.received >= self.expected:
+            self.done.set()
+
+
+def run(dispatch, port, count):
+    address = "tcp://127.0.0.1:%d" % port
+    server = ZeroMQIPC.ZeroMQIPCMessageService(address, "bench-server",
+                                               DaemonThreading, True,
+                                               dispatch)
+    client = ZeroMQIPC.ZeroMQIPCMessageService(address, "bench-client",
+                                               DaemonThreading, False,
+                                               dispatch)
+    counter = Counter()
+    server.listen(RFCLIENT_RFSERVER_CHANNEL, counter, counter, False)
+
+    msg = PortRegister(vm_id=0x12a0a0a0a0a0, vm_port=1,
+                       hwaddress="12:a0:a0:a0:a0:a0")
+    # Wait for the client to connect before timing
+    counter.expect(1)
+    client.send(RFCLIENT_RFSERVER_CHANNEL, "bench-server", msg)
+    counter.done.wait()
+
+    counter.expect(count)
+    start = time.time()
+    for i in xrange(count):
+        client.send(RFCLIENT_RFSERVER_CHANNEL, "bench-server", msg)
+    counter.done.wait()
+    return time.time() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='ZeroMQ IPC benchmark')
+    parser.add_argument('-m', '--messages', type=int, default=100000,
+                        help='messages to send with each dispatch mode')
+    parser.add_argument('-p', '--port', type=int, default=25600,
+                        help='first loopback port to use')
+    parser.add_argument('-d', '--dispatch', action='append',
+                        choices=('direct', 'pubsub'),
+                        help='dispatch mode to run, default is both')
+    args = parser.parse_args()
+
+    for (i, dispatch) in enumerate(args.dispatch or ('pubsub', 'direct')):
+        elapsed = run(dispatch, args.port + i, args.messages)
+        print("%-6s %d messages in %.3fs, %.0f msg/s" %
+              (dispatch, args.messages, elapsed, args.messages / elapsed))
+    sys.exit(0)
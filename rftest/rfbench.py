@@ -0,0 +1,414 @@
+#!/usr/bin/env python
+"""Offline benchmark of RFServer's control plane.
+
+RFServer is run in-process against synthetic configuration files and fed a
+stream of PortRegister, DatapathPortRegister, VirtualPlaneMap and RouteMod
+messages. The messages it sends are captured by a fake IPC service, which
+also acknowledges RouteMods the way rfproxy does. No switches, VMs or
+controllers are needed. Run from the repository root:
+
+    python rftest/rfbench.py --dps 100 --ports 20 --routes 10000 -o run.json
+    python rftest/rfbench.py ... --baseline run.json
+
+A stream can be saved with --save-stream and replayed with --stream, along
+with the --config and --islconfig files it was generated for (kept with
+--config-dir).
+"""
+import os
+import sys
+import json
+import time
+import base64
+import Queue
+import logging
+import argparse
+import shutil
+import resource
+import tempfile
+import threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'rfserver')]
+
+import rflib.ipc.IPC as IPC
+import rflib.ipc.IPCService as IPCService
+from rflib.ipc.RFProtocol import *
+from rflib.ipc.RFProtocolFactory import RFProtocolFactory
+from rflib.defs import *
+from rflib.types.Match import *
+from rflib.types.Action import *
+from rflib.types.Option import *
+import rfserver
+
+PERCENTILES = (50, 90, 99)
+
+
+class CaptureIPC(IPC.IPCMessageService):
+    """Counts the messages RFServer sends, acknowledging those sent to
+    rfproxy from a separate thread"""
+
+    def __init__(self):
+        self.server = None
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.routemods = 0
+        self.ack_q = Queue.Queue()
+        worker = threading.Thread(target=self._ack_worker)
+        worker.daemon = True
+        worker.start()
+
+    def listen(self, channel_id, factory, processor, block=True):
+        pass
+
+    def send(self, channel_id, to, msg):
+        type_ = msg.get_type()
+        with self.lock:
+            key = "%s %s" % (channel_id, type_)
+            self.counts[key] = self.counts.get(key, 0) + 1
+            if type_ == ROUTE_MOD:
+                self.routemods += 1
+            elif type_ == ROUTE_MOD_BATCH:
+                self.routemods += len(msg.get_routemods())
+        if type_ in (ROUTE_MOD, ROUTE_MOD_BATCH):
+            self.ack_q.put(to)
+        return True
+
+    def _ack_worker(self):
+        while True:
+            ct_id = self.ack_q.get()
+            self.server.process(ct_id, RFSERVER_ID, RFSERVER_RFPROXY_CHANNEL,
+                                RouteMod())
+            self.ack_q.task_done()
+
+
+class BenchServer(rfserver.RFServer):
+    """RFServer timing each stage a message passes through"""
+
+    def __init__(self, *args):
+        self.timings = {}
+        self.timings_lock = threading.Lock()
+        # id(rm) -> (rm, time) for RouteMods queued to be sent
+        self.queued = {}
+        rfserver.RFServer.__init__(self, *args)
+
+    def record(self, stage, elapsed):
+        with self.timings_lock:
+            self.timings.setdefault(stage, []).append(elapsed)
+
+    def process(self, from_, to, channel, msg):
+        start = time.time()
+        rfserver.RFServer.process(self, from_, to, channel, msg)
+        self.record("process " + label(channel, msg), time.time() - start)
+
+    def process_message(self, from_, to, channel, msg):
+        start = time.time()
+        rfserver.RFServer.process_message(self, from_, to, channel, msg)
+        self.record("handle " + label(channel, msg), time.time() - start)
+
+    def send_route_mod(self, ct_id, rm):
+        with self.timings_lock:
+            self.queued[id(rm)] = (rm, time.time())
+        rfserver.RFServer.send_route_mod(self, ct_id, rm)
+
+    def _dequeued(self, rm):
+        with self.timings_lock:
+            entry = self.queued.pop(id(rm), None)
+        if entry is not None and entry[0] is rm:
+            self.record("queue RouteMod", time.time() - entry[1])
+
+    def send_route_mod_batch(self, ct_id, rms):
+        for rm in rms:
+            self._dequeued(rm)
+        rfserver.RFServer.send_route_mod_batch(self, ct_id, rms)
+
+    def send_to_controller(self, ct_id, msg, count=1):
+        if msg.get_type() == ROUTE_MOD:
+            self._dequeued(msg)
+        rfserver.RFServer.send_to_controller(self, ct_id, msg, count)
+
+
+def label(channel, msg):
+    type_ = msg.get_type()
+    if type_ == ROUTE_MOD and channel == RFSERVER_RFPROXY_CHANNEL:
+        return "RouteMod ack"
+    return {PORT_REGISTER: "PortRegister", PORT_CONFIG: "PortConfig",
+            DATAPATH_PORT_REGISTER: "DatapathPortRegister",
+            DATAPATH_DOWN: "DatapathDown",
+            VIRTUAL_PLANE_MAP: "VirtualPlaneMap",
+            DATA_PLANE_MAP: "DataPlaneMap", ROUTE_MOD: "RouteMod",
+            ROUTE_MOD_BATCH: "RouteModBatch"}.get(type_, str(type_))
+
+def vm_id_of(dp_id):
+    return 0x12a000000000 + dp_id
+
+def write_config(args, directory):
+    """Writes config.csv and islconf.csv for args, returns their paths"""
+    config = os.path.join(directory, "config.csv")
+    with open(config, "w") as f:
+        f.write("vm_id,vm_port,ct_id,dp_id,dp_port\n")
+        for dp_id in xrange(1, args.dps + 1):
+            for port in xrange(1, args.ports + 1):
+                f.write("%x,%d,%d,%x,%d\n" % (vm_id_of(dp_id), port,
+                                              dp_id % args.controllers,
+                                              dp_id, port))
+    islconf = os.path.join(directory, "islconf.csv")
+    with open(islconf, "w") as f:
+        f.write("vm_id,ct_id,dp_id,dp_port,eth_addr,"
+                "rem_ct,rem_id,rem_port,rem_eth_addr\n")
+        # A chain, each datapath uses port ports + 1 towards the next and
+        # ports + 2 towards the previous
+        for dp_id in xrange(1, args.isls + 1):
+            rem_id = dp_id + 1
+            f.write("%x,%d,%x,%d,%s,%d,%x,%d,%s\n" % (
+                vm_id_of(dp_id), dp_id % args.controllers, dp_id,
+                args.ports + 1, mac(dp_id, args.ports + 1),
+                rem_id % args.controllers, rem_id, args.ports + 2,
+                mac(rem_id, args.ports + 2)))
+    return (config, islconf)
+
+def mac(dp_id, port):
+    return "02:%02x:%02x:%02x:%02x:%02x" % ((dp_id >> 24) & 0xff,
+                                           (dp_id >> 16) & 0xff,
+                                           (dp_id >> 8) & 0xff,
+                                           dp_id & 0xff, port & 0xff)
+
+def generate_stream(args):
+    """Returns a list of (channel, from_, msg) bringing up every port, then
+    adding args.routes routes spread over the client ports"""
+    stream = []
+    for dp_id in xrange(1, args.dps + 1):
+        ct_id = dp_id % args.controllers
+        vm_id = vm_id_of(dp_id)
+        for port in xrange(1, args.ports + 1):
+            stream.append((RFSERVER_RFPROXY_CHANNEL, str(ct_id),
+                           DatapathPortRegister(ct_id=ct_id, dp_id=dp_id,
+                                                dp_port=port)))
+            stream.append((RFCLIENT_RFSERVER_CHANNEL, str(vm_id),
+                           PortRegister(vm_id=vm_id, vm_port=port,
+                                        hwaddress=mac(vm_id, port))))
+            stream.append((RFSERVER_RFPROXY_CHANNEL, str(ct_id),
+                           VirtualPlaneMap(vm_id=vm_id, vm_port=port,
+                                           vs_id=1, vs_port=port)))
+        for port in (args.ports + 1, args.ports + 2):
+            stream.append((RFSERVER_RFPROXY_CHANNEL, str(ct_id),
+                           DatapathPortRegister(ct_id=ct_id, dp_id=dp_id,
+                                                dp_port=port)))
+    for i in xrange(args.routes):
+        dp_id = i % args.dps + 1
+        port = (i // args.dps) % args.ports + 1
+        rm = RouteMod(RMT_ADD, vm_id_of(dp_id), port)
+        rm.add_match(Match.IPV4("10.%d.%d.0" % ((i >> 8) & 0xff, i & 0xff),
+                                "255.255.255.0"))
+        rm.add_action(Action.SET_ETH_DST(mac(dp_id, port)))
+        rm.add_option(Option.PRIORITY(PRIORITY_LOW + 24))
+        stream.append((RFCLIENT_RFSERVER_CHANNEL, str(vm_id_of(dp_id)), rm))
+    return stream
+
+def save_stream(stream, path):
+    with open(path, "w") as f:
+        for (channel, from_, msg) in stream:
+            f.write(json.dumps({"channel": channel, "from": from_,
+                                "type": msg.get_type(),
+                                "bson": base64.b64encode(msg.to_bson())}))
+            f.write("\n")
+
+def load_stream(path):
+    factory = RFProtocolFactory()
+    stream = []
+    with open(path) as f:
+        for line in f:
+            record = json.loads(line)
+            msg = factory.build_for_type(record["type"])
+            msg.from_bson(base64.b64decode(record["bson"]))
+            stream.append((str(record["channel"]), str(record["from"]), msg))
+    return stream
+
+def wait_idle(server, ipc):
+    """Waits until every queue between RFServer and the fake IPC is empty"""
+    queues = list(server.shard_qs)
+    if server.coalesce_interval > 0:
+        queues.append(server.coalesce_q)
+    queues.extend(server.dp_qs)
+    while True:
+        for queue in queues:
+            queue.join()
+        for ct_queue in server.ct_queues.values():
+            ct_queue.queue.join()
+        ipc.ack_q.join()
+        if all(queue.unfinished_tasks == 0 for queue in queues):
+            return
+
+def percentiles(samples):
+    samples = sorted(samples)
+    result = {"count": len(samples),
+              "max_ms": round(samples[-1] * 1000, 3)}
+    for p in PERCENTILES:
+        index = min(len(samples) - 1, int(len(samples) * p / 100.0))
+        result["p%d_ms" % p] = round(samples[index] * 1000, 3)
+    return result
+
+def run(args):
+    directory = args.config_dir or tempfile.mkdtemp(prefix="rfbench-")
+    if args.config:
+        (config, islconf) = (args.config, args.islconfig)
+    else:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        (config, islconf) = write_config(args, directory)
+    if args.stream:
+        stream = load_stream(args.stream)
+    else:
+        stream = generate_stream(args)
+    if args.save_stream:
+        save_stream(stream, args.save_stream)
+
+    ipc = CaptureIPC()
+    for_server = IPCService.for_server
+    IPCService.for_server = lambda id_, threading_=None: ipc
+    try:
+        server = BenchServer(config, islconf, "", "", "",
+                             args.shards, args.batch, args.batch_ms / 1000.0,
+                             args.reconcile, args.coalesce_ms / 1000.0,
+                             args.window, args.hwm, args.aggregate_acks)
+    finally:
+        IPCService.for_server = for_server
+        if not args.config_dir:
+            shutil.rmtree(directory)
+    ipc.server = server
+
+    setup = []
+    routes = []
+    for item in stream:
+        if (item[0] == RFCLIENT_RFSERVER_CHANNEL and
+            item[2].get_type() == ROUTE_MOD):
+            routes.append(item)
+        else:
+            setup.append(item)
+
+    start = time.time()
+    for (channel, from_, msg) in setup:
+        server.process(from_, RFSERVER_ID, channel, msg)
+    wait_idle(server, ipc)
+    setup_end = time.time()
+    setup_routemods = ipc.routemods
+    for (channel, from_, msg) in routes:
+        server.process(from_, RFSERVER_ID, channel, msg)
+    wait_idle(server, ipc)
+    end = time.time()
+
+    routes_elapsed = max(end - setup_end, 1e-9)
+    return {
+        "args": vars(args),
+        "messages_in": len(stream),
+        "routemods_in": len(routes),
+        "routemods_out": ipc.routemods,
+        "messages_out": ipc.counts,
+        "elapsed_s": {"setup": round(setup_end - start, 3),
+                      "routes": round(routes_elapsed, 3)},
+        "rates": {
+            "routemods_in_per_s": round(len(routes) / routes_elapsed, 1),
+            "routemods_out_per_s": round((ipc.routemods - setup_routemods) /
+                                         routes_elapsed, 1),
+        },
+        "latency": dict((stage, percentiles(samples)) for (stage, samples)
+                        in server.timings.iteritems()),
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": round(resource.getrusage(
+            resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1),
+    }
+
+def compare(result, baseline, tolerance):
+    """Prints changes from baseline, returns the number of regressions
+    larger than tolerance (a fraction)"""
+    checks = []
+    for (name, value) in result["rates"].iteritems():
+        checks.append((name, baseline["rates"].get(name), value, True))
+    for (stage, stats) in result["latency"].iteritems():
+        old = baseline["latency"].get(stage, {})
+        for p in PERCENTILES:
+            key = "p%d_ms" % p
+            checks.append(("%s %s" % (stage, key), old.get(key), stats[key],
+                           False))
+    checks.append(("peak_rss_mb", baseline.get("peak_rss_mb"),
+                   result["peak_rss_mb"], False))
+
+    regressions = 0
+    for (name, old, new, higher_is_better) in sorted(checks):
+        if not old:
+            continue
+        change = (new - old) / float(old)
+        worse = -change if higher_is_better else change
+        flag = ""
+        if worse > tolerance:
+            flag = "  REGRESSION"
+            regressions += 1
+        print("%-40s %12s %12s %+7.1f%%%s" % (name, old, new, change * 100,
+                                             flag))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='RFServer benchmark')
+    parser.add_argument('--dps', type=int, default=100,
+                        help='number of datapaths')
+    parser.add_argument('--ports', type=int, default=20,
+                        help='client ports per datapath')
+    parser.add_argument('--isls', type=int, default=99,
+                        help='number of ISLs, chaining the datapaths')
+    parser.add_argument('--controllers', type=int, default=1,
+                        help='number of controllers the datapaths are '
+                             'spread over')
+    parser.add_argument('--routes', type=int, default=10000,
+                        help='number of RouteMods sent by clients')
+    parser.add_argument('--config', help='use this config.csv rather than '
+                                         'generating one')
+    parser.add_argument('--islconfig', help='islconf.csv to use with '
+                                            '--config')
+    parser.add_argument('--config-dir', help='keep the generated config.csv '
+                                             'and islconf.csv here')
+    parser.add_argument('--stream', help='replay messages saved with '
+                                         '--save-stream')
+    parser.add_argument('--save-stream', help='save the messages sent')
+    parser.add_argument('-n', '--shards', type=int, default=0)
+    parser.add_argument('-b', '--batch', type=int, default=0)
+    parser.add_argument('--batch-ms', type=float, default=5)
+    parser.add_argument('-r', '--reconcile', action='store_true')
+    parser.add_argument('-c', '--coalesce-ms', type=float, default=0)
+    parser.add_argument('-w', '--window', type=int, default=0)
+    parser.add_argument('--hwm', type=int, default=1000)
+    parser.add_argument('-a', '--aggregate-acks', action='store_true')
+    parser.add_argument('-o', '--output', help='write the results as JSON')
+    parser.add_argument('--baseline', help='compare with results from a '
+                                           'previous run')
+    parser.add_argument('--tolerance', type=float, default=10,
+                        help='percentage change counted as a regression')
+    args = parser.parse_args()
+    if args.isls >= args.dps:
+        parser.error("--isls must be less than --dps")
+    if args.config and not args.islconfig:
+        parser.error("--config needs --islconfig")
+
+    logging.disable(logging.INFO)
+    result = run(args)
+
+    print("%d messages, %d client RouteMods -> %d RouteMods" %
+          (result["messages_in"], result["routemods_in"],
+           result["routemods_out"]))
+    print("setup %.3fs, routes %.3fs, %.0f RouteMods in/s, %.0f out/s, "
+          "peak RSS %.1f MB" %
+          (result["elapsed_s"]["setup"], result["elapsed_s"]["routes"],
+           result["rates"]["routemods_in_per_s"],
+           result["rates"]["routemods_out_per_s"], result["peak_rss_mb"]))
+    for (stage, stats) in sorted(result["latency"].iteritems()):
+        print("%-32s n=%-7d p50=%.3fms p90=%.3fms p99=%.3fms max=%.3fms" %
+              (stage, stats["count"], stats["p50_ms"], stats["p90_ms"],
+               stats["p99_ms"], stats["max_ms"]))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(result, baseline, args.tolerance / 100.0):
+            sys.exit(1)
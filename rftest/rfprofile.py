@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+"""Asks a running rfserver to profile itself.
+
+rfserver samples its worker and IPC threads for the given time, then
+writes collapsed stacks for flamegraph.pl and a report of the translator
+methods to its --profile-dir, and logs where. Sending SIGUSR1 to rfserver
+does the same for its default --profile-seconds.
+
+    PYTHONPATH=. python rftest/rfprofile.py -d 30
+"""
+import sys
+import time
+import argparse
+
+import rflib.ipc.IPCService as IPCService
+from rflib.ipc.RFProtocol import ProfileRequest
+from rflib.defs import RFCLIENT_RFSERVER_CHANNEL, RFSERVER_ID, RFPROFILE_ID
+from ipcbench import DaemonThreading
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Start profiling rfserver')
+    parser.add_argument('-d', '--duration', type=int, default=0,
+                        help='seconds to profile for (0 uses the rfserver '
+                             'default)')
+    args = parser.parse_args()
+
+    ipc = IPCService.for_client(RFPROFILE_ID, DaemonThreading)
+    ipc.send(RFCLIENT_RFSERVER_CHANNEL, RFSERVER_ID,
+             ProfileRequest(duration=args.duration))
+    # Sends are asynchronous, give the IPC threads time to deliver it
+    time.sleep(1)
+    sys.exit(0)
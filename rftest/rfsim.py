@@ -0,0 +1,347 @@
+#!/usr/bin/env python
+"""Simulated rfproxy and RFClient instances for load testing rfserver.
+
+One rfproxy is simulated per controller and one RFClient per VM, each with
+its own ZeroMQ IPC service, so rfserver sees the same peers and framing as
+in a real deployment. The datapaths, ports and ISLs follow rfbench.py, so
+start rfserver with the files written by --write-config:
+
+    python rftest/rfsim.py --dps 100 --ports 20 --write-config /tmp/sim
+    rfserver/rfserver.py /tmp/sim/config.csv -i /tmp/sim/islconf.csv
+    python rftest/rfsim.py --dps 100 --ports 20 --routes 1000000 \\
+        --address tcp://127.0.0.1:25555
+
+The proxies register every datapath port and map it once its client port
+has registered. The clients then stream routes, keeping at most --window
+RouteMods unacknowledged like RFClient. The proxies acknowledge every
+RouteMod or RouteModBatch they receive. Reported latencies run from the
+client sending a route to a proxy receiving the first RouteMod for it, and
+to the client receiving its ack.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'rfserver')]
+
+import rflib.ipc.IPC as IPC
+import rflib.ipc.ZeroMQIPC as ZeroMQIPC
+from rflib.ipc.RFProtocol import *
+from rflib.ipc.RFProtocolFactory import RFProtocolFactory
+from rflib.defs import *
+from rflib.types.Match import *
+from rflib.types.Action import *
+from rflib.types.Option import *
+from rfbench import write_config, vm_id_of, mac, percentiles
+from ipcbench import DaemonThreading
+
+RFVS_ID = (RFVS_PREFIX << 32) | 1
+
+
+def connect(args, id_):
+    return ZeroMQIPC.ZeroMQIPCMessageService(args.address, id_,
+                                             DaemonThreading, False)
+
+def prefix_of(i):
+    return "%d.%d.%d.0" % (1 + (i >> 16), (i >> 8) & 0xff, i & 0xff)
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Route prefix -> time its RouteMod was sent by a client
+        self.sent = {}
+        self.routes_sent = 0
+        self.routes_received = 0
+        self.routemods_received = 0
+        self.acks = 0
+        self.receive_latency = []
+        self.ack_latency = []
+
+    def route_sent(self, prefix):
+        with self.lock:
+            self.sent[prefix] = time.time()
+            self.routes_sent += 1
+
+    def routemod_received(self, rm):
+        now = time.time()
+        prefix = None
+        for match in rm.get_matches():
+            if match['type'] == RFMT_IPV4:
+                prefix = Match.from_dict(match).get_value()[0]
+        with self.lock:
+            self.routemods_received += 1
+            sent = self.sent.pop(prefix, None)
+            if sent is not None:
+                self.routes_received += 1
+                self.receive_latency.append(now - sent)
+
+    def wait_received(self, settle, deadline):
+        """Waits until every route sent has reached a proxy, or none has for
+        settle seconds"""
+        while time.time() < deadline:
+            with self.lock:
+                received = self.routemods_received
+                if self.routes_received >= self.routes_sent:
+                    return
+            time.sleep(settle)
+            with self.lock:
+                if self.routemods_received == received:
+                    return
+
+    def acked(self, latencies):
+        with self.lock:
+            self.acks += len(latencies)
+            self.ack_latency.extend(latencies)
+
+
+class ProxySim(IPC.IPCMessageProcessor):
+    """An rfproxy for one controller"""
+
+    def __init__(self, args, ct_id, dp_ids, stats):
+        self.args = args
+        self.ct_id = ct_id
+        self.dp_ids = dp_ids
+        self.stats = stats
+        self.ipc = connect(args, str(ct_id))
+        self.ipc.listen(RFSERVER_RFPROXY_CHANNEL, RFProtocolFactory(), self,
+                        False)
+
+    def send(self, msg):
+        self.ipc.send(RFSERVER_RFPROXY_CHANNEL, RFSERVER_ID, msg)
+
+    def register_ports(self):
+        for dp_id in self.dp_ids:
+            for port in xrange(1, self.args.ports + 3):
+                self.send(DatapathPortRegister(ct_id=self.ct_id, dp_id=dp_id,
+                                               dp_port=port))
+
+    def map_ports(self):
+        for dp_id in self.dp_ids:
+            for port in xrange(1, self.args.ports + 1):
+                self.send(VirtualPlaneMap(vm_id=vm_id_of(dp_id), vm_port=port,
+                                          vs_id=RFVS_ID,
+                                          vs_port=dp_id * 1000 + port))
+
+    def process(self, from_, to, channel, msg):
+        type_ = msg.get_type()
+        if type_ == ROUTE_MOD:
+            self.stats.routemod_received(msg)
+        elif type_ == ROUTE_MOD_BATCH:
+            for data in msg.get_routemods():
+                rm = RouteMod()
+                rm.from_dict(data)
+                self.stats.routemod_received(rm)
+        else:
+            return
+        self.send(RouteMod())
+
+
+class ClientSim(IPC.IPCMessageProcessor):
+    """An RFClient for one VM, whose ports are those of one datapath"""
+
+    def __init__(self, args, dp_id, stats):
+        self.args = args
+        self.dp_id = dp_id
+        self.vm_id = vm_id_of(dp_id)
+        self.stats = stats
+        self.cond = threading.Condition()
+        self.mapped = set()
+        # vm_port -> send times of RouteMods not yet acknowledged
+        self.outstanding = dict((port, [])
+                                for port in xrange(1, args.ports + 1))
+        self.unacked = 0
+        self.ipc = connect(args, str(self.vm_id))
+        self.ipc.listen(RFCLIENT_RFSERVER_CHANNEL, RFProtocolFactory(), self,
+                        False)
+
+    def send(self, msg):
+        self.ipc.send(RFCLIENT_RFSERVER_CHANNEL, RFSERVER_ID, msg)
+
+    def register_ports(self):
+        for port in xrange(1, self.args.ports + 1):
+            self.send(PortRegister(vm_id=self.vm_id, vm_port=port,
+                                   hwaddress=mac(self.vm_id, port)))
+
+    def wait_mapped(self, deadline):
+        with self.cond:
+            while len(self.mapped) < self.args.ports:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self.cond.wait(remaining)
+        return True
+
+    def process(self, from_, to, channel, msg):
+        if msg.get_type() != PORT_CONFIG:
+            return
+        operation = msg.get_operation_id()
+        port = msg.get_vm_port()
+        with self.cond:
+            if operation == PCT_MAP_SUCCESS:
+                self.mapped.add(port)
+            elif operation == PCT_ROUTEMOD_ACK:
+                now = time.time()
+                times = self.outstanding[port]
+                count = min(max(msg.get_count(), 1), len(times))
+                self.stats.acked([now - t for t in times[:count]])
+                del times[:count]
+                self.unacked -= count
+            self.cond.notify_all()
+
+    def send_routes(self, indexes):
+        for i in indexes:
+            port = i % self.args.ports + 1
+            prefix = prefix_of(i)
+            rm = RouteMod(RMT_ADD, self.vm_id, port)
+            rm.add_match(Match.IPV4(prefix, "255.255.255.0"))
+            rm.add_action(Action.SET_ETH_DST(mac(self.dp_id, port)))
+            rm.add_option(Option.PRIORITY(PRIORITY_LOW + 24))
+            with self.cond:
+                waited = time.time()
+                while self.unacked >= self.args.window:
+                    if time.time() - waited > self.args.timeout:
+                        # rfserver stopped acknowledging, wait_acked fails
+                        return
+                    self.cond.wait(1)
+                self.unacked += 1
+                self.outstanding[port].append(time.time())
+            self.stats.route_sent(prefix)
+            self.send(rm)
+
+    def wait_acked(self, deadline):
+        with self.cond:
+            while self.unacked > 0:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self.cond.wait(remaining)
+        return True
+
+
+def run(args):
+    stats = Stats()
+    dp_ids = range(1, args.dps + 1)
+    proxies = [ProxySim(args, ct_id, [dp_id for dp_id in dp_ids
+                                      if dp_id % args.controllers == ct_id],
+                        stats)
+               for ct_id in xrange(args.controllers)]
+    clients = [ClientSim(args, dp_id, stats) for dp_id in dp_ids]
+
+    start = time.time()
+    for proxy in proxies:
+        proxy.register_ports()
+    for client in clients:
+        client.register_ports()
+    # Ports are only mapped once both sides have registered
+    time.sleep(args.settle)
+    for proxy in proxies:
+        proxy.map_ports()
+    deadline = time.time() + args.timeout
+    if not all(client.wait_mapped(deadline) for client in clients):
+        sys.exit("Timed out waiting for ports to be mapped, is rfserver "
+                 "running with the --write-config files?")
+    mapped = time.time()
+
+    threads = []
+    for (n, client) in enumerate(clients):
+        thread = threading.Thread(target=client.send_routes,
+                                  args=(xrange(n, args.routes, len(clients)),))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    deadline = time.time() + args.timeout
+    complete = all(client.wait_acked(deadline) for client in clients)
+    end = time.time()
+    # RouteMods may still be on their way to the proxies after the acks
+    stats.wait_received(args.settle, time.time() + args.timeout)
+    received = time.time()
+
+    elapsed = max(end - mapped, 1e-9)
+    result = {
+        "args": vars(args),
+        "complete": complete,
+        "elapsed_s": {"setup": round(mapped - start, 3),
+                      "routes": round(elapsed, 3),
+                      "routemods": round(received - mapped, 3)},
+        "routes_sent": stats.routes_sent,
+        "routes_received": stats.routes_received,
+        "routemods_received": stats.routemods_received,
+        "acks": stats.acks,
+        "rates": {"routes_per_s": round(stats.acks / elapsed, 1),
+                  "routemods_per_s": round(stats.routemods_received /
+                                           max(received - mapped, 1e-9), 1)},
+        "latency": {},
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": round(resource.getrusage(
+            resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1),
+    }
+    if stats.receive_latency:
+        result["latency"]["client to proxy"] = \
+            percentiles(stats.receive_latency)
+    if stats.ack_latency:
+        result["latency"]["client to ack"] = percentiles(stats.ack_latency)
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='rfproxy and RFClient '
+                                                 'simulator')
+    parser.add_argument('--address', default=ZEROMQ_ADDRESS,
+                        help='rfserver ZeroMQ address')
+    parser.add_argument('--dps', type=int, default=10,
+                        help='number of datapaths, and of client VMs')
+    parser.add_argument('--ports', type=int, default=4,
+                        help='client ports per datapath')
+    parser.add_argument('--isls', type=int, default=9,
+                        help='number of ISLs, chaining the datapaths')
+    parser.add_argument('--controllers', type=int, default=1,
+                        help='number of controllers the datapaths are '
+                             'spread over')
+    parser.add_argument('--routes', type=int, default=100000,
+                        help='number of routes sent by the clients')
+    parser.add_argument('--window', type=int, default=2,
+                        help='unacknowledged RouteMods per client')
+    parser.add_argument('--settle', type=float, default=1,
+                        help='seconds to wait for rfserver between stages')
+    parser.add_argument('--timeout', type=float, default=60,
+                        help='seconds to wait for mappings and acks')
+    parser.add_argument('--write-config',
+                        help='write config.csv and islconf.csv for rfserver '
+                             'to this directory and exit')
+    parser.add_argument('-o', '--output', help='write the results as JSON')
+    args = parser.parse_args()
+    if args.isls >= args.dps:
+        parser.error("--isls must be less than --dps")
+
+    if args.write_config:
+        if not os.path.isdir(args.write_config):
+            os.makedirs(args.write_config)
+        print("Wrote %s and %s" % write_config(args, args.write_config))
+        sys.exit(0)
+
+    result = run(args)
+    print("%d routes sent, %d acked, %d received by proxies as %d RouteMods"
+          % (result["routes_sent"], result["acks"],
+             result["routes_received"], result["routemods_received"]))
+    print("setup %.3fs, routes %.3fs, %.0f routes/s, %.0f RouteMods/s, "
+          "peak RSS %.1f MB" %
+          (result["elapsed_s"]["setup"], result["elapsed_s"]["routes"],
+           result["rates"]["routes_per_s"],
+           result["rates"]["routemods_per_s"], result["peak_rss_mb"]))
+    for (stage, stats) in sorted(result["latency"].iteritems()):
+        print("%-16s n=%-8d p50=%.3fms p90=%.3fms p99=%.3fms max=%.3fms" %
+              (stage, stats["count"], stats["p50_ms"], stats["p90_ms"],
+               stats["p99_ms"], stats["max_ms"]))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2, sort_keys=True)
+    if not result["complete"]:
+        sys.exit("Timed out waiting for acks")